@@ -3,6 +3,16 @@ ASGI config for mainframe project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve it with an ASGI server, e.g.::
+
+    uvicorn mainframe.asgi:application --workers 2
+
+Long-lived responses such as the live attendance streams
+(``/api/events/<id>/stream/``) are async views; under ASGI each open stream
+is a coroutine rather than a blocked sync worker. Under WSGI (runserver,
+gunicorn) the stream endpoint answers 503 and the member page and event
+modal poll instead; see LIVE_STREAMS in settings.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
  
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -84,7 +85,8 @@ WSGI_APPLICATION = 'mainframe.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        # SQLITE_PATH lets load tests run servers against a scratch database
+        'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
     }
 }
 
@@ -125,7 +127,46 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Rendered badge QR images live in their own on-disk cache. FileBasedCache
+# lists its whole directory on every write (and culls at random once
+# MAX_ENTRIES is reached), all on the request path, so the cache is kept
+# small and each cull drops half of it to make culls rare. Repeat views are
+# answered from the ETag without touching the cache, so a miss only costs a
+# re-render.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'qr': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('QR_CACHE_DIR', BASE_DIR / '.qr_cache'),
+        'OPTIONS': {'MAX_ENTRIES': 2000, 'CULL_FREQUENCY': 2},
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Background jobs go to Celery when a broker is configured and to an
+# in-process thread pool otherwise (see superdb/tasks.py).
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL')
+JOB_BACKEND = os.environ.get('JOB_BACKEND') or ('celery' if CELERY_BROKER_URL else 'thread')
+
+# End-of-event penalties are scheduled by `manage.py run_scheduler`.
+# SCHEDULER_IN_WEB=1 starts the scheduler inside the web server instead,
+# for single-process setups without a separate worker.
+SCHEDULER_IN_WEB = os.environ.get('SCHEDULER_IN_WEB') == '1'
+
+# Live attendance streams (/api/events/<id>/stream/) need ASGI, see
+# mainframe/asgi.py. Left unset they are used only when the request came in
+# through ASGI, and pages poll instead under WSGI; LIVE_STREAMS=0 or 1
+# forces them off or on.
+LIVE_STREAMS = {'0': False, '1': True}.get(os.environ.get('LIVE_STREAMS', ''))
+
+# Badge QR tokens: 'jwt' (HS256) or 'compact' (32-char base32, a much
+# smaller QR, but signed with an HMAC truncated to 56 bits). Deployments
+# opt in to compact with QR_TOKEN_FORMAT=compact. The scanner endpoints
+# accept both formats either way.
+QR_TOKEN_FORMAT = os.environ.get('QR_TOKEN_FORMAT') or 'jwt'
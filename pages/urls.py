@@ -12,6 +12,10 @@ urlpatterns = [
     path('member/', views.member_page, name='member_page'),
     path('scanner/', views.scanner_page, name='scanner_page'),
     path('admin-dashboard/', views.admin_dashboard, name='admin_dashboard'),
+    path('dashboard/users/', views.dashboard_users, name='dashboard_users'),
+    path('dashboard/events/', views.dashboard_events, name='dashboard_events'),
+    path('dashboard/penalties/', views.dashboard_penalties, name='dashboard_penalties'),
+    path('dashboard/groups/', views.dashboard_groups, name='dashboard_groups'),
     path('users/create/', views.user_create, name='user_create'),
     path('users/edit/<int:user_id>/', views.user_edit, name='user_edit'),
     path('users/delete/<int:user_id>/', views.user_delete, name='user_delete'),
@@ -20,6 +24,10 @@ urlpatterns = [
     path('group/delete/<int:user_id>/', views.group_delete, name='group_delete'),
     path('generate_qr/<int:event_id>/<int:user_id>/', views.generate_qr_for_user_event, name='generate_qr'),
     path('bulk_qr/<int:event_id>/zip/', views.bulk_qr_zip, name='bulk_qr_zip'),
+    path('bulk_qr/<int:event_id>/sheets/', views.bulk_qr_sheets, name='bulk_qr_sheets'),
+    path('bulk_qr/<int:event_id>/jobs/', views.bulk_qr_job_start, name='bulk_qr_job_start'),
+    path('bulk_qr/jobs/<int:job_id>/', views.bulk_qr_job_status, name='bulk_qr_job_status'),
+    path('bulk_qr/jobs/<int:job_id>/download/', views.bulk_qr_job_download, name='bulk_qr_job_download'),
     path('check-role/', views.check_role, name='check_role'),
     path('events/create/', views.event_create, name='event_create'),
     path('events/<int:event_id>/edit/', views.event_edit, name='event_edit'),
@@ -38,6 +46,7 @@ urlpatterns = [
     path("penalty/pardon/<int:user_id>/", views.penalty_pardon),
     path("penalty/ban/<int:user_id>/", views.penalty_ban),
     path('logs/', views.get_logs, name='get_logs'),
+    path('scheduler/metrics/', views.scheduler_metrics, name='scheduler_metrics'),
     path('updater/', views.update_server),
     path('run-backup/', views.auto_backup),
 ]
@@ -1,23 +1,30 @@
 # views.py
 from django.db.models import Q
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth import authenticate, login, logout
 from django.contrib import messages
-from superdb.models import User, Event, Penalty, Graup, Attendance, Log
-from superdb.utils import make_qr_payload, timezone
+from superdb.models import User, Event, Penalty, Graup, Attendance, Log, BadgeArchive, SchedulerRun
+from superdb.utils import timezone
 from django.contrib.auth.decorators import login_required, user_passes_test
 from superdb.forms import AdminUserForm, EventForm, GraupForm
-from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
-import qrcode
-from io import BytesIO
-import zipfile
+from django.http import FileResponse, HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.formats import date_format
+from django.core.exceptions import ValidationError
 from datetime import timedelta
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 import json
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from superdb.scheduler import apply_no_show_penalties
+from superdb.penalties import claim_no_show_penalties
+from superdb.scheduler import schedule_event_end, unschedule_event_end
+from superdb.live import record_checkins, record_undo, streams_enabled
+from superdb.badges import stream_badge_zip, stream_badge_pdf, badge_image, badge_version, badge_roster, badge_window, roster_key, BADGE_FORMATS
+from superdb.tasks import enqueue, build_badge_archive
+from django.utils.cache import get_conditional_response, patch_cache_control
 import os
+import time
 import subprocess# You might need to pip install gitpython, or use subprocess
 
 # SECURITY WARNING: Ideally, check for a secret token here!
@@ -242,6 +249,7 @@ def member_page(request):
             'ongoing': False,
         }
 
+    context['live_stream'] = streams_enabled(request)
     return render(request, 'member_page.html', context)
 
 @login_required
@@ -260,47 +268,323 @@ def generate_qr_for_user_event(request, event_id, user_id):
     if not (is_admin or request.user.id == user.id):
         return HttpResponseForbidden("Not allowed")
 
-    # ✅ generate token
-    token = make_qr_payload(event.id, user.id)
-
-    # ✅ generate QR image
-    img = qrcode.make(token)
-    buf = BytesIO()
-    img.save(buf, format='PNG')
-    buf.seek(0)
-
-    return HttpResponse(buf.read(), content_type="image/png")
+    # ?format=svg gives a vector badge; PNG otherwise
+    fmt = 'svg' if request.GET.get('format') == 'svg' else 'png'
+    now = time.time()  # one window for both the etag and the image
+    _, etag, fresh_for = badge_version(event.id, user.id, fmt, now)
+
+    # a revalidation is answered before the image cache is even read
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        data, etag, fresh_for = badge_image(event.id, user.id, fmt, now)
+        response = HttpResponse(data, content_type=BADGE_FORMATS[fmt])
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, max_age=fresh_for)
+    return response
 
 # bulk QR zip
 @login_required
 @user_passes_test(is_admin)
 def bulk_qr_zip(request, event_id):
     event = get_object_or_404(Event, pk=event_id)
-    users = User.objects.filter(role='member')
-    zip_buf = BytesIO()
-    with zipfile.ZipFile(zip_buf, 'w') as zf:
-        for u in users:
-            token = make_qr_payload(event.id, u.id)
-            img = qrcode.make(token)
-            img_buf = BytesIO()
-            img.save(img_buf, format='PNG')
-            img_buf.seek(0)
-            zf.writestr(f'{u.username}_event{event.id}.png', img_buf.getvalue())
-    zip_buf.seek(0)
-    response = HttpResponse(zip_buf.getvalue(), content_type='application/zip')
+    # ?scope=assigned limits the download to the event's assigned users
+    scope = 'assigned' if request.GET.get('scope') == 'assigned' else 'members'
+    members = badge_roster(event, scope)
+    response = StreamingHttpResponse(stream_badge_zip(event.id, members), content_type='application/zip')
     response['Content-Disposition'] = f'attachment; filename=event_{event.id}_qrs.zip'
     return response
 
-# admin dashboard - simple
+# printable badge sheets: one PDF, cols x rows badges per page
+@login_required
+@user_passes_test(is_admin)
+def bulk_qr_sheets(request, event_id):
+    event = get_object_or_404(Event, pk=event_id)
+    scope = 'assigned' if request.GET.get('scope') == 'assigned' else 'members'
+    try:
+        cols = min(max(int(request.GET.get('cols', 3)), 1), 6)
+        rows = min(max(int(request.GET.get('rows', 4)), 1), 8)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'cols and rows must be numbers'}, status=400)
+    members = badge_roster(event, scope, fields=('id', 'username', 'displayname', 'graup__name'))
+    response = StreamingHttpResponse(stream_badge_pdf(event.id, members, cols, rows), content_type='application/pdf')
+    response['Content-Disposition'] = f'inline; filename=event_{event.id}_badges.pdf'
+    return response
+
+# bulk QR as a background job: start (or reuse) a build, poll it, download it
+BADGE_JOB_TIMEOUT = timedelta(hours=1)  # a build this old without finishing is presumed dead
+
+def badge_archive_json(archive):
+    return {
+        'success': True,
+        'id': archive.id,
+        'status': archive.status,
+        'done': archive.done,
+        'total': archive.total,
+        'error': archive.error or None,
+        'download_url': reverse('bulk_qr_job_download', args=[archive.id]) if archive.status == 'done' else None,
+    }
+
+@login_required
+@user_passes_test(is_admin)
+@require_http_methods(["POST"])
+def bulk_qr_job_start(request, event_id):
+    event = get_object_or_404(Event, pk=event_id)
+    scope = 'assigned' if request.GET.get('scope') == 'assigned' else 'members'
+    window = badge_window()
+    members = badge_roster(event, scope)
+    key = roster_key(event.id, scope, members, window)
+
+    # same roster, same token window: the existing archive is still right
+    archive = (BadgeArchive.objects
+               .filter(event=event, scope=scope, roster_key=key)
+               .exclude(status='failed')
+               .order_by('-id')
+               .first())
+    if archive is not None:
+        if archive.status == 'done' and not os.path.exists(archive.path):
+            archive = None
+        elif archive.status != 'done' and archive.created_at < timezone.now() - BADGE_JOB_TIMEOUT:
+            archive = None
+    if archive is None:
+        archive = BadgeArchive.objects.create(event=event, scope=scope, roster_key=key, total=len(members), requested_by=request.user)
+        enqueue(build_badge_archive, archive.id, window)
+        archive.refresh_from_db()
+
+    return JsonResponse(badge_archive_json(archive))
+
+@login_required
+@user_passes_test(is_admin)
+@require_http_methods(["GET"])
+def bulk_qr_job_status(request, job_id):
+    return JsonResponse(badge_archive_json(get_object_or_404(BadgeArchive, pk=job_id)))
+
+@login_required
+@user_passes_test(is_admin)
+@require_http_methods(["GET"])
+def bulk_qr_job_download(request, job_id):
+    archive = get_object_or_404(BadgeArchive, pk=job_id, status='done')
+    if not os.path.exists(archive.path):
+        return JsonResponse({'success': False, 'error': 'Archive is gone, start a new one'}, status=410)
+    return FileResponse(open(archive.path, 'rb'), as_attachment=True, filename=f'event_{archive.event_id}_qrs.zip', content_type='application/zip')
+
+# scheduler runs recorded by superdb.instrumentation, for sizing the interval
+SCHEDULER_METRICS_MAX_RUNS = 200
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+@login_required
+@user_passes_test(is_admin)
+@require_http_methods(["GET"])
+def scheduler_metrics(request):
+    try:
+        hours = max(1, int(request.GET.get('hours', 24)))
+        limit = min(SCHEDULER_METRICS_MAX_RUNS, max(1, int(request.GET.get('limit', 50))))
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'hours and limit must be numbers'}, status=400)
+
+    now = timezone.now()
+    runs = SchedulerRun.objects.filter(started_at__gte=now - timedelta(hours=hours))
+    if request.GET.get('kind') in ('catch_up', 'event_end'):
+        runs = runs.filter(kind=request.GET['kind'])
+    fields = ('kind', 'started_at', 'duration_ms', 'events', 'penalties', 'failed', 'queries',
+              'apply_ms', 'max_lag_s', 'mean_lag_s', 'budget_exhausted')
+    rows = list(runs.values(*fields))
+
+    durations = [row['duration_ms'] for row in rows]
+    lags = [row['max_lag_s'] for row in rows if row['max_lag_s'] is not None]
+    events = sum(row['events'] for row in rows)
+    oldest_pending = (Event.objects
+                      .filter(end_time__lt=now, penalties_processed=False)
+                      .order_by('end_time')
+                      .values_list('end_time', flat=True)
+                      .first())
+
+    return JsonResponse({
+        'success': True,
+        'window_hours': hours,
+        'summary': {
+            'runs': len(rows),
+            'events': events,
+            'penalties': sum(row['penalties'] for row in rows),
+            'failed': sum(row['failed'] for row in rows),
+            'budget_exhausted': sum(row['budget_exhausted'] for row in rows),
+            'duration_ms_p50': _percentile(durations, 0.5),
+            'duration_ms_p95': _percentile(durations, 0.95),
+            'duration_ms_max': max(durations, default=None),
+            'queries_per_event': round(sum(row['queries'] for row in rows) / events, 2) if events else None,
+            'lag_s_p95': _percentile(lags, 0.95),
+            'lag_s_max': max(lags, default=None),
+        },
+        'backlog': {
+            'events': Event.objects.filter(end_time__lt=now, penalties_processed=False).count(),
+            'oldest_lag_s': round((now - oldest_pending).total_seconds(), 3) if oldest_pending else None,
+        },
+        'runs': rows[:limit],
+    })
+
+# admin dashboard: the page is a shell and its lists come from the dashboard_*
+# views a page at a time. Pages are keyset-paginated on each list's order, so
+# the hundredth page costs what the first does.
+DASHBOARD_PAGE_SIZE = 50
+DASHBOARD_MAX_PAGE_SIZE = 200
+
 @login_required
 @user_passes_test(is_admin)
 def admin_dashboard(request):
-    users = User.objects.all().order_by('-username')
-    events = Event.objects.all().order_by('-start_time')
-    penalty_history = Penalty.objects.all().order_by('-created_at')
-    groups = Graup.objects.all().order_by('-name')
-    return render(request, 'admin_dashboard.html', {'users': users, 'events': events, 'penalty_history': penalty_history, 'groups': groups
-        })
+    return render(request, 'admin_dashboard.html', {'live_stream': streams_enabled(request)})
+
+def _encode_cursor(values):
+    raw = json.dumps(values, default=lambda value: value.isoformat())  # isoformat keeps microseconds
+    return urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def _decode_cursor(model, order, cursor):
+    values = json.loads(urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    if not isinstance(values, list) or len(values) != len(order):
+        raise ValueError("wrong cursor shape")
+    try:
+        return [model._meta.get_field(field.lstrip('-')).to_python(value) for field, value in zip(order, values)]
+    except ValidationError as e:
+        raise ValueError(e.messages) from e
+
+def _after(order, values):
+    """Q for the rows that come after `values` in `order`, e.g. ('-start_time', '-id')."""
+    condition = None
+    for field, value in reversed(list(zip(order, values))):
+        name = field.lstrip('-')
+        beyond = Q(**{f"{name}__{'lt' if field.startswith('-') else 'gt'}": value})
+        condition = beyond if condition is None else beyond | (Q(**{name: value}) & condition)
+    return condition
+
+def _dashboard_page(request, queryset, order, fields, serialize):
+    """One page of `queryset` in `order` (which must be unique), after ?after= and up to ?limit=."""
+    try:
+        limit = min(DASHBOARD_MAX_PAGE_SIZE, max(1, int(request.GET.get('limit', DASHBOARD_PAGE_SIZE))))
+        if request.GET.get('after'):
+            queryset = queryset.filter(_after(order, _decode_cursor(queryset.model, order, request.GET['after'])))
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'limit must be a number and after a cursor from this list'}, status=400)
+
+    keys = [field.lstrip('-') for field in order]
+    rows = list(queryset.order_by(*order).values(*dict.fromkeys((*fields, *keys)))[:limit + 1])
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return JsonResponse({
+        'success': True,
+        'results': [serialize(row) for row in rows],
+        'next': _encode_cursor([rows[-1][key] for key in keys]) if more else None,
+    })
+
+def _display_time(value, format='DATETIME_FORMAT'):
+    return date_format(timezone.localtime(value), format)
+
+@login_required
+@user_passes_test(is_admin)
+@require_http_methods(["GET"])
+def dashboard_users(request):
+    users = User.objects.all()
+    if not (request.GET.get('include_core') and request.user.role == 'core'):
+        users = users.exclude(role='core')
+    if request.GET.get('q'):
+        users = users.filter(Q(username__icontains=request.GET['q']) | Q(displayname__icontains=request.GET['q']))
+    if request.GET.get('role'):
+        users = users.filter(role=request.GET['role'])
+    if request.GET.get('penalty') == 'penalized':
+        users = users.exclude(penalty_status='ok')
+    elif request.GET.get('penalty'):
+        users = users.filter(penalty_status=request.GET['penalty'])
+    if request.GET.get('group'):
+        users = users.filter(graup__name=request.GET['group'])
+    if request.GET.get('ids_only'):
+        # every match, unpaged, for "Select All" in the assign modal
+        return JsonResponse({'success': True, 'ids': list(users.values_list('id', flat=True))})
+
+    manages_admins = request.user.role in ('admin', 'core')
+
+    def serialize(row):
+        return {
+            'id': row['id'],
+            'username': row['username'],
+            'displayname': row['displayname'],
+            'role': row['role'],
+            'penalty_status': row['penalty_status'],
+            'group': row['graup__name'],
+            'can_manage': row['role'] in ('member', 'scanner', 'moderator') or (row['role'] == 'admin' and manages_admins),
+        }
+
+    fields = ('id', 'username', 'displayname', 'role', 'penalty_status', 'graup__name')
+    return _dashboard_page(request, users, ('-username',), fields, serialize)
+
+@login_required
+@user_passes_test(is_admin)
+@require_http_methods(["GET"])
+def dashboard_events(request):
+    now = timezone.now()
+    events = Event.objects.all()
+    if request.GET.get('q'):
+        events = events.filter(title__icontains=request.GET['q'])
+    status = request.GET.get('status')
+    if status == 'planned':
+        events = events.filter(start_time__gt=now)
+    elif status == 'ongoing':
+        events = events.filter(start_time__lte=now, end_time__gte=now)
+    elif status == 'ended':
+        events = events.filter(end_time__lt=now)
+
+    def serialize(row):
+        if row['start_time'] > now:
+            status = 'planned'
+        elif row['end_time'] >= now:
+            status = 'ongoing'
+        else:
+            status = 'ended'
+        return {
+            'id': row['id'],
+            'title': row['title'],
+            'status': status,
+            'start_time': _display_time(row['start_time']),
+            'end_time': _display_time(row['end_time']),
+            'created_by': row['created_by__displayname'],
+        }
+
+    fields = ('id', 'title', 'start_time', 'end_time', 'created_by__displayname')
+    return _dashboard_page(request, events, ('-start_time', '-id'), fields, serialize)
+
+@login_required
+@user_passes_test(is_admin)
+@require_http_methods(["GET"])
+def dashboard_penalties(request):
+    penalties = Penalty.objects.all()
+    if request.GET.get('q'):
+        penalties = penalties.filter(user__username__icontains=request.GET['q'])
+    if request.GET.get('type'):
+        penalties = penalties.filter(type=request.GET['type'])
+
+    def serialize(row):
+        return {
+            'id': row['id'],
+            'type': row['type'],
+            'reason': row['reason'],
+            'timestamp': _display_time(row['created_at'], 'M d, Y g:i A'),
+            'username': row['user__username'],
+            'displayname': row['user__displayname'],
+            'by': 'System' if row['admin__role'] == 'core' else row['admin__displayname'] or '',
+        }
+
+    fields = ('id', 'type', 'reason', 'created_at', 'user__username', 'user__displayname', 'admin__role', 'admin__displayname')
+    return _dashboard_page(request, penalties, ('-created_at', '-id'), fields, serialize)
+
+@login_required
+@user_passes_test(is_admin)
+@require_http_methods(["GET"])
+def dashboard_groups(request):
+    groups = Graup.objects.all()
+    if request.GET.get('q'):
+        groups = groups.filter(name__icontains=request.GET['q'])
+    return _dashboard_page(request, groups, ('-name',), ('id', 'name'), lambda row: {'id': row['id'], 'name': row['name']})
 
 # CRUD user (admin)
 @login_required
@@ -431,6 +715,7 @@ def event_create(request):
             event = form.save(commit=False)
             event.created_by = request.user
             event.save()
+            schedule_event_end(event)
             Log.log(
                 action='event_create',
                 user=request.user,
@@ -454,6 +739,7 @@ def event_edit(request, event_id):
         form = EventForm(request.POST, instance=event)
         if form.is_valid():
             form.save()
+            schedule_event_end(event)
             Log.log(
                 action='event_edit',
                 user=request.user,
@@ -474,6 +760,7 @@ def event_delete(request, event_id):
     event = get_object_or_404(Event, pk=event_id)
     if request.method == 'POST':
         title = event.title
+        unschedule_event_end(event.id)
         event.delete()
         Log.log(
             action='event_delete',
@@ -783,6 +1070,7 @@ def checkin_user(request, event_id, user_id):
         scanner=scanner,
         banned_snapshot=(user.penalty_status == 'banned')
     )
+    record_checkins([attendance])
     
     Log.log(
         action='checkin',
@@ -826,6 +1114,7 @@ def undo_checkin(request, event_id, user_id):
         ip_address=get_client_ip(request)
     )
     attendance.delete()
+    record_undo(event.id, user.id)
     
     return JsonResponse({'success': True})
 
@@ -851,6 +1140,7 @@ def bulk_checkin(request, event_id):
     
     scanner = request.user if request.user.is_authenticated else None
     count = 0
+    created = []
     
     for user_id in user_ids:
         try:
@@ -862,80 +1152,20 @@ def bulk_checkin(request, event_id):
             if Attendance.objects.filter(event=event, user=user).exists():
                 continue
             
-            Attendance.objects.create(
+            created.append(Attendance.objects.create(
                 event=event,
                 user=user,
                 scanner=scanner,
                 banned_snapshot=(user.penalty_status == 'banned')
-            )
+            ))
             count += 1
         except User.DoesNotExist:
             continue
     
+    record_checkins(created)
     return JsonResponse({'success': True, 'count': count})
 
 
-def apply_no_show_penalties(event):
-    """
-    Apply penalties to all assigned users who didn't check in to an event.
-    Call this when an event ends.
-    Penalties are marked as given by the SYSTEM user.
-    """
-    # Get or create the SYSTEM user
-    system_user, created = User.objects.get_or_create(
-        username='whatisasystem',
-        defaults={
-            'displayname': 'SYSTEM',
-            'role': 'core',
-            'password': 'D@kn1r_12'  # Not a real login
-        }
-    )
-    
-    # Get all assigned users
-    assigned_users = event.assigned_users.all()
-    
-    # Get users who checked in
-    checked_in_user_ids = event.attendances.values_list('user_id', flat=True)
-    
-    # Find users who didn't check in
-    no_show_users = assigned_users.exclude(id__in=checked_in_user_ids)
-    
-    penalties_added = 0
-    
-    for user in no_show_users:
-        # Skip if user is already banned
-        if user.penalty_status == 'banned':
-            continue
-        
-        # Skip the SYSTEM user itself
-        if user.username == 'whatisasystem':
-            continue
-        
-        # Create penalty record
-        Penalty.objects.create(
-            user=user,
-            type='add',
-            reason=f"Failed to check in during the event ({event.title})",
-            admin=system_user,
-            active=True,
-            previouslevel=user.penalty_level
-        )
-        
-        # Update user's penalty level and status
-        user.penalty_level += 1
-        
-        # Update status based on penalty level (customize thresholds as needed)
-        if user.penalty_level >= 3:  # 3+ penalties = banned
-            user.penalty_status = 'banned'
-        elif user.penalty_level >= 1:  # 1-2 penalties = warned
-            user.penalty_status = 'warned'
-        
-        user.save()
-        penalties_added += 1
-    
-    return penalties_added, no_show_users.count()
-
-
 @require_http_methods(["POST"])
 def end_event_and_penalize(request, event_id):
     """Manually end an event and apply penalties to no-shows"""
@@ -947,12 +1177,14 @@ def end_event_and_penalize(request, event_id):
     if request.user.role not in ['admin', 'core']:
         return JsonResponse({'success': False, 'error': 'Permission denied'})
     
+    # Claimed like the scheduler's end-of-event job, so ending an event
+    # twice, or after that job ran, never penalises anyone a second time.
     # Uses SYSTEM user automatically
-    penalties_added, total_no_shows = apply_no_show_penalties(event)
-    
-    # Mark as processed
-    event.penalties_processed = True
-    event.save()
+    result = claim_no_show_penalties(event)
+    if result is None:
+        return JsonResponse({'success': False, 'error': 'Penalties for this event were already processed'}, status=409)
+    penalties_added, total_no_shows = result
+    schedule_event_end(event)  # drops the now pointless end-of-event job
 
     Log.log(
         action='event_end',
@@ -988,10 +1220,8 @@ def event_details(request, event_id):
         status = 'ended'
         
         # Auto-apply penalties if not processed yet
-        if hasattr(event, 'penalties_processed') and not event.penalties_processed:
-            apply_no_show_penalties(event)
-            event.penalties_processed = True
-            event.save()
+        if not event.penalties_processed:
+            claim_no_show_penalties(event)
     
     assigned_users = event.assigned_users.all()
     attendances = {a.user_id: a for a in event.attendances.select_related('scanner').all()}
@@ -1,6 +1,6 @@
 # superdb/admin.py
 from django.contrib import admin
-from .models import User, Graup, Event, Attendance, Penalty
+from .models import User, Graup, Event, Attendance, Penalty, ScanReceipt, SchedulerRun, ImportJob
 from django.contrib.auth.admin import UserAdmin as DefaultUserAdmin
 
 @admin.register(Graup)
@@ -39,3 +39,19 @@ class AttendanceAdmin(admin.ModelAdmin):
 class PenaltyAdmin(admin.ModelAdmin):
     list_display = ('user', 'reason', 'admin', 'active', 'created_at')
     list_filter = ('active', 'created_at')
+
+@admin.register(ScanReceipt)
+class ScanReceiptAdmin(admin.ModelAdmin):
+    list_display = ('scan_id', 'scanner', 'scanned_at', 'status', 'created_at')
+    list_filter = ('status', 'created_at')
+
+@admin.register(SchedulerRun)
+class SchedulerRunAdmin(admin.ModelAdmin):
+    list_display = ('started_at', 'kind', 'duration_ms', 'events', 'penalties', 'failed', 'queries', 'max_lag_s', 'budget_exhausted')
+    list_filter = ('kind', 'budget_exhausted', 'started_at')
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'status', 'role', 'processed', 'total', 'created', 'updated', 'skipped', 'requested_by')
+    list_filter = ('status', 'created_at')
+
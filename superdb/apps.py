@@ -8,6 +8,12 @@ class SuperdbConfig(AppConfig):
     def ready(self):
         import os
         import sys
+        from django.conf import settings
+
+        # The scheduler normally lives in `manage.py run_scheduler`; web
+        # processes only start one for single-process setups that ask for it
+        if not getattr(settings, 'SCHEDULER_IN_WEB', False):
+            return
         
         # Check if running a server
         argv_str = ' '.join(sys.argv)
@@ -20,7 +26,7 @@ class SuperdbConfig(AppConfig):
         if not is_server:
             return
         
-        # Always try to start - the scheduler itself prevents double-start
+        # Always try to start - only the process holding the leader lock runs it
         try:
             from superdb import scheduler
             scheduler.start_scheduler()
@@ -0,0 +1,357 @@
+# superdb/badges.py
+"""
+Badge QR rendering.
+
+Single badges are minted once per validity window and the rendered image
+is kept in the 'qr' cache (on disk by default), addressed by a digest of
+the token, so reopening the member page costs a cache read. For the bulk
+download, PNG encoding is pure CPU, so badges are rendered in a shared
+process pool and the ZIP is written to the response as each entry comes
+back instead of being assembled in memory first; large rosters can be
+built ahead of time as a BadgeArchive (see tasks.build_badge_archive).
+"""
+import hashlib
+import os
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+
+import qrcode
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone as dj_timezone
+
+from .models import User, BadgeArchive
+from .pdf import PdfStream, pdf_string, text_width
+from .utils import make_qr_token, QR_VALID_FOR_SECONDS, QR_TOKEN_FORMAT
+
+# 0 or 1 renders in the request thread; tests and single-core hosts use that
+QR_RENDER_WORKERS = getattr(settings, 'QR_RENDER_WORKERS', os.cpu_count() or 1)
+# renders in flight per worker; bounds memory when the client reads slowly
+QR_RENDER_WINDOW = 8
+
+# Prebuilt bulk downloads, see build_badge_archive and prune_badge_archives
+BADGE_ARCHIVE_DIR = getattr(settings, 'BADGE_ARCHIVE_DIR', os.path.join(settings.BASE_DIR, '.badge_archives'))
+PROGRESS_EVERY = 50  # badges between progress writes
+
+# A badge minted at the start of a window is reused until the window ends,
+# so every token handed out still has at least half its validity left.
+QR_CACHE_WINDOW = QR_VALID_FOR_SECONDS // 2
+
+BADGE_FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+_pool = None
+
+
+def render_qr_png(token):
+    buf = BytesIO()
+    qrcode.make(token).save(buf, format='PNG')
+    return buf.getvalue()
+
+
+def qr_runs(token):
+    """
+    The QR matrix (quiet zone included) as runs of dark modules:
+    (size, [(x, y, length), ...]). Shared by the SVG and PDF renderers.
+    """
+    qr = qrcode.QRCode()
+    qr.add_data(token)
+    qr.make(fit=True)
+    matrix = qr.get_matrix()
+    size = len(matrix)
+    runs = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < size:
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < size and row[x]:
+                x += 1
+            runs.append((start, y, x - start))
+    return size, runs
+
+
+def render_qr_svg(token):
+    """
+    One <path> with a subpath per run of dark modules. No Pillow involved,
+    and it scales to any print size.
+    """
+    size, runs = qr_runs(token)
+    path = ''.join(f'M{x} {y}h{n}v1h-{n}z' for x, y, n in runs)
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="#fff"/><path d="{path}"/></svg>'
+    ).encode()
+
+
+def render_qr_pdf_ops(token):
+    """
+    PDF path operators filling the dark modules in a unit-per-module,
+    y-down space; the sheet layout scales and places them.
+    """
+    size, runs = qr_runs(token)
+    return size, b''.join(b'%d %d %d 1 re\n' % run for run in runs)
+
+
+RENDERERS = {
+    'png': render_qr_png,
+    'svg': render_qr_svg,
+}
+
+
+def badge_window(now=None):
+    """Start of the current badge window, as a unix timestamp."""
+    now = int(now if now is not None else time.time())
+    return now - now % QR_CACHE_WINDOW
+
+
+def badge_version(event_id, user_id, fmt='png', now=None):
+    """
+    Return (token, etag, seconds the badge stays current) without touching
+    the image cache, so a conditional request can be answered first.
+    """
+    now = int(now if now is not None else time.time())
+    window_start = badge_window(now)
+    token = make_qr_token(event_id, user_id, issued_at=datetime.fromtimestamp(window_start, timezone.utc))
+    key = hashlib.sha256(f'{fmt}:{token}'.encode()).hexdigest()
+    return token, f'"{key}"', window_start + QR_CACHE_WINDOW - now
+
+
+def badge_image(event_id, user_id, fmt='png', now=None):
+    """
+    Return (image bytes, etag, seconds the image stays current) for one
+    badge, rendering it only if the cache has nothing for this window.
+    """
+    token, etag, fresh_for = badge_version(event_id, user_id, fmt, now)
+    key = etag.strip('"')
+
+    cache = caches['qr']
+    data = cache.get(key)
+    if data is None:
+        data = RENDERERS[fmt](token)
+        cache.set(key, data, timeout=fresh_for)
+    return data, etag, fresh_for
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=QR_RENDER_WORKERS)
+    return _pool
+
+
+def render_many(tokens, workers=None, render=None):
+    """Yield render(token) for each token (PNG by default), in order, rendering ahead in the pool."""
+    workers = QR_RENDER_WORKERS if workers is None else workers
+    render = render or render_qr_png
+    if workers <= 1:
+        for token in tokens:
+            yield render(token)
+        return
+
+    pool = get_pool()
+    pending = deque()
+    try:
+        for token in tokens:
+            pending.append(pool.submit(render, token))
+            if len(pending) >= workers * QR_RENDER_WINDOW:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # client went away: drop whatever has not started yet
+        for future in pending:
+            future.cancel()
+
+
+class ZipStream:
+    """Write-only sink for zipfile that hands back what was written so far."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def badge_roster(event, scope='members', fields=('id', 'username')):
+    """Rows of `fields` for everyone getting a badge, in id order."""
+    if scope == 'assigned':
+        users = event.assigned_users.all()
+    else:
+        users = User.objects.filter(role='member')
+    return list(users.order_by('id').values_list(*fields))
+
+
+def roster_key(event_id, scope, members, window_start):
+    """Identifies an archive's contents; any roster change gives a new key."""
+    digest = hashlib.sha256(f'{event_id}:{scope}:{window_start}:{QR_TOKEN_FORMAT}'.encode())
+    for user_id, username in members:
+        digest.update(f'\n{user_id}:{username}'.encode())
+    return digest.hexdigest()
+
+
+def stream_badge_zip(event_id, members, workers=None, issued_at=None):
+    """
+    Yield a ZIP of badge PNGs chunk by chunk. `members` is a list of
+    (user_id, username) pairs; tokens are minted as the pool needs them.
+    """
+    sink = ZipStream()
+    # no seek/tell on the sink, so zipfile writes data descriptors instead
+    # of going back to patch each local header
+    with zipfile.ZipFile(sink, 'w') as zf:
+        tokens = (make_qr_token(event_id, user_id, issued_at=issued_at) for user_id, _ in members)
+        for (_, username), png in zip(members, render_many(tokens, workers)):
+            # PNG is already deflated; storing it keeps this cheap
+            zf.writestr(f'{username}_event{event_id}.png', png)
+            yield sink.drain()
+    yield sink.drain()
+
+
+def build_badge_archive(archive, members, window_start, workers=None):
+    """
+    Write the archive's ZIP under BADGE_ARCHIVE_DIR, recording progress on
+    the row as it goes. Tokens are minted for `window_start`, so the
+    download stays valid for as long as the archive can be reused.
+    """
+    os.makedirs(BADGE_ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(BADGE_ARCHIVE_DIR, f'event{archive.event_id}_{archive.roster_key[:16]}.zip')
+    partial = f'{path}.{archive.id}.part'
+    issued_at = datetime.fromtimestamp(window_start, timezone.utc)
+
+    BadgeArchive.objects.filter(pk=archive.pk).update(status='running', total=len(members))
+    written = 0
+    try:
+        with open(partial, 'wb') as out:
+            # every chunk but the last closes one ZIP entry
+            for chunk in stream_badge_zip(archive.event_id, members, workers, issued_at):
+                out.write(chunk)
+                written += 1
+                if written % PROGRESS_EVERY == 0:
+                    BadgeArchive.objects.filter(pk=archive.pk).update(done=min(written, len(members)))
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+    archive.status, archive.done, archive.total, archive.path = 'done', len(members), len(members), path
+    archive.finished_at = dj_timezone.now()
+    archive.save(update_fields=['status', 'done', 'total', 'path', 'finished_at'])
+
+    # a finished archive supersedes the older ones for the same event and
+    # scope; builds still in flight are left to supersede this one
+    older = (BadgeArchive.objects
+             .filter(event_id=archive.event_id, scope=archive.scope, id__lt=archive.id)
+             .exclude(status__in=('queued', 'running')))
+    for stale in older.exclude(path=path).exclude(path='').values_list('path', flat=True):
+        _remove(stale)
+    older.delete()
+    return archive
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def prune_badge_archives(now=None):
+    """
+    Drop archives whose tokens have expired, then delete every file under
+    BADGE_ARCHIVE_DIR that no remaining archive points at. Returns how many
+    files went.
+    """
+    now = now or dj_timezone.now()
+    # tokens are minted for a window that starts before the row is created
+    BadgeArchive.objects.filter(created_at__lt=now - timedelta(seconds=QR_VALID_FOR_SECONDS)).delete()
+    if not os.path.isdir(BADGE_ARCHIVE_DIR):
+        return 0
+
+    keep = {os.path.basename(path) for path in BadgeArchive.objects.filter(status='done').values_list('path', flat=True)}
+    building = {str(pk) for pk in BadgeArchive.objects.filter(status__in=('queued', 'running')).values_list('id', flat=True)}
+    removed = 0
+    for entry in os.scandir(BADGE_ARCHIVE_DIR):
+        if not entry.is_file() or entry.name in keep:
+            continue
+        # partial files are named <archive>.zip.<id>.part
+        if entry.name.endswith('.part') and entry.name.rsplit('.', 2)[-2] in building:
+            continue
+        _remove(entry.path)
+        removed += 1
+    return removed
+
+
+SHEET_MARGIN = 28  # points around the grid
+SHEET_LABEL = 30  # points under each QR for name and group
+
+
+def fit_label(text, size, width):
+    while text and text_width(text, size) > width:
+        text = text[:-2] + '…' if len(text) > 2 else ''
+    return text
+
+
+def badge_cell(x, y, width, height, qr, name, group):
+    """Operators for one badge whose cell has its lower-left corner at x, y."""
+    size, ops = qr
+    side = min(width, height - SHEET_LABEL) - 12
+    scale = side / size
+    left = x + (width - side) / 2
+    top = y + height - 6
+    name = fit_label(name, 10, width - 8)
+    group = fit_label(group, 8, width - 8)
+    return b''.join([
+        b'0.85 G 0.5 w %.2f %.2f %.2f %.2f re S\n' % (x, y, width, height),  # cut guide
+        b'q %.4f 0 0 %.4f %.2f %.2f cm\n' % (scale, -scale, left, top),
+        ops,
+        b'f Q\n',
+        b'BT /F2 10 Tf %.2f %.2f Td %s Tj ET\n' % (x + (width - text_width(name, 10)) / 2, y + 16, pdf_string(name)),
+        b'BT /F1 8 Tf %.2f %.2f Td %s Tj ET\n' % (x + (width - text_width(group, 8)) / 2, y + 6, pdf_string(group)),
+    ])
+
+
+def stream_badge_pdf(event_id, members, cols=3, rows=4, workers=None, issued_at=None):
+    """
+    Yield a printable PDF, cols x rows badges per page, one page at a time.
+    `members` holds (user_id, username, displayname, group name) rows.
+    QR matrices come from the render pool and are drawn as vector runs.
+    """
+    pdf = PdfStream()
+    width, height = pdf.page_size
+    cell_w = (width - 2 * SHEET_MARGIN) / cols
+    cell_h = (height - 2 * SHEET_MARGIN) / rows
+    per_page = cols * rows
+
+    yield pdf.start()
+    tokens = (make_qr_token(event_id, row[0], issued_at=issued_at) for row in members)
+    cells = []
+    for (_, username, displayname, group), qr in zip(members, render_many(tokens, workers, render_qr_pdf_ops)):
+        slot = len(cells)
+        x = SHEET_MARGIN + (slot % cols) * cell_w
+        y = height - SHEET_MARGIN - (slot // cols + 1) * cell_h
+        cells.append(badge_cell(x, y, cell_w, cell_h, qr, displayname or username, group or 'Groupless'))
+        if len(cells) == per_page:
+            yield pdf.page(b''.join(cells))
+            cells = []
+    if cells or not pdf.page_ids:
+        yield pdf.page(b''.join(cells))
+    yield pdf.finish()
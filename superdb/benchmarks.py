@@ -0,0 +1,489 @@
+# superdb/benchmarks.py
+"""
+Benchmarks for the hot paths, run with ``python manage.py benchmark <name>``.
+Every scenario runs against a throwaway test database, never db.sqlite3.
+"""
+import time
+from datetime import timedelta
+
+from django.db import connection
+from django.utils import timezone
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+def timed(func, *args, **kwargs):
+    """Run func once, returning (result, elapsed_seconds, queries_issued)."""
+    queries = 0
+
+    def count(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    # counted rather than captured: query logs stop at 9000 entries
+    with connection.execute_wrapper(count):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+    return result, elapsed, queries
+
+
+def seed_users(count, prefix='bench', **fields):
+    from .models import User
+    User.objects.bulk_create(
+        [User(username=f'{prefix}_{i}', displayname=f'Bench {i}', **fields) for i in range(count)],
+        batch_size=1000,
+    )
+    return list(User.objects.filter(username__startswith=f'{prefix}_').order_by('id'))
+
+
+def seed_history(users, events_count):
+    """Fill Attendance with past, non-overlapping events every user attended."""
+    from .models import Event, Attendance
+    now = timezone.now()
+    events = Event.objects.bulk_create([
+        Event(
+            title=f'Past {i}',
+            start_time=now - timedelta(days=events_count - i + 2, hours=2),
+            end_time=now - timedelta(days=events_count - i + 2),
+        )
+        for i in range(events_count)
+    ])
+    Attendance.objects.bulk_create(
+        [Attendance(event=e, user=u) for e in events for u in users],
+        batch_size=2000,
+    )
+
+
+def _legacy_scan(scanner, event_id, user_id, now):
+    """The pre-fast-path scan_endpoint body, kept only for comparison."""
+    from django.db import transaction
+    from .models import Event, User, Attendance
+
+    event = Event.objects.get(pk=event_id)
+    user = User.objects.get(pk=user_id)
+    if user.penalty_status == 'banned' or not user.is_active_member:
+        return 'user_banned'
+    if not (event.start_time <= now <= event.end_time):
+        return 'outside_event_time'
+    overlapping = Attendance.objects.filter(
+        user=user,
+        event__start_time__lte=event.end_time,
+        event__end_time__gte=event.start_time
+    ).exclude(event=event)
+    if overlapping.exists():
+        return 'overlap'
+    with transaction.atomic():
+        Attendance.objects.get_or_create(event=event, user=user, defaults={'scanner': scanner})
+    return user.graup.name if user.graup else 'Groupless'
+
+
+def _fast_scan(scanner, event_id, user_id, now):
+    from .views import _scan  # imported before timing
+    return _scan(scanner, event_id, user_id, now)
+
+
+@scenario('scan')
+def bench_scan(history_sizes=(0, 10, 50), roster=200, **_):
+    """
+    Per-scan latency of scan_endpoint's fast path against the legacy query
+    sequence, as the Attendance table grows.
+    """
+    from .models import Event, Graup, User
+    from . import views  # noqa: F401 -- keep the module import out of the timings
+
+    group = Graup.objects.create(name='Bench group')
+    scanner = User.objects.create(username='bench_scanner', role='scanner')
+    rows = []
+    for size in history_sizes:
+        # every seeded user gets `size` past attendances
+        users = seed_users(roster * 2, prefix=f'scan{size}', graup=group)
+        seed_history(users, size)
+        now = timezone.now()
+        event = Event.objects.create(title=f'Live {size}', start_time=now - timedelta(hours=1), end_time=now + timedelta(hours=1))
+
+        result = {'history_per_user': size}
+        for label, func, batch in (('legacy', _legacy_scan, users[:roster]), ('fast', _fast_scan, users[roster:])):
+            elapsed = 0.0
+            queries = 0
+            for u in batch:
+                _, t, q = timed(func, scanner, event.id, u.id, now)
+                elapsed += t
+                queries += q
+            result[f'{label}_ms_per_scan'] = round(elapsed / len(batch) * 1000, 3)
+            result[f'{label}_queries_per_scan'] = round(queries / len(batch), 2)
+        rows.append(result)
+    return rows
+
+
+@scenario('qr_tokens')
+def bench_qr_tokens(iterations=5000, badges=100, **_):
+    """
+    Encode/decode cost of JWT vs compact badge tokens, the QR symbol each one
+    needs, and the PNG render cost for a single badge and a bulk ZIP.
+    """
+    import zipfile
+    from io import BytesIO
+
+    import qrcode
+
+    from .utils import make_qr_payload, make_compact_qr_payload, decode_qr_token
+
+    rows = []
+    for label, make in (('jwt', make_qr_payload), ('compact', make_compact_qr_payload)):
+        start = time.perf_counter()
+        for i in range(iterations):
+            token = make(i, i)
+        encode_us = (time.perf_counter() - start) / iterations * 1e6
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            decode_qr_token(token)
+        decode_us = (time.perf_counter() - start) / iterations * 1e6
+
+        qr = qrcode.QRCode()
+        qr.add_data(token)
+        qr.make(fit=True)
+
+        start = time.perf_counter()
+        buf = BytesIO()
+        qrcode.make(token).save(buf, format='PNG')
+        png_ms = (time.perf_counter() - start) * 1000
+
+        # same loop bulk_qr_zip runs, minus the database
+        start = time.perf_counter()
+        zip_buf = BytesIO()
+        with zipfile.ZipFile(zip_buf, 'w') as zf:
+            for i in range(badges):
+                img_buf = BytesIO()
+                qrcode.make(make(1, i)).save(img_buf, format='PNG')
+                zf.writestr(f'user{i}.png', img_buf.getvalue())
+        zip_ms = (time.perf_counter() - start) * 1000
+
+        rows.append({
+            'format': label,
+            'token_chars': len(token),
+            'encode_us': round(encode_us, 2),
+            'decode_us': round(decode_us, 2),
+            'qr_version': qr.version,
+            'qr_modules': qr.modules_count,
+            'png_bytes': len(buf.getvalue()),
+            'png_ms': round(png_ms, 2),
+            f'zip_{badges}_ms': round(zip_ms, 1),
+            'zip_bytes': len(zip_buf.getvalue()),
+        })
+    return rows
+
+
+@scenario('token_cache')
+def bench_token_cache(iterations=20000, **_):
+    """Per-scan token verification cost with a cold versus a warm cache."""
+    from .utils import make_qr_payload, make_compact_qr_payload, decode_qr_token, token_cache
+
+    rows = []
+    for label, make in (('jwt', make_qr_payload), ('compact', make_compact_qr_payload)):
+        token = make(1, 1)
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            token_cache.clear()
+            decode_qr_token(token)
+        cold_us = (time.perf_counter() - start) / iterations * 1e6
+
+        token_cache.clear()
+        decode_qr_token(token)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            decode_qr_token(token)
+        warm_us = (time.perf_counter() - start) / iterations * 1e6
+
+        rows.append({
+            'format': label,
+            'cold_us': round(cold_us, 2),
+            'warm_us': round(warm_us, 2),
+            'speedup': round(cold_us / warm_us, 1),
+            **{f'cache_{k}': v for k, v in token_cache.stats().items()},
+        })
+    token_cache.clear()
+    return rows
+
+
+@scenario('badge_sheets')
+def bench_badge_sheets(sizes=(100, 1000), **_):
+    """Bulk badge export: PNG ZIP versus the vector PDF sheets, one worker."""
+    from .badges import stream_badge_zip, stream_badge_pdf
+
+    rows = []
+    for count in sizes:
+        members = [(i, f'user{i}', f'User {i}', 'Blue') for i in range(count)]
+        for label, stream in (
+            ('zip', lambda: stream_badge_zip(1, [m[:2] for m in members], workers=1)),
+            ('pdf', lambda: stream_badge_pdf(1, members, workers=1)),
+        ):
+            start = time.perf_counter()
+            size = sum(len(chunk) for chunk in stream())
+            elapsed = time.perf_counter() - start
+            rows.append({
+                'badges': count,
+                'format': label,
+                'total_s': round(elapsed, 2),
+                'per_badge_ms': round(elapsed / count * 1000, 2),
+                'bytes': size,
+            })
+    return rows
+
+
+def _legacy_no_show_penalties(event, system_user):
+    """The per-user loop apply_no_show_penalties used to run, kept only for comparison."""
+    from .models import Penalty
+
+    no_show_users = event.assigned_users.exclude(id__in=event.attendances.values_list('user_id', flat=True))
+    penalties_added = 0
+    for user in no_show_users:
+        if user.penalty_status == 'banned' or user.username == 'whatisasystem':
+            continue
+        Penalty.objects.create(
+            user=user, type='add', reason=f"Failed to check in during the event ({event.title})",
+            admin=system_user, active=True, previouslevel=user.penalty_level,
+        )
+        user.penalty_level += 1
+        if user.penalty_level >= 3:
+            user.penalty_status = 'banned'
+        elif user.penalty_level >= 1:
+            user.penalty_status = 'warned'
+        user.save()
+        penalties_added += 1
+    return penalties_added, no_show_users.count()
+
+
+@scenario('no_show_penalties')
+def bench_no_show_penalties(sizes=(100, 1000, 10000), **_):
+    """
+    End-of-event penalties for rosters of growing size, a tenth of whom
+    checked in, set-based versus the old per-user loop. Each side gets its
+    own identical event and users.
+    """
+    from .models import Event, Attendance
+    from .penalties import apply_no_show_penalties, get_system_user
+
+    system_user = get_system_user()
+    now = timezone.now()
+    rows = []
+    for size in sizes:
+        result = {'assigned': size}
+        for label, func in (('legacy', _legacy_no_show_penalties), ('set', apply_no_show_penalties)):
+            users = seed_users(size, prefix=f'noshow_{label}{size}')
+            event = Event.objects.create(title=f'Ended {size}', start_time=now - timedelta(hours=2), end_time=now - timedelta(hours=1))
+            Event.assigned_users.through.objects.bulk_create(
+                [Event.assigned_users.through(event_id=event.id, user_id=u.id) for u in users], batch_size=2000,
+            )
+            Attendance.objects.bulk_create([Attendance(event=event, user=u) for u in users[::10]], batch_size=2000)
+
+            (added, no_shows), elapsed, queries = timed(func, event, system_user)
+            result[f'{label}_ms'] = round(elapsed * 1000, 1)
+            result[f'{label}_queries'] = queries
+        result['penalties'] = added
+        result['speedup'] = round(result['legacy_ms'] / result['set_ms'], 1)
+        rows.append(result)
+    return rows
+
+
+def _legacy_import_record(row, mode, mapping):
+    """The per-row normalisation finalize_import used to run, kept only for comparison."""
+    group_name = row.get(mapping["group"], "")
+    password = row.get(mapping.get("password"), None)
+    if mode == "username":
+        username = row.get(mapping["username"], "")
+        display_name = username.strip().capitalize() if username else ""
+    else:
+        firstname = row.get(mapping["firstname"], "")
+        lastname = row.get(mapping["lastname"], "")
+        username = f"{firstname}_{lastname}".lower().replace(" ", "")
+        display_name = f"{str(firstname).strip().title()} {str(lastname).strip().title()}"
+    if not username:
+        return None
+    return username, display_name, group_name, password
+
+
+def _legacy_import_users(frames, mode, mapping, role):
+    """The per-row update_or_create loop finalize_import used to run, kept only for comparison."""
+    from .models import Graup, User
+
+    count = 0
+    for frame in frames:
+        for row in frame.to_dict(orient='records'):
+            record = _legacy_import_record(row, mode, mapping)
+            if record is None:
+                continue
+            username, display_name, group_name, password = record
+            graup_obj, _ = Graup.objects.update_or_create(name=group_name, defaults={"description": ""})
+            user, _ = User.objects.update_or_create(
+                username=username,
+                defaults={"role": role, "graup": graup_obj, "penalty_level": 0, "penalty_status": "ok", "displayname": display_name},
+            )
+            if password:
+                user.set_password(password)
+            count += 1
+    return count
+
+
+def _sheet(size, label, duplicates=0):
+    """A name-mode sheet as IMPORT_FRAME_ROWS-row frames, like iter_frames yields."""
+    import pandas as pd
+    from .imports import IMPORT_FRAME_ROWS
+
+    frame = pd.DataFrame({
+        'first': [f'{label}{size}' for i in range(size)],
+        'last': [f'member {i % (size - duplicates)}' for i in range(size)],
+        'team': [f'Team {i % 40}' for i in range(size)],
+        'pin': [str(1000 + i) for i in range(size)],
+    }, index=range(2, size + 2))
+    return [frame.iloc[i:i + IMPORT_FRAME_ROWS] for i in range(0, size, IMPORT_FRAME_ROWS)]
+
+
+IMPORT_MAPPING = {'firstname': 'first', 'lastname': 'last', 'group': 'team', 'password': 'pin'}
+
+
+@scenario('import_users')
+def bench_import_users(sizes=(1000, 10000), **_):
+    """
+    finalize_import's write phase for sheets of growing size, 40 groups and
+    a password column, bulk upsert versus the old per-row loop. Each side
+    imports the sheet twice: once into an empty table, once over itself.
+    """
+    from .imports import import_users
+
+    rows = []
+    for size in sizes:
+        result = {'rows': size}
+        for label, func in (('legacy', _legacy_import_users), ('bulk', import_users)):
+            frames = _sheet(size, label)
+            for run in ('create', 'update'):
+                _, elapsed, queries = timed(func, frames, 'name', IMPORT_MAPPING, 'member')
+                result[f'{label}_{run}_ms'] = round(elapsed * 1000, 1)
+                result[f'{label}_{run}_queries'] = queries
+        result['speedup'] = round(result['legacy_create_ms'] / result['bulk_create_ms'], 1)
+        rows.append(result)
+    return rows
+
+
+def _legacy_normalize(frames, mode, mapping):
+    return [
+        record for frame in frames for record in
+        (_legacy_import_record(row, mode, mapping) for row in frame.to_dict(orient='records'))
+        if record is not None
+    ]
+
+
+def _normalize(frames, mode, mapping):
+    from .imports import prepare_frame
+
+    seen, conflicts, records = {}, 0, 0
+    for frame in frames:
+        chunk, stats = prepare_frame(frame, mode, mapping, seen)
+        records += len(chunk)
+        conflicts += len(stats['conflicts'])
+    return records, conflicts
+
+
+@scenario('import_normalize')
+def bench_import_normalize(sizes=(10000, 50000), **_):
+    """
+    Username and display-name building for name-mode sheets with 1% repeated
+    names: the old per-row loop (no duplicate handling) versus the column
+    operations plus duplicate detection and length checks. No database work.
+    """
+    rows = []
+    for size in sizes:
+        frames = _sheet(size, 'norm', duplicates=size // 100)
+        _, legacy, _ = timed(_legacy_normalize, frames, 'name', IMPORT_MAPPING)
+        (records, conflicts), vectorized, _ = timed(_normalize, frames, 'name', IMPORT_MAPPING)
+        rows.append({
+            'rows': size,
+            'legacy_ms': round(legacy * 1000, 1),
+            'vectorized_ms': round(vectorized * 1000, 1),
+            'conflicts': conflicts,
+            'speedup': round(legacy / vectorized, 1),
+        })
+    return rows
+
+
+@scenario('import_dry_run')
+def bench_import_dry_run(sizes=(10000, 50000), **_):
+    """
+    diff_import for a username-mode CSV against a table holding nine in
+    ten of its users; a tenth of the rows change group, the rest match.
+    """
+    import csv
+    import os
+    import tempfile
+    from .imports import diff_import, discard, stage_copy
+
+    rows = []
+    for size in sizes:
+        from .models import User
+        prefix = f'dry{size}'
+        User.objects.bulk_create(
+            [User(username=f'{prefix}_{i}', displayname=f'{prefix}_{i}'.capitalize()) for i in range(size - size // 10)],
+            batch_size=1000,
+        )
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', newline='', delete=False) as f:
+            writer = csv.writer(f)
+            writer.writerow(['name', 'group'])
+            for i in range(size):
+                writer.writerow([f'{prefix}_{i}', 'Moved' if i % 10 == 1 else ''])
+        import_id = stage_copy(f.name)
+        os.remove(f.name)
+        try:
+            diff, elapsed, queries = timed(diff_import, import_id, 'username', {'username': 'name', 'group': 'group'}, 'member')
+        finally:
+            discard(import_id)
+        summary = diff['summary']
+        rows.append({
+            'rows': size,
+            'ms': round(elapsed * 1000, 1),
+            'queries': queries,
+            'create': summary['create'],
+            'update': summary['update'],
+            'unchanged': summary['unchanged'],
+        })
+    return rows
+
+
+@scenario('admin_dashboard')
+def bench_admin_dashboard(sizes=(100, 50000), **_):
+    """
+    The admin dashboard's first render, and the first page of its users
+    list, with every user holding one penalty and one event per 100 users.
+    """
+    from django.test import Client
+    from .models import Event, Penalty, User
+
+    admin = User.objects.create(username='bench_admin', role='admin')
+    client = Client()
+    client.force_login(admin)
+    now = timezone.now()
+    rows = []
+    seeded = 0
+    for size in sizes:
+        users = seed_users(size - seeded, prefix=f'dash{size}')
+        seeded = size
+        Penalty.objects.bulk_create([Penalty(user=u, reason='Bench', admin=admin) for u in users], batch_size=1000)
+        Event.objects.bulk_create([
+            Event(title=f'Bench {i}', start_time=now + timedelta(days=i), end_time=now + timedelta(days=i, hours=2), created_by=admin)
+            for i in range(len(users) // 100)
+        ])
+        page, elapsed, queries = timed(client.get, '/admin-dashboard/')
+        result = {'users': size, 'render_ms': round(elapsed * 1000, 1), 'render_queries': queries, 'render_kb': len(page.content) // 1024}
+        users_page, elapsed, queries = timed(client.get, '/dashboard/users/')
+        result.update({'users_page_ms': round(elapsed * 1000, 1), 'users_page_queries': queries, 'users_page_kb': len(users_page.content) // 1024})
+        rows.append(result)
+    return rows
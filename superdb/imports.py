@@ -0,0 +1,508 @@
+# superdb/imports.py
+"""
+Staged spreadsheet imports.
+
+parse_import stores the uploaded (or fetched) sheet under IMPORT_DIR and
+hands the browser an import id, the column names and a few preview rows.
+finalize_import then reads the rows back from that file a chunk at a
+time, so no request carries the full sheet and no full DataFrame is built.
+xlsx files are read with openpyxl in read-only mode; CSV with pandas'
+chunked reader. Each chunk is written with a handful of bulk queries in
+its own transaction; large imports run as an ImportJob in the background
+(see run_import_job).
+"""
+import csv
+import os
+import re
+import shutil
+import time
+import uuid
+
+import pandas as pd
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from openpyxl import load_workbook
+
+from .models import Graup, User
+
+IMPORT_DIR = getattr(settings, 'IMPORT_DIR', os.path.join(settings.BASE_DIR, '.imports'))
+IMPORT_RETENTION_SECONDS = 24 * 3600  # staged files nobody finalized
+IMPORT_FRAME_ROWS = 5000  # rows read and normalised together; column operations only pay off in bulk
+IMPORT_CHUNK = 500  # rows written per transaction
+PREVIEW_ROWS = 5
+
+IMPORT_FORMATS = ('xlsx', 'csv')
+_IMPORT_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+class ImportNotFound(Exception):
+    pass
+
+
+def _prune_stale():
+    cutoff = time.time() - IMPORT_RETENTION_SECONDS
+    for entry in os.scandir(IMPORT_DIR):
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+def _new_path(fmt):
+    os.makedirs(IMPORT_DIR, exist_ok=True)
+    _prune_stale()
+    import_id = uuid.uuid4().hex
+    return import_id, os.path.join(IMPORT_DIR, f'{import_id}.{fmt}')
+
+
+def stage_upload(upload):
+    """Store an uploaded file (Django UploadedFile) and return its import id."""
+    fmt = 'csv' if upload.name.lower().endswith('.csv') else 'xlsx'
+    import_id, path = _new_path(fmt)
+    with open(path, 'wb') as out:
+        for chunk in upload.chunks():
+            out.write(chunk)
+    return import_id
+
+
+def stage_copy(path, fmt='csv'):
+    """Stage a copy of a local file, e.g. a cached sheet download."""
+    import_id, staged = _new_path(fmt)
+    shutil.copyfile(path, staged)
+    return import_id
+
+
+def staged_path(import_id):
+    if not isinstance(import_id, str) or not _IMPORT_ID.match(import_id):
+        raise ImportNotFound(import_id)
+    for fmt in IMPORT_FORMATS:
+        path = os.path.join(IMPORT_DIR, f'{import_id}.{fmt}')
+        if os.path.exists(path):
+            return path
+    raise ImportNotFound(import_id)
+
+
+def discard(import_id):
+    try:
+        os.remove(staged_path(import_id))
+    except (ImportNotFound, FileNotFoundError):
+        pass
+
+
+def cell_text(value):
+    """Cells as the strings finalize works with; empty cells become ''."""
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        if value != value:  # NaN
+            return ''
+        if value.is_integer():
+            return str(int(value))
+    return str(value).strip()
+
+
+def _unique_columns(header):
+    """Header cells as column names, blank ones dropped, repeats numbered like pandas does."""
+    columns, seen = [], {}
+    for cell in header:
+        name = cell_text(cell)
+        if name:
+            if name in seen:
+                seen[name] += 1
+                name = f'{name}.{seen[name]}'
+            else:
+                seen[name] = 0
+        columns.append(name)
+    return columns
+
+
+def _xlsx_rows(path):
+    """(workbook, columns, row tuple iterator) of the first sheet; close the workbook when done."""
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    rows = workbook.worksheets[0].iter_rows(values_only=True)
+    columns = _unique_columns(next(rows, ()))
+    return workbook, columns, rows
+
+
+def iter_frames(import_id, chunk_size=None):
+    """
+    Yield DataFrames of up to chunk_size (IMPORT_FRAME_ROWS) rows, every
+    cell as trimmed text, indexed by sheet row number (the header is row 1).
+    """
+    chunk_size = chunk_size or IMPORT_FRAME_ROWS
+    path = staged_path(import_id)
+    if path.endswith('.csv'):
+        reader = pd.read_csv(path, encoding='utf-8-sig', dtype=str, keep_default_na=False, chunksize=chunk_size)
+        with reader:
+            for frame in reader:
+                frame.columns = [str(c) for c in frame.columns]
+                frame.index = frame.index + 2
+                yield frame.apply(lambda column: column.str.strip())
+        return
+
+    workbook, columns, rows = _xlsx_rows(path)
+    keep = [i for i, name in enumerate(columns) if name]
+    names = [columns[i] for i in keep]
+
+    def frame(numbers, values):
+        return pd.DataFrame(values, index=numbers, columns=names, dtype=object)
+
+    try:
+        numbers, values = [], []
+        for number, row in enumerate(rows, start=2):
+            if not any(v is not None for v in row):
+                continue  # blank or formatting-only rows
+            row = row + (None,) * (len(columns) - len(row))
+            numbers.append(number)
+            values.append([cell_text(row[i]) for i in keep])
+            if len(values) == chunk_size:
+                yield frame(numbers, values)
+                numbers, values = [], []
+        if values:
+            yield frame(numbers, values)
+    finally:
+        workbook.close()
+
+
+def iter_chunks(import_id, chunk_size=None):
+    """Yield lists of up to chunk_size {column: text} dicts, in sheet order."""
+    for frame in iter_frames(import_id, chunk_size):
+        yield frame.to_dict(orient='records')
+
+
+def count_rows(import_id):
+    """Data rows in a staged import (for xlsx, as the sheet's dimensions say)."""
+    path = staged_path(import_id)
+    if path.endswith('.csv'):
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            return max(0, sum(1 for row in csv.reader(f) if row) - 1)
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        return max(0, (workbook.worksheets[0].max_row or 1) - 1)
+    finally:
+        workbook.close()
+
+
+def describe(import_id, preview_rows=PREVIEW_ROWS):
+    """Columns, the first few rows and the row count of a staged import."""
+    path = staged_path(import_id)
+    if path.endswith('.csv'):
+        header = pd.read_csv(path, encoding='utf-8-sig', dtype=str, keep_default_na=False, nrows=0)
+        columns = [str(c) for c in header.columns]
+    else:
+        workbook, columns, rows = _xlsx_rows(path)
+        workbook.close()
+        columns = [c for c in columns if c]
+    chunks = iter_chunks(import_id, preview_rows)
+    preview = next(chunks, [])
+    chunks.close()
+    return {'columns': columns, 'preview': preview, 'total_rows': count_rows(import_id)}
+
+
+# Imported users start over with a clean penalty record
+IMPORT_USER_FIELDS = ['role', 'graup', 'penalty_level', 'penalty_status', 'displayname']
+
+USERNAME_MAX_LENGTH = User._meta.get_field('username').max_length
+DISPLAYNAME_MAX_LENGTH = User._meta.get_field('displayname').max_length
+GROUP_MAX_LENGTH = Graup._meta.get_field('name').max_length
+MAX_ROW_ERRORS = 100  # errors and conflicts kept on a job; the rest are only counted
+
+
+def normalize_frame(frame, mode, mapping):
+    """
+    Usernames, display names, groups and passwords for a chunk of sheet
+    rows, as column-wide string operations. `mode` is 'username' or
+    first/last name; mapped columns missing from the sheet read as ''.
+    Returns a DataFrame with the sheet's row numbers as its index.
+    """
+    def column(key):
+        name = mapping.get(key)
+        if name in frame.columns:
+            return frame[name].astype(str)
+        return pd.Series('', index=frame.index, dtype=object)
+
+    # cells arrive trimmed (see iter_frames)
+    # --- MODE A: USERNAME ---
+    if mode == "username":
+        username = column("username")
+        # Requirement: Username with the first letter in Caps
+        display_name = username.str.capitalize()
+
+    # --- MODE B: FIRSTNAME + LASTNAME ---
+    else:
+        firstname, lastname = column("firstname"), column("lastname")
+        # Generate username
+        username = (firstname + "_" + lastname).str.lower().str.replace(" ", "", regex=False)
+        # Requirement: Firstname Lastname (Both capitalized, space between)
+        display_name = (firstname + " " + lastname).str.title()
+
+    return pd.DataFrame({
+        'username': username,
+        'displayname': display_name,
+        'group': column("group"),
+        'password': column("password"),
+    })
+
+
+def dedupe_usernames(records, mode, seen):
+    """
+    Resolve usernames that already appeared in this sheet. `seen` maps
+    every username handed out so far to the row it came from and is
+    updated in place. Generated (first/last name) usernames get the lowest
+    free number appended, so two John Does become john_doe and john_doe2;
+    usernames taken from the sheet are identities, so a repeat updates the
+    same user and is only reported. Returns the conflicts, in row order.
+    """
+    usernames = records['username']
+    repeated = usernames.duplicated(keep='first') | usernames.map(seen.__contains__).astype(bool)
+    seen.update(zip(usernames[~repeated], usernames.index[~repeated]))
+    if not repeated.any():
+        return []
+
+    conflicts = []
+    for row, username in usernames[repeated].items():
+        imported_as = username
+        if mode != "username":
+            n = 2
+            while f'{username}{n}' in seen:
+                n += 1
+            imported_as = f'{username}{n}'
+            records.at[row, 'username'] = imported_as
+            seen[imported_as] = row
+        conflicts.append({'row': int(row), 'username': username, 'first_row': int(seen[username]), 'imported_as': imported_as})
+    return conflicts
+
+
+def record_problems(records):
+    """Why each row cannot be stored as is ('' when it can)."""
+    problems = pd.Series('', index=records.index, dtype=object)
+    for field, label, limit in (
+        ('group', 'group', GROUP_MAX_LENGTH),
+        ('displayname', 'name', DISPLAYNAME_MAX_LENGTH),
+        ('username', 'username', USERNAME_MAX_LENGTH),
+    ):
+        too_long = records[field].str.len() > limit
+        if too_long.any():
+            problems[too_long] = f'{label} is longer than {limit} characters'
+    return problems
+
+
+def resolve_groups(names, known):
+    """
+    Fill `known` (name -> Graup id) for every name in `names`: one query
+    for the unknown ones, one bulk insert for those that do not exist yet.
+    """
+    missing = {name for name in names if name and name not in known}
+    if not missing:
+        return known
+    known.update(Graup.objects.filter(name__in=missing).values_list('name', 'id'))
+    new = [Graup(name=name, description="") for name in sorted(missing - known.keys())]
+    if new:
+        Graup.objects.bulk_create(new, ignore_conflicts=True)
+        known.update(Graup.objects.filter(name__in=[g.name for g in new]).values_list('name', 'id'))
+    return known
+
+
+def upsert_users(records, role, groups):
+    """
+    Create or update the users for one chunk of (username, displayname,
+    group, password) tuples. Later rows for the same username win.
+    """
+    by_username = {record[0]: record for record in records}
+    resolve_groups({record[2] for record in by_username.values()}, groups)
+
+    with_password, without_password = [], []
+    for username, display_name, group_name, password in by_username.values():
+        user = User(
+            username=username,
+            displayname=display_name,
+            role=role,
+            graup_id=groups.get(group_name),
+            penalty_level=0,
+            penalty_status="ok",
+            password=password or None,  # stored raw, see User.set_password
+        )
+        (with_password if password else without_password).append(user)
+
+    for users, fields in ((with_password, IMPORT_USER_FIELDS + ['password']), (without_password, IMPORT_USER_FIELDS)):
+        if users:
+            User.objects.bulk_create(users, update_conflicts=True, unique_fields=['username'], update_fields=fields)
+
+
+def prepare_frame(frame, mode, mapping, seen):
+    """
+    Normalise a frame of sheet rows and split it into rows to store and
+    rows to skip. Returns (records DataFrame, stats) where stats counts the
+    skipped rows and holds "Row N: ..." errors and duplicate conflicts.
+    """
+    records = normalize_frame(frame, mode, mapping)
+    records = records[records['username'] != ''].copy()
+    stats = {'created': 0, 'updated': 0, 'skipped': len(frame) - len(records), 'errors': [], 'conflicts': []}
+    stats['conflicts'] = dedupe_usernames(records, mode, seen)
+
+    problems = record_problems(records)
+    bad = problems != ''
+    stats['skipped'] += int(bad.sum())
+    stats['errors'] = [f'Row {row}: {problem}' for row, problem in problems[bad].items()]
+    return records[~bad], stats
+
+
+def write_records(records, role, groups):
+    """Upsert a batch of prepared records; returns (created, updated)."""
+    if not len(records):
+        return 0, 0
+    usernames = set(records['username'])
+    existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+    upsert_users(list(records.itertuples(index=False, name=None)), role, groups)
+    created = len(usernames - existing)
+    return created, len(records) - created
+
+
+def import_frame(frame, mode, mapping, role, groups, seen, skip=0, on_batch=None):
+    """
+    Normalise the frame in one pass, then write it IMPORT_CHUNK rows per
+    transaction, starting `skip` rows in. After each batch's writes,
+    on_batch(rows_done, stats) runs inside that batch's transaction. The
+    frame's skips, errors and conflicts come with its first batch, so a
+    resumed frame (skip > 0) does not report them twice.
+    """
+    records, frame_stats = prepare_frame(frame, mode, mapping, seen)
+    rows = frame.index
+    for start in range(skip, len(frame), IMPORT_CHUNK):
+        batch = rows[start:start + IMPORT_CHUNK]
+        stats = frame_stats if start == 0 else {'created': 0, 'updated': 0, 'skipped': 0, 'errors': [], 'conflicts': []}
+        with transaction.atomic():
+            stats['created'], stats['updated'] = write_records(records.loc[batch[0]:batch[-1]], role, groups)
+            if on_batch is not None:
+                on_batch(start + len(batch), stats)
+
+
+def _add_stats(totals, stats, cap=None):
+    for key in ('created', 'updated', 'skipped'):
+        totals[key] += stats[key]
+    for key in ('errors', 'conflicts'):
+        totals[key] = (totals[key] + stats[key])[:cap]
+
+
+def import_users(frames, mode, mapping, role):
+    """
+    Upsert users from an iterable of row DataFrames (see iter_frames), one
+    transaction per IMPORT_CHUNK rows. Returns the summed counts, errors
+    and conflicts.
+    """
+    totals = {'created': 0, 'updated': 0, 'skipped': 0, 'errors': [], 'conflicts': []}
+    groups, seen = {}, {}
+    for frame in frames:
+        import_frame(frame, mode, mapping, role, groups, seen, on_batch=lambda done, stats: _add_stats(totals, stats))
+    return totals
+
+
+def run_import_job(job):
+    """
+    Work through an ImportJob's staged file from job.processed on. Each
+    batch and the job's counters commit together, so after a failure the
+    job picks up at the first row that was not written. Frames committed
+    earlier are only normalised again, to know which usernames they took.
+    """
+    groups, seen = {}, {}
+    done = 0
+
+    def record_progress(frame_start):
+        def on_batch(rows_done, stats):
+            job.processed = frame_start + rows_done
+            job.duplicates += len(stats['conflicts'])
+            totals = {'created': job.created, 'updated': job.updated, 'skipped': job.skipped, 'errors': job.errors, 'conflicts': job.conflicts}
+            _add_stats(totals, stats, MAX_ROW_ERRORS)
+            job.created, job.updated, job.skipped = totals['created'], totals['updated'], totals['skipped']
+            job.errors, job.conflicts = totals['errors'], totals['conflicts']
+            job.save(update_fields=['processed', 'created', 'updated', 'skipped', 'duplicates', 'errors', 'conflicts', 'updated_at'])
+        return on_batch
+
+    for frame in iter_frames(job.import_id):
+        start, done = done, done + len(frame)
+        if done <= job.processed:
+            prepare_frame(frame, job.mode, job.mapping, seen)  # committed by an earlier attempt
+            continue
+        import_frame(frame, job.mode, job.mapping, job.role, groups, seen,
+                     skip=max(0, job.processed - start), on_batch=record_progress(start))
+
+    job.status, job.total, job.finished_at = 'done', job.processed, timezone.now()
+    job.save(update_fields=['status', 'total', 'finished_at', 'updated_at'])
+    discard(job.import_id)
+    return job
+
+
+DIFF_PAGE_SIZE = 50
+DIFF_FIELDS = ['role', 'group', 'displayname']  # compared as shown; passwords only flagged
+
+
+def diff_import(import_id, mode, mapping, role, page=1, page_size=None):
+    """
+    What finalizing this import would do, without writing anything: every
+    row is normalised as the job would, then joined against all existing
+    users and groups (one query each). Returns summary counts, the groups
+    that would be created and one page of per-user changes in row order.
+    """
+    page_size = page_size or DIFF_PAGE_SIZE
+    seen = {}
+    parts, summary = [], {'rows': 0, 'skipped': 0, 'duplicates': 0, 'errors': []}
+    for frame in iter_frames(import_id):
+        records, stats = prepare_frame(frame, mode, mapping, seen)
+        parts.append(records)
+        summary['rows'] += len(frame)
+        summary['skipped'] += stats['skipped']
+        summary['duplicates'] += len(stats['conflicts'])
+        summary['errors'] = (summary['errors'] + stats['errors'])[:MAX_ROW_ERRORS]
+
+    incoming = pd.concat(parts) if parts else normalize_frame(pd.DataFrame(), mode, mapping)
+    # a username given twice ends up with its last row
+    incoming = incoming[~incoming['username'].duplicated(keep='last')]
+    incoming = incoming.rename_axis('row').reset_index()
+    incoming['role'] = role
+
+    existing = pd.DataFrame.from_records(
+        User.objects.values_list('username', 'role', 'graup__name', 'displayname', 'password', 'penalty_level', 'penalty_status'),
+        columns=['username', 'role', 'group', 'displayname', 'password', 'penalty_level', 'penalty_status'],
+    )
+    existing['group'] = existing['group'].fillna('')
+    groups = set(Graup.objects.values_list('name', flat=True))
+
+    joined = incoming.merge(existing, on='username', how='left', suffixes=('', '_old'), indicator=True)
+    is_new = joined['_merge'] == 'left_only'
+    old = joined[~is_new]
+
+    changed = pd.DataFrame(index=old.index)
+    for field in DIFF_FIELDS:
+        changed[field] = old[field] != old[f'{field}_old']
+    changed['password'] = (old['password'] != '') & (old['password'] != old['password_old'].fillna(''))
+    changed['penalties'] = (old['penalty_level'] != 0) | (old['penalty_status'] != 'ok')
+    is_update = changed.any(axis=1).reindex(joined.index, fill_value=False)
+
+    summary.update({
+        'create': int(is_new.sum()),
+        'update': int(is_update.sum()),
+        'unchanged': int((~is_new & ~is_update).sum()),
+        'new_groups': sorted({g for g in incoming['group'] if g} - groups),
+    })
+
+    listed = joined[is_new | is_update].sort_values('row')
+    pages = max(1, -(-len(listed) // page_size))
+    page = min(max(1, page), pages)
+    entries = []
+    for index, row in listed.iloc[(page - 1) * page_size:page * page_size].iterrows():
+        if is_new[index]:
+            entries.append({
+                'row': int(row['row']), 'username': row['username'], 'action': 'create',
+                'changes': {field: [None, row[field]] for field in DIFF_FIELDS},
+            })
+            continue
+        diff = {field: [row[f'{field}_old'], row[field]] for field in DIFF_FIELDS if changed.at[index, field]}
+        if changed.at[index, 'password']:
+            diff['password'] = ['***', '***']
+        if changed.at[index, 'penalties']:
+            diff['penalties'] = [f"{row['penalty_status']} ({int(row['penalty_level'])})", 'ok (0)']
+        entries.append({'row': int(row['row']), 'username': row['username'], 'action': 'update', 'changes': diff})
+
+    return {'summary': summary, 'page': page, 'pages': pages, 'changes': entries}
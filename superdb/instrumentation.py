@@ -0,0 +1,100 @@
+# superdb/instrumentation.py
+"""
+Scheduler run metrics. A task wraps its work in `scheduler_run(kind)`; while
+it is open, every query on the connection is counted (no SQL is kept), and
+processed events and apply_no_show_penalties calls report into it. On exit
+the run is saved as a SchedulerRun row and printed as one JSON line.
+"""
+import json
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.db import connection
+from django.utils import timezone
+
+from .models import SchedulerRun
+
+RUN_RETENTION = timedelta(days=30)
+
+_current = ContextVar('scheduler_run', default=None)
+
+
+class RunStats:
+    def __init__(self, kind):
+        self.kind = kind
+        self.started_at = timezone.now()
+        self.events = 0
+        self.penalties = 0
+        self.failed = 0
+        self.queries = 0
+        self.apply_seconds = 0.0
+        self.lags = []
+        self.budget_exhausted = False
+
+    def count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def event_processed(self, event, penalties_added):
+        self.events += 1
+        self.penalties += penalties_added
+        self.lags.append((timezone.now() - event.end_time).total_seconds())
+
+    def event_failed(self):
+        self.failed += 1
+
+    def summary(self, duration):
+        return {
+            'kind': self.kind,
+            'started_at': self.started_at.isoformat(),
+            'duration_ms': round(duration * 1000, 2),
+            'events': self.events,
+            'penalties': self.penalties,
+            'failed': self.failed,
+            'queries': self.queries,
+            'apply_ms': round(self.apply_seconds * 1000, 2),
+            'max_lag_s': round(max(self.lags), 3) if self.lags else None,
+            'mean_lag_s': round(sum(self.lags) / len(self.lags), 3) if self.lags else None,
+            'budget_exhausted': self.budget_exhausted,
+        }
+
+
+@contextmanager
+def scheduler_run(kind):
+    """Measure one task run; runs that touched no event are not recorded."""
+    stats = RunStats(kind)
+    token = _current.set(stats)
+    start = time.perf_counter()
+    try:
+        with connection.execute_wrapper(stats.count_query):
+            yield stats
+    finally:
+        duration = time.perf_counter() - start
+        _current.reset(token)
+        if stats.events or stats.failed:
+            summary = stats.summary(duration)
+            print(f"[AUTO-PENALTY] run {json.dumps(summary)}")
+            try:
+                SchedulerRun.objects.create(**{k: v for k, v in summary.items() if k != 'started_at'}, started_at=stats.started_at)
+                if kind == 'catch_up':
+                    SchedulerRun.objects.filter(started_at__lt=timezone.now() - RUN_RETENTION).delete()
+            except Exception as e:
+                print(f"[AUTO-PENALTY] Could not record run: {e}")
+
+
+@contextmanager
+def measure_apply():
+    """Time apply_no_show_penalties into the open run, if there is one."""
+    stats = _current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if stats is not None:
+            stats.apply_seconds += time.perf_counter() - start
+
+
+def current_run():
+    return _current.get()
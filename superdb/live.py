@@ -0,0 +1,183 @@
+# superdb/live.py
+"""
+Live attendance feed.
+
+Every change to Attendance is also written as an AttendanceChange row. Under
+ASGI, one poller per process tails that table and fans new rows out to every
+open server-sent-events stream, so the database sees one small indexed query
+per second per process however many dashboards are watching. Rows are
+written however the app is served, so the scheduler's housekeeping task
+prunes them (prune_feed), not the poller.
+"""
+import asyncio
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.utils import timezone
+
+from .models import AttendanceChange
+
+POLL_INTERVAL = 1.0  # seconds between feed polls while anyone is listening
+HEARTBEAT_EVERY = 15  # seconds; keeps proxies from closing idle streams
+FEED_RETENTION = timedelta(days=1)
+DISPLAY_FORMAT = '%b %d, %Y %I:%M %p'  # same as the event details endpoint
+
+
+def streams_enabled(request):
+    """
+    Whether pages should open live streams. Under WSGI a stream holds a
+    worker thread for as long as the page stays open, so unless the
+    LIVE_STREAMS setting says otherwise they are only used under ASGI.
+    """
+    forced = getattr(settings, 'LIVE_STREAMS', None)
+    if forced is not None:
+        return forced
+    return isinstance(request, ASGIRequest)
+
+
+def record_checkins(attendances):
+    """Publish freshly created Attendance rows (any iterable, one query)."""
+    changes = [
+        AttendanceChange(
+            event_id=a.event_id,
+            user_id=a.user_id,
+            action='checkin',
+            scanner=a.scanner.username if a.scanner_id else '',
+            at=a.checked_at or timezone.now(),
+        )
+        for a in attendances
+    ]
+    if len(changes) == 1:
+        # bulk_create would wrap a single INSERT in BEGIN/COMMIT
+        changes[0].save(force_insert=True)
+    else:
+        AttendanceChange.objects.bulk_create(changes)
+
+
+def record_undo(event_id, user_id):
+    AttendanceChange.objects.create(event_id=event_id, user_id=user_id, action='undo')
+
+
+def prune_feed(now=None):
+    """Delete feed rows older than FEED_RETENTION; returns how many went."""
+    now = now or timezone.now()
+    deleted, _ = AttendanceChange.objects.filter(at__lt=now - FEED_RETENTION).delete()
+    return deleted
+
+
+def serialize(change):
+    return {
+        'id': change.id,
+        'event': change.event_id,
+        'user': change.user_id,
+        'action': change.action,
+        'scanner': change.scanner or None,
+        'at': change.at.isoformat(),
+        'checked_at': timezone.localtime(change.at).strftime(DISPLAY_FORMAT) if change.action == 'checkin' else None,
+    }
+
+
+def format_sse(change):
+    return f"id: {change['id']}\nevent: attendance\ndata: {json.dumps(change)}\n\n"
+
+
+class AttendanceFeed:
+    """Per-process fan-out of AttendanceChange rows to asyncio subscribers."""
+
+    def __init__(self):
+        self.subscribers = {}  # event_id -> set of asyncio.Queue
+        self.last_id = None
+        self.task = None
+        self.loop = None
+        self.ready = None  # set once last_id is known
+
+    def subscribe(self, event_id):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # asyncio primitives are bound to the loop that created them
+            self.loop = loop
+            self.task = None
+            self.last_id = None
+            self.ready = asyncio.Event()
+        queue = asyncio.Queue()
+        self.subscribers.setdefault(event_id, set()).add(queue)
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+        return queue
+
+    def unsubscribe(self, event_id, queue):
+        queues = self.subscribers.get(event_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[event_id]
+
+    async def poll(self):
+        if self.last_id is None:
+            self.last_id = await latest_change_id()
+            self.ready.set()
+        changes = [c async for c in AttendanceChange.objects.filter(id__gt=self.last_id).order_by('id')[:500]]
+        for change in changes:
+            self.last_id = change.id
+            payload = serialize(change)
+            for queue in self.subscribers.get(change.event_id, ()):
+                queue.put_nowait(payload)
+
+    async def run(self):
+        while self.subscribers:
+            try:
+                await self.poll()
+            except Exception as e:
+                print(f"[LIVE] Feed poll failed: {e}")
+            await asyncio.sleep(POLL_INTERVAL)
+        # start from the head again next time instead of replaying the gap
+        self.last_id = None
+        self.ready.clear()
+
+
+async def latest_change_id(event_id=None):
+    changes = AttendanceChange.objects.order_by('-id')
+    if event_id is not None:
+        changes = changes.filter(event_id=event_id)
+    return await changes.values_list('id', flat=True).afirst() or 0
+
+
+feed = AttendanceFeed()
+
+
+async def stream_event(event_id, since=None, only_user=None):
+    """
+    Yield SSE frames for one event. `since` replays changes after that id
+    (the browser's Last-Event-ID); `only_user` limits the stream to one
+    member's own check-ins.
+    """
+    if since is None:
+        since = await latest_change_id(event_id)
+    queue = feed.subscribe(event_id)
+    try:
+        yield 'retry: 3000\n\n'
+        # anything newer than `since` but older than the feed's starting
+        # point is sent from here; the queue skips what was already sent
+        await feed.ready.wait()
+        sent = since
+        backlog = AttendanceChange.objects.filter(event_id=event_id, id__gt=since).order_by('id')
+        async for change in backlog:
+            if only_user is None or change.user_id == only_user:
+                yield format_sse(serialize(change))
+            sent = change.id
+
+        while True:
+            try:
+                change = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_EVERY)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            if change['id'] <= sent:
+                continue
+            sent = change['id']
+            if only_user is None or change['user'] == only_user:
+                yield format_sse(change)
+    finally:
+        feed.unsubscribe(event_id, queue)
@@ -0,0 +1,68 @@
+# superdb/loadtest.py
+"""
+Shared pieces for the load-test commands: seeding a scratch database and
+summarising latency samples.
+"""
+import statistics
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.db import connection
+from django.utils import timezone
+
+from .models import User, Event, Graup
+
+
+@contextmanager
+def scratch_database(path):
+    """Point the default connection at a fresh, migrated SQLite file."""
+    old_name = connection.settings_dict['NAME']
+    connection.close()
+    connection.settings_dict['NAME'] = str(path)
+    try:
+        call_command('migrate', verbosity=0, interactive=False)
+        yield
+    finally:
+        connection.close()
+        connection.settings_dict['NAME'] = old_name
+
+
+def seed_roster(users=1000, events=1, groups=10, scanners=1):
+    """
+    Create `users` members spread over `groups`, `events` running events
+    with every member assigned, and `scanners` scanner accounts.
+    Returns (event_ids, member_ids, scanner_usernames).
+    """
+    now = timezone.now()
+    graups = Graup.objects.bulk_create([Graup(name=f'Load group {i}') for i in range(groups)])
+    User.objects.bulk_create(
+        [User(username=f'load_member_{i}', displayname=f'Load Member {i}', graup=graups[i % groups]) for i in range(users)],
+        batch_size=1000,
+    )
+    User.objects.bulk_create([User(username=f'load_scanner_{i}', role='scanner') for i in range(scanners)])
+    member_ids = list(User.objects.filter(username__startswith='load_member_').order_by('id').values_list('id', flat=True))
+
+    created = Event.objects.bulk_create([
+        Event(title=f'Load event {i}', start_time=now - timedelta(days=1), end_time=now + timedelta(days=1))
+        for i in range(events)
+    ])
+    event_ids = [e.id for e in created]
+    Through = Event.assigned_users.through
+    Through.objects.bulk_create(
+        [Through(event_id=event_id, user_id=user_id) for event_id in event_ids for user_id in member_ids],
+        batch_size=5000,
+    )
+    return event_ids, member_ids, [f'load_scanner_{i}' for i in range(scanners)]
+
+
+def percentiles(samples):
+    """p50/p95/p99 and mean of latency samples (seconds), in milliseconds."""
+    if not samples:
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'mean_ms': None}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+    return {'p50_ms': pick(0.50), 'p95_ms': pick(0.95), 'p99_ms': pick(0.99), 'mean_ms': round(statistics.fmean(ordered) * 1000, 2)}
@@ -0,0 +1,37 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from superdb.benchmarks import SCENARIOS
+
+
+class Command(BaseCommand):
+    help = "Run a benchmark scenario against a throwaway test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=sorted(SCENARIOS))
+        parser.add_argument('--json', action='store_true', help="Print raw JSON instead of a table.")
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        setup_test_environment(debug=False)
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            rows = SCENARIOS[options['scenario']](**options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['json']:
+            self.stdout.write(json.dumps(rows, indent=2))
+            return
+
+        if not rows:
+            return
+        headers = list(rows[0])
+        widths = [max(len(h), *(len(str(r.get(h, ''))) for r in rows)) for h in headers]
+        self.stdout.write('  '.join(h.ljust(w) for h, w in zip(headers, widths)))
+        for r in rows:
+            self.stdout.write('  '.join(str(r.get(h, '')).ljust(w) for h, w in zip(headers, widths)))
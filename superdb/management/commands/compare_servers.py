@@ -0,0 +1,143 @@
+import itertools
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from superdb.loadtest import scratch_database, seed_roster, percentiles
+from superdb.utils import make_qr_token
+
+SERVERS = {
+    'wsgi': lambda port, workers: [
+        sys.executable, '-m', 'gunicorn', 'mainframe.wsgi:application',
+        '--workers', str(workers), '--bind', f'127.0.0.1:{port}', '--log-level', 'warning',
+    ],
+    'asgi': lambda port, workers: [
+        sys.executable, '-m', 'uvicorn', 'mainframe.asgi:application',
+        '--workers', str(workers), '--host', '127.0.0.1', '--port', str(port),
+        '--log-level', 'warning', '--no-access-log',
+    ],
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = ("Requests per second of /api/scan/ and /api/check_status/ under gunicorn sync "
+            "workers versus uvicorn (ASGI) with the same worker count, on a scratch database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+        parser.add_argument('--concurrency', type=int, default=32, help="Client threads.")
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds per endpoint per server.")
+        parser.add_argument('--users', type=int, default=20000, help="Members to seed (one scan each at most).")
+        parser.add_argument('--servers', default='wsgi,asgi')
+
+    def handle(self, *args, **options):
+        workdir = Path(tempfile.mkdtemp(prefix='compare_servers_'))
+        try:
+            results = self.compare(workdir / 'load.sqlite3', options)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def compare(self, db_path, options):
+        with scratch_database(db_path):
+            event_ids, member_ids, scanners = seed_roster(users=options['users'])
+        event_id = event_ids[0]
+
+        results = []
+        for name in options['servers'].split(','):
+            port = free_port()
+            env = {**os.environ, 'SQLITE_PATH': str(db_path)}
+            proc = subprocess.Popen(SERVERS[name](port, options['workers']), cwd=settings.BASE_DIR, env=env, stdout=sys.stderr)
+            try:
+                base = f'http://127.0.0.1:{port}'
+                self.wait_until_up(base)
+                # each server scans a disjoint slice of members, so every scan is a fresh check-in
+                half = len(member_ids) // 2
+                pool = member_ids[:half] if name == 'wsgi' else member_ids[half:]
+                tokens = iter([make_qr_token(event_id, user_id) for user_id in pool])
+                lock = threading.Lock()
+
+                def scan(session):
+                    with lock:
+                        token = next(tokens)
+                    return session.post(f'{base}/api/scan/', json={'token': token},
+                                        headers={'X-CSRFToken': session.cookies['csrftoken']})
+
+                statuses = itertools.cycle(pool)
+
+                def status(session):
+                    return session.get(f'{base}/api/check_status/', params={'event_id': event_id, 'user_id': next(statuses)})
+
+                for endpoint, call in (('check_status', status), ('scan', scan)):
+                    results.append({'server': name, 'workers': options['workers'], 'endpoint': endpoint,
+                                    **self.drive(base, scanners[0], call, options)})
+            finally:
+                proc.terminate()
+                proc.wait(timeout=30)
+        return results
+
+    def wait_until_up(self, base, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                if requests.get(f'{base}/accounts/login/', timeout=1).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f"server at {base} did not come up")
+
+    def login(self, base, username):
+        session = requests.Session()
+        session.get(f'{base}/accounts/login/', timeout=10)
+        session.post(f'{base}/accounts/login/', data={'username': username, 'password': ''},
+                     headers={'X-CSRFToken': session.cookies['csrftoken']}, timeout=10)
+        return session
+
+    def drive(self, base, username, call, options):
+        deadline = time.monotonic() + options['duration']
+
+        def worker(_):
+            session = self.login(base, username)
+            latencies, errors = [], 0
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                try:
+                    response = call(session)
+                    ok = response.status_code < 500
+                except (requests.RequestException, StopIteration):
+                    ok = False
+                latencies.append(time.perf_counter() - start)
+                errors += not ok
+            return latencies, errors
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            runs = list(executor.map(worker, range(options['concurrency'])))
+        elapsed = time.monotonic() - started
+
+        samples = [t for latencies, _ in runs for t in latencies]
+        return {
+            'requests': len(samples),
+            'errors': sum(errors for _, errors in runs),
+            'rps': round(len(samples) / elapsed, 1),
+            **percentiles(samples),
+        }
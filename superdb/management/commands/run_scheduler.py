@@ -0,0 +1,34 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from superdb import scheduler, tasks
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the end-of-event scheduler in its own process. Start one or more; "
+        "one leads and the rest stand by. Tasks run on Celery when "
+        "CELERY_BROKER_URL is set, otherwise on this process's job threads."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Process every ended event and run housekeeping now, then exit (cron-style).")
+
+    def handle(self, *args, **options):
+        if options['once']:
+            tasks.process_ended_events()
+            tasks.housekeeping()
+            return
+
+        stop = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stop.set())
+
+        scheduler.start_scheduler()
+        self.stdout.write(f"Scheduler process ready (job backend: {tasks.JOB_BACKEND}); Ctrl-C to stop.")
+        while not stop.wait(1):
+            pass
+        if scheduler.scheduler is not None:
+            scheduler.scheduler.shutdown(wait=True)
@@ -0,0 +1,122 @@
+import json
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.db import connection, OperationalError
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from superdb.loadtest import scratch_database, seed_roster, percentiles
+from superdb.models import Attendance, User
+from superdb.utils import make_qr_payload, make_qr_token
+
+
+class Command(BaseCommand):
+    help = ("Seed a scratch database and fire concurrent scans at /api/scan/ from a thread pool. "
+            "Prints throughput, latency percentiles, SQLite lock errors and queries per scan as JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000, help="Members to seed.")
+        parser.add_argument('--events', type=int, default=1, help="Running events; members are spread across them.")
+        parser.add_argument('--scanners', type=int, default=4, help="Concurrent scanner threads.")
+        parser.add_argument('--scans', type=int, default=None, help="Total scans (default: one per member). "
+                            "Scans beyond --users repeat badges, like scanner retries.")
+        parser.add_argument('--token-format', choices=['jwt', 'compact'], default='jwt')
+        parser.add_argument('--db', default=None, help="SQLite file to use (default: a temp file).")
+        parser.add_argument('--output', default=None, help="Also write the JSON report to this file.")
+
+    def handle(self, *args, **options):
+        workdir = None if options['db'] else Path(tempfile.mkdtemp(prefix='scan_storm_'))
+        db_path = Path(options['db']) if options['db'] else workdir / 'storm.sqlite3'
+        scans = options['scans'] or options['users']
+        mint = make_qr_payload if options['token_format'] == 'jwt' else make_qr_token
+
+        try:
+            with scratch_database(db_path):
+                event_ids, member_ids, scanners = seed_roster(
+                    users=options['users'], events=options['events'], scanners=options['scanners'],
+                )
+                # member i always goes to the same event, so repeats are retries, not overlaps
+                tokens = [
+                    mint(event_ids[(i % len(member_ids)) % len(event_ids)], member_ids[i % len(member_ids)])
+                    for i in range(scans)
+                ]
+                report = self.storm(tokens, scanners)
+                report['attendance_rows'] = Attendance.objects.count()
+        finally:
+            if workdir is not None:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+        report.update({
+            'users': options['users'],
+            'events': options['events'],
+            'scanners': options['scanners'],
+            'token_format': options['token_format'],
+        })
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            Path(options['output']).write_text(output)
+        self.stdout.write(output)
+
+    def storm(self, tokens, scanners):
+        position = iter(range(len(tokens)))
+        lock = threading.Lock()
+
+        def scanner_thread(username):
+            # 'testserver' is not in ALLOWED_HOSTS outside the test runner
+            client = Client(SERVER_NAME='localhost')
+            client.force_login(User.objects.get(username=username))
+            latencies, queries, outcomes, lock_errors = [], 0, {}, 0
+            try:
+                while True:
+                    with lock:
+                        i = next(position, None)
+                    if i is None:
+                        break
+                    body = json.dumps({'token': tokens[i]})
+                    start = time.perf_counter()
+                    with CaptureQueriesContext(connection) as ctx:
+                        try:
+                            response = client.post('/api/scan/', body, content_type='application/json')
+                            if response.get('Content-Type') == 'application/json':
+                                data = response.json()
+                                outcome = data.get('message') or data.get('error')
+                            else:
+                                data = {}
+                                outcome = f'http_{response.status_code}'
+                            if 'locked' in str(data.get('details', '')):
+                                lock_errors += 1
+                        except OperationalError as e:
+                            outcome = 'operational_error'
+                            lock_errors += 'locked' in str(e)
+                    latencies.append(time.perf_counter() - start)
+                    queries += len(ctx.captured_queries)
+                    outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            finally:
+                connection.close()
+            return latencies, queries, outcomes, lock_errors
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(scanners)) as executor:
+            runs = list(executor.map(scanner_thread, scanners))
+        elapsed = time.perf_counter() - started
+
+        samples = [t for latencies, _, _, _ in runs for t in latencies]
+        outcomes = {}
+        for _, _, counts, _ in runs:
+            for key, value in counts.items():
+                outcomes[key] = outcomes.get(key, 0) + value
+        return {
+            'scans': len(samples),
+            'elapsed_s': round(elapsed, 3),
+            'scans_per_s': round(len(samples) / elapsed, 1),
+            **percentiles(samples),
+            'sqlite_lock_errors': sum(errors for _, _, _, errors in runs),
+            'queries_per_scan': round(sum(q for _, q, _, _ in runs) / max(1, len(samples)), 2),
+            'outcomes': outcomes,
+        }
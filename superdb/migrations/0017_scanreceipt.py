@@ -0,0 +1,27 @@
+# Generated by Django 5.2.8 on 2026-10-18 20:18
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('superdb', '0016_log'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScanReceipt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scan_id', models.UUIDField(unique=True)),
+                ('scanned_at', models.DateTimeField()),
+                ('status', models.PositiveSmallIntegerField()),
+                ('response', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('scanner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='scan_receipts', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
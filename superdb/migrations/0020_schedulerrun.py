@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-18 20:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('superdb', '0019_badgearchive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SchedulerRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('catch_up', 'Backlog catch-up'), ('event_end', 'End of event')], max_length=10)),
+                ('started_at', models.DateTimeField(db_index=True)),
+                ('duration_ms', models.FloatField()),
+                ('events', models.PositiveIntegerField(default=0)),
+                ('penalties', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0)),
+                ('queries', models.PositiveIntegerField(default=0)),
+                ('apply_ms', models.FloatField(default=0)),
+                ('max_lag_s', models.FloatField(blank=True, null=True)),
+                ('mean_lag_s', models.FloatField(blank=True, null=True)),
+                ('budget_exhausted', models.BooleanField(default=False)),
+            ],
+            options={
+                'ordering': ['-started_at'],
+            },
+        ),
+    ]
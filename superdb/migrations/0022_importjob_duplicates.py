@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 20:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('superdb', '0021_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='conflicts',
+            field=models.JSONField(default=list),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='duplicates',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
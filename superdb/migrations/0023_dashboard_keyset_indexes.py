@@ -0,0 +1,21 @@
+# Generated by Django 5.2.8 on 2026-10-18 21:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('superdb', '0022_importjob_duplicates'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['start_time', 'id'], name='superdb_eve_start_t_6abb09_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='penalty',
+            index=models.Index(fields=['created_at', 'id'], name='superdb_pen_created_45a058_idx'),
+        ),
+    ]
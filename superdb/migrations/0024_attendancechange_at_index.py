@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-18 21:26
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('superdb', '0023_dashboard_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='attendancechange',
+            name='at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
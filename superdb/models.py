@@ -134,6 +134,9 @@ class Event(models.Model):
         at = at or timezone.now()
         return self.start_time <= at <= self.end_time
 
+    class Meta:
+        indexes = [models.Index(fields=['start_time', 'id'])]  # the dashboard's keyset order
+
     def __str__(self):
         return f"{self.title} ({self.start_time} → {self.end_time})"
 
@@ -152,6 +155,114 @@ class Attendance(models.Model):
     def __str__(self): 
         return f"{self.user} @ {self.event} at {self.checked_at}"
 
+class ScanReceipt(models.Model):
+    """Outcome of a replayed offline scan, keyed by the scanner's scan UUID."""
+    scan_id = models.UUIDField(unique=True)
+    scanner = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name='scan_receipts')
+    scanned_at = models.DateTimeField()
+    status = models.PositiveSmallIntegerField()
+    response = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Scan {self.scan_id} ({self.status})"
+
+ATTENDANCE_CHANGE_ACTIONS = [
+    ('checkin', 'Check-in'),
+    ('undo', 'Check-in Undone'),
+]
+
+class AttendanceChange(models.Model):
+    """Append-only feed of attendance deltas, streamed to live views."""
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='attendance_changes')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    action = models.CharField(max_length=10, choices=ATTENDANCE_CHANGE_ACTIONS)
+    scanner = models.CharField(max_length=150, blank=True, default='')  # username snapshot
+    at = models.DateTimeField(default=timezone.now, db_index=True)  # for the retention sweep
+
+    def __str__(self):
+        return f"{self.get_action_display()}: {self.user_id} @ {self.event_id}"
+
+BADGE_ARCHIVE_STATUS = [
+    ('queued', 'Queued'),
+    ('running', 'Running'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+]
+
+class BadgeArchive(models.Model):
+    """A bulk QR ZIP built in the background and kept on disk for download."""
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='badge_archives')
+    scope = models.CharField(max_length=10, default='members')  # 'members' or 'assigned'
+    roster_key = models.CharField(max_length=64)  # digest of the roster and token window
+    status = models.CharField(max_length=10, choices=BADGE_ARCHIVE_STATUS, default='queued')
+    done = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    path = models.CharField(max_length=500, blank=True, default='')
+    error = models.TextField(blank=True, default='')
+    requested_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['event', 'scope', 'roster_key'])]
+
+    def __str__(self):
+        return f"Badges for {self.event_id} ({self.status} {self.done}/{self.total})"
+
+class ImportJob(models.Model):
+    """
+    A staged spreadsheet import (see superdb.imports) written in the
+    background. `processed` counts rows already committed, so a failed
+    job resumes from the next chunk.
+    """
+    import_id = models.CharField(max_length=32)
+    mode = models.CharField(max_length=20)
+    mapping = models.JSONField(default=dict)
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES, default='member')
+    status = models.CharField(max_length=10, choices=BADGE_ARCHIVE_STATUS, default='queued')
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    created = models.PositiveIntegerField(default=0)
+    updated = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    duplicates = models.PositiveIntegerField(default=0)  # rows repeating an earlier username
+    errors = models.JSONField(default=list)  # per-row problems, capped
+    conflicts = models.JSONField(default=list)  # the duplicates and what they became, capped
+    error = models.TextField(blank=True, default='')  # what stopped the job
+    requested_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Import {self.import_id[:8]} ({self.status} {self.processed}/{self.total})"
+
+SCHEDULER_RUN_KINDS = [
+    ('catch_up', 'Backlog catch-up'),
+    ('event_end', 'End of event'),
+]
+
+class SchedulerRun(models.Model):
+    """One scheduler task run: timings, work done and how late it was."""
+    kind = models.CharField(max_length=10, choices=SCHEDULER_RUN_KINDS)
+    started_at = models.DateTimeField(db_index=True)
+    duration_ms = models.FloatField()
+    events = models.PositiveIntegerField(default=0)
+    penalties = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    queries = models.PositiveIntegerField(default=0)
+    apply_ms = models.FloatField(default=0)  # time inside apply_no_show_penalties
+    max_lag_s = models.FloatField(null=True, blank=True)  # processed minus end_time
+    mean_lag_s = models.FloatField(null=True, blank=True)
+    budget_exhausted = models.BooleanField(default=False)
+
+    class Meta:
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return f"{self.get_kind_display()} at {self.started_at:%Y-%m-%d %H:%M}: {self.events} events in {self.duration_ms:.0f}ms"
+
 class Penalty(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='penalties')
     type = models.CharField(max_length=10, choices=PENALTY_TYPES, default='add')
@@ -161,6 +272,9 @@ class Penalty(models.Model):
     active = models.BooleanField(default=True)
     previouslevel = models.IntegerField(default=0)
 
+    class Meta:
+        indexes = [models.Index(fields=['created_at', 'id'])]  # the dashboard's keyset order
+
     def __str__(self):
         return f"Penalty {self.user} ({'active' if self.active else 'inactive'})"
         
@@ -0,0 +1,88 @@
+# superdb/pdf.py
+"""
+Just enough of PDF 1.4 to stream vector pages: objects are written as soon
+as they are ready and only the page tree, cross-reference table and trailer
+wait for the end. Text uses the standard Helvetica fonts (WinAnsi), so
+nothing is embedded.
+"""
+import zlib
+
+A4 = (595.28, 841.89)  # points
+
+FONTS = {
+    'F1': 'Helvetica',
+    'F2': 'Helvetica-Bold',
+}
+
+# object numbers fixed up front; pages and their contents follow
+CATALOG, PAGES, FIRST_FONT = 1, 2, 3
+
+
+def pdf_string(text):
+    """A PDF literal string; characters outside WinAnsi become '?'."""
+    raw = text.encode('cp1252', 'replace')
+    return b'(' + raw.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+def text_width(text, size):
+    """Rough Helvetica width, enough to centre a label."""
+    return len(text) * size * 0.5
+
+
+class PdfStream:
+    """
+    Build a PDF incrementally: each call to page() returns the bytes to send
+    next, and finish() returns the tail.
+    """
+
+    def __init__(self, page_size=A4):
+        self.page_size = page_size
+        self.offsets = {}
+        self.position = 0
+        self.page_ids = []
+        self.next_id = FIRST_FONT + len(FONTS)
+
+    def _object(self, number, body):
+        self.offsets[number] = self.position
+        data = b'%d 0 obj\n' % number + body + b'\nendobj\n'
+        self.position += len(data)
+        return data
+
+    def start(self):
+        head = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+        self.position = len(head)
+        out = [head, self._object(CATALOG, b'<< /Type /Catalog /Pages %d 0 R >>' % PAGES)]
+        for i, (name, base) in enumerate(FONTS.items()):
+            out.append(self._object(
+                FIRST_FONT + i,
+                b'<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>' % base.encode(),
+            ))
+        return b''.join(out)
+
+    def page(self, content):
+        """Add one page whose content stream is `content` (raw operators)."""
+        content_id, page_id = self.next_id, self.next_id + 1
+        self.next_id += 2
+        self.page_ids.append(page_id)
+        packed = zlib.compress(content)
+        fonts = b' '.join(b'/%s %d 0 R' % (name.encode(), FIRST_FONT + i) for i, name in enumerate(FONTS))
+        width, height = self.page_size
+        return b''.join([
+            self._object(content_id, b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(packed) + packed + b'\nendstream'),
+            self._object(page_id, (
+                b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %.2f %.2f] '
+                b'/Resources << /Font << %s >> >> /Contents %d 0 R >>'
+            ) % (PAGES, width, height, fonts, content_id)),
+        ])
+
+    def finish(self):
+        kids = b' '.join(b'%d 0 R' % i for i in self.page_ids)
+        out = [self._object(PAGES, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(self.page_ids)))]
+        xref_at = self.position
+        size = self.next_id
+        xref = [b'xref\n0 %d\n' % size, b'0000000000 65535 f \n']
+        for number in range(1, size):
+            xref.append(b'%010d 00000 n \n' % self.offsets[number])
+        out.extend(xref)
+        out.append(b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (size, CATALOG, xref_at))
+        return b''.join(out)
@@ -0,0 +1,90 @@
+# superdb/penalties.py
+"""
+No-show penalties, shared by the scheduler and the manual "end event" path.
+
+The no-show set is read once, every Penalty row goes in through
+bulk_create, and penalty levels move with one conditional UPDATE, all in
+a single transaction, so an event costs a handful of queries whatever its
+size.
+"""
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+
+from .instrumentation import measure_apply
+from .models import User, Penalty, Event
+
+SYSTEM_USERNAME = 'whatisasystem'
+BAN_AT_LEVEL = 3  # no-show penalties; 1-2 leave the user warned
+
+
+def get_system_user():
+    """The SYSTEM account penalties and scheduler logs are attributed to."""
+    user, _ = User.objects.get_or_create(
+        username=SYSTEM_USERNAME,
+        defaults={
+            'displayname': 'SYSTEM',
+            'role': 'core',
+            'password': 'D@kn1r_12'  # Not a real login
+        }
+    )
+    return user
+
+
+def no_show_users(event):
+    """Assigned users with no attendance for the event."""
+    return event.assigned_users.exclude(id__in=event.attendances.values('user_id'))
+
+
+def apply_no_show_penalties(event, system_user=None):
+    """
+    Apply penalties to all assigned users who didn't check in to an event.
+    Banned users and the SYSTEM user are skipped but still count as
+    no-shows. Returns (penalties_added, total_no_shows).
+    """
+    system_user = system_user or get_system_user()
+    reason = f"Failed to check in during the event ({event.title})"
+
+    with measure_apply(), transaction.atomic():
+        no_shows = list(no_show_users(event).values_list('id', 'penalty_level', 'penalty_status', 'username'))
+        targets = [
+            (user_id, level) for user_id, level, status, username in no_shows
+            if status != 'banned' and username != SYSTEM_USERNAME
+        ]
+        if targets:
+            Penalty.objects.bulk_create(
+                [
+                    Penalty(user_id=user_id, type='add', reason=reason, admin=system_user, active=True, previouslevel=level)
+                    for user_id, level in targets
+                ],
+                batch_size=500,
+            )
+            # same filter as above, so SQLite gets a subquery rather than
+            # thousands of id parameters
+            (no_show_users(event)
+                .exclude(penalty_status='banned')
+                .exclude(username=SYSTEM_USERNAME)
+                .update(
+                    penalty_level=F('penalty_level') + 1,
+                    penalty_status=Case(
+                        When(penalty_level__gte=BAN_AT_LEVEL - 1, then=Value('banned')),
+                        default=Value('warned'),
+                    ),
+                ))
+
+    return len(targets), len(no_shows)
+
+
+def claim_no_show_penalties(event, system_user=None):
+    """
+    Mark the event processed and apply its penalties in one transaction,
+    but only if nobody else has. The conditional UPDATE is the claim:
+    concurrent runners serialise on it and all but one see zero rows.
+    Returns apply_no_show_penalties' result, or None if already claimed.
+    """
+    with transaction.atomic():
+        claimed = Event.objects.filter(pk=event.pk, penalties_processed=False).update(penalties_processed=True)
+        if not claimed:
+            return None
+        result = apply_no_show_penalties(event, system_user)
+    event.penalties_processed = True
+    return result
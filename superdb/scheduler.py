@@ -1,166 +1,233 @@
+from apscheduler.jobstores.base import JobLookupError
 from apscheduler.schedulers.background import BackgroundScheduler
+from django.conf import settings
 from django.utils import timezone
 import atexit
+import os
+import threading
+
+from superdb import tasks
+from superdb.tasks import enqueue
+
+# Each event gets a one-shot job at its end_time instead of a poll every
+# minute. Events changed in other processes reach the leader through
+# notify_leader; anything else (the Django admin, a crash) is picked up by
+# the startup pass and the hourly sweep.
+RECONCILE_EVERY_MINUTES = 60
+HOUSEKEEPING_EVERY_MINUTES = 60
+
+# Only one process per database runs the scheduler: whoever holds an
+# exclusive lock on a file next to it. The OS drops the lock when that
+# process dies, and the others keep retrying so one of them takes over.
+LEADER_LOCK_PATH = getattr(settings, 'SCHEDULER_LOCK_PATH', None) or f"{settings.DATABASES['default']['NAME']}.scheduler.lock"
+LEADER_RETRY_SECONDS = 30
+# Other processes cannot reach the leader's jobs, so they touch this file
+# when an event changes and a leader holds the lock; the leader stats it
+# every few seconds.
+EVENTS_CHANGED_PATH = f"{LEADER_LOCK_PATH}.events"
+CHANGE_CHECK_SECONDS = 10
 
 scheduler = None
 scheduler_started = False
+leader_lock = None  # open file holding the lock while this process leads
+events_seen = None  # mtime of EVENTS_CHANGED_PATH at the last reconcile
+
+
+def event_job_id(event_id):
+    return f'event_end:{event_id}'
 
 
-def apply_no_show_penalties(event):
+def run_event_end(event_id):
+    """APScheduler job at an event's end_time; the work itself is a task."""
+    enqueue(tasks.process_event_end, event_id)
+
+
+def schedule_event_end(event):
     """
-    Apply penalties to all assigned users who didn't check in to an event.
-    Returns (penalties_added, total_no_shows)
+    Create, move or drop the end-of-event job for `event` so it matches the
+    row. Called whenever an event is created, edited or deleted; a no-op in
+    processes that are not running the scheduler.
     """
-    from superdb.models import User, Penalty
-    
-    # Get or create the SYSTEM user
-    system_user, _ = User.objects.get_or_create(
-        username='whatisasystem',
-        defaults={
-            'displayname': 'SYSTEM',
-            'role': 'core',
-            'password': 'D@kn1r_12'
-        }
+    if scheduler is None:
+        notify_leader()
+        return
+    if event.penalties_processed:
+        unschedule_event_end(event.id)
+        return
+    scheduler.add_job(
+        run_event_end,
+        'date',
+        run_date=max(event.end_time, timezone.now()),
+        args=[event.id],
+        id=event_job_id(event.id),
+        replace_existing=True,
+        misfire_grace_time=None,  # late is still better than never
     )
-    
-    # Get all assigned users
-    assigned_users = event.assigned_users.all()
-    
-    # Get users who checked in
-    checked_in_user_ids = event.attendances.values_list('user_id', flat=True)
-    
-    # Find users who didn't check in
-    no_show_users = assigned_users.exclude(id__in=checked_in_user_ids)
-    
-    penalties_added = 0
-    
-    for user in no_show_users:
-        # Skip if user is already banned
-        if user.penalty_status == 'banned':
-            continue
-        
-        # Skip the SYSTEM user itself
-        if user.username == 'whatisasystem':
-            continue
-        
-        # Create penalty record
-        Penalty.objects.create(
-            user=user,
-            type='add',
-            reason=f"Failed to check in during the event ({event.title})",
-            admin=system_user,
-            active=True,
-            previouslevel=user.penalty_level
-        )
-        
-        # Update user's penalty level and status
-        user.penalty_level += 1
-        
-        # Update status based on penalty level
-        if user.penalty_level >= 3:
-            user.penalty_status = 'banned'
-        elif user.penalty_level >= 1:
-            user.penalty_status = 'warned'
-        
-        user.save()
-        penalties_added += 1
-    
-    return penalties_added, no_show_users.count()
-
-
-def process_ended_events():
-    """Check for ended events and apply penalties - runs every minute."""
+
+
+def unschedule_event_end(event_id):
+    if scheduler is None:
+        # the leader's job finds the event gone and does nothing
+        return
     try:
-        from superdb.models import Event, Log
-        
-        now = timezone.now()
-        
-        ended_events = Event.objects.filter(
-            end_time__lt=now,
-            penalties_processed=False
-        )
-        
-        if not ended_events.exists():
-            print(f"[AUTO-PENALTY] {now.strftime('%H:%M:%S')} - No events to process")
-            return
-        
-        # Get SYSTEM user for logging
-        from superdb.models import User
-        system_user, _ = User.objects.get_or_create(
-            username='whatisasystem',
-            defaults={
-                'displayname': 'SYSTEM',
-                'role': 'core',
-                'password': 'SYSTEM_NO_LOGIN_ALLOWED_12345!'
-            }
-        )
-        
-        total_events = 0
-        total_penalties = 0
-        
-        for event in ended_events:
-            penalties_added, total_no_shows = apply_no_show_penalties(event)
-            event.penalties_processed = True
-            event.save()
-            
-            total_events += 1
-            total_penalties += penalties_added
-            
-            # Log the scheduler action
-            Log.log(
-                action='scheduler_run',
-                user=system_user,
-                target_event=event,
-                details=f"Auto-processed event '{event.title}': {penalties_added} penalties for {total_no_shows} no-shows"
-            )
-            
-            print(f"[AUTO-PENALTY] Processed: {event.title} - {penalties_added} penalties for {total_no_shows} no-shows")
-        
-        print(f"[AUTO-PENALTY] ✅ Completed: {total_events} events, {total_penalties} total penalties")
-    
+        scheduler.remove_job(event_job_id(event_id))
+    except JobLookupError:
+        pass
+
+
+def reconcile_event_jobs():
+    """
+    Catch up on events that ended while no scheduler was running, then make
+    sure every upcoming unprocessed event has its job.
+    """
+    from superdb.models import Event
+
+    enqueue(tasks.process_ended_events)
+    try:
+        upcoming = Event.objects.filter(end_time__gte=timezone.now(), penalties_processed=False)
+        for event in upcoming.only('id', 'end_time', 'penalties_processed'):
+            schedule_event_end(event)
     except Exception as e:
-        print(f"[AUTO-PENALTY] Error: {e}")
+        print(f"[AUTO-PENALTY] Reconcile failed: {e}")
 
 
-def start_scheduler():
-    """Start the background scheduler."""
-    global scheduler, scheduler_started
-    
-    if scheduler_started:
+def run_housekeeping():
+    enqueue(tasks.housekeeping)
+
+
+def leader_running():
+    """True if another process holds the scheduler lock."""
+    try:
+        import fcntl
+    except ImportError:
+        return False  # no flock: the only scheduler is in this process
+    try:
+        lock = open(LEADER_LOCK_PATH)
+    except FileNotFoundError:
+        return False
+    with lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except OSError:
+            return True
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        return False
+
+
+def notify_leader():
+    # nobody is listening; a leader that starts later reconciles anyway
+    if not leader_running():
         return
-    
+    try:
+        with open(EVENTS_CHANGED_PATH, 'a'):
+            os.utime(EVENTS_CHANGED_PATH)
+    except OSError as e:
+        print(f"[AUTO-PENALTY] Could not notify scheduler leader: {e}")
+
+
+def _events_changed_mtime():
+    try:
+        return os.stat(EVENTS_CHANGED_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def check_for_event_changes():
+    """Reconcile when another process has reported an event change."""
+    global events_seen
+    changed = _events_changed_mtime()
+    if changed != events_seen:
+        events_seen = changed
+        reconcile_event_jobs()
+
+
+def try_become_leader():
+    """Take the scheduler lock without blocking; True if this process now holds it."""
+    global leader_lock
+    if leader_lock is not None:
+        return True
+    try:
+        import fcntl
+    except ImportError:
+        # no flock (Windows): single-process dev servers only
+        return True
+
+    lock = open(LEADER_LOCK_PATH, 'a+')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return False
+    lock.seek(0)
+    lock.truncate()
+    lock.write(f"{os.getpid()}\n")
+    lock.flush()
+    leader_lock = lock
+    return True
+
+
+def _wait_for_leadership():
+    stop = threading.Event()
+    atexit.register(stop.set)
+    while not stop.wait(LEADER_RETRY_SECONDS):
+        if try_become_leader():
+            print(f"[AUTO-PENALTY] Process {os.getpid()} took over as scheduler leader")
+            _start()
+            return
+
+
+def _start():
+    global scheduler, scheduler_started, events_seen
+
+    events_seen = _events_changed_mtime()
     scheduler = BackgroundScheduler(daemon=True)
     scheduler.add_job(
-        process_ended_events,
+        reconcile_event_jobs,
+        'interval',
+        minutes=RECONCILE_EVERY_MINUTES,
+        id='reconcile_event_jobs',
+        replace_existing=True,
+        max_instances=1,
+        next_run_time=timezone.now(),  # the startup pass
+    )
+    scheduler.add_job(
+        run_housekeeping,
         'interval',
-        minutes=1,
-        id='process_ended_events',
+        minutes=HOUSEKEEPING_EVERY_MINUTES,
+        id='housekeeping',
         replace_existing=True,
-        max_instances=1
+        max_instances=1,
+    )
+    scheduler.add_job(
+        check_for_event_changes,
+        'interval',
+        seconds=CHANGE_CHECK_SECONDS,
+        id='check_for_event_changes',
+        replace_existing=True,
+        max_instances=1,
     )
     scheduler.start()
     scheduler_started = True
-    
+
     # Shut down scheduler when Django exits
     atexit.register(lambda: scheduler.shutdown(wait=False))
-    
-    print("[AUTO-PENALTY] ✅ Scheduler started - checking every minute")
+
+    print("[AUTO-PENALTY] ✅ Scheduler started - one job per event end")
 
 
 def start_scheduler():
-    """Start the background scheduler."""
-    global scheduler
-    
-    if scheduler is not None:
+    """
+    Start the background scheduler if this process wins the leader lock,
+    otherwise stand by and retry in the background.
+    """
+    global scheduler_started
+
+    if scheduler_started:
         return
-    
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(
-        process_ended_events,
-        'interval',
-        minutes=1,
-        id='process_ended_events',
-        replace_existing=True
-    )
-    scheduler.start()
-    print("[AUTO-PENALTY] Scheduler started - checking every minute")
\ No newline at end of file
+    scheduler_started = True
+
+    if try_become_leader():
+        _start()
+        return
+    threading.Thread(target=_wait_for_leadership, name='scheduler-standby', daemon=True).start()
+    print(f"[AUTO-PENALTY] Process {os.getpid()} standing by; another process runs the scheduler")
@@ -0,0 +1,139 @@
+# superdb/sheets.py
+"""
+Google Sheets CSV downloads for URL imports.
+
+One pooled requests.Session is shared by the process, every request has
+explicit connect/read timeouts, and the body is streamed to a file rather
+than held in memory. Downloads are kept under SHEET_CACHE_DIR with their
+ETag and Last-Modified, so importing an unchanged sheet again costs a
+conditional request answered with 304. Sheets can hold passwords, so
+copies older than SHEET_CACHE_RETENTION_SECONDS are deleted (prune_cache).
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# {sheet_id} is filled in; tests point this at a local server
+SHEETS_EXPORT_URL = getattr(settings, 'SHEETS_EXPORT_URL', 'https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=csv')
+SHEET_CACHE_DIR = getattr(settings, 'SHEET_CACHE_DIR', os.path.join(settings.BASE_DIR, '.sheet_cache'))
+FETCH_TIMEOUT = (5, 30)  # seconds to connect, seconds between bytes
+MAX_SHEET_BYTES = 50 * 1024 * 1024
+SHEET_CACHE_RETENTION_SECONDS = 24 * 3600
+DOWNLOAD_CHUNK = 64 * 1024
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class SheetFetchError(Exception):
+    pass
+
+
+def sheet_id_from_url(url):
+    try:
+        return url.split("/d/")[1].split("/")[0]
+    except (AttributeError, IndexError):
+        raise SheetFetchError("Not a Google Sheets URL") from None
+
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            retry = Retry(total=2, backoff_factor=0.5, status_forcelist=(502, 503, 504), allowed_methods=('GET',))
+            session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry))
+            session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry))
+            _session = session
+    return _session
+
+
+def _cache_paths(export_url):
+    key = hashlib.sha256(export_url.encode()).hexdigest()
+    base = os.path.join(SHEET_CACHE_DIR, key)
+    return f'{base}.csv', f'{base}.json'
+
+
+def prune_cache():
+    """Delete cached downloads older than SHEET_CACHE_RETENTION_SECONDS; returns how many went."""
+    if not os.path.isdir(SHEET_CACHE_DIR):
+        return 0
+    cutoff = time.time() - SHEET_CACHE_RETENTION_SECONDS
+    removed = 0
+    for entry in os.scandir(SHEET_CACHE_DIR):
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_atomic(path, write):
+    fd, partial = tempfile.mkstemp(dir=SHEET_CACHE_DIR, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            write(out)
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+
+def fetch_sheet_csv(url):
+    """
+    Return (path, changed): a local copy of the sheet's CSV export, and
+    False when the server confirmed the cached copy is still current.
+    """
+    export_url = SHEETS_EXPORT_URL.format(sheet_id=sheet_id_from_url(url))
+    os.makedirs(SHEET_CACHE_DIR, exist_ok=True)
+    prune_cache()
+    data_path, meta_path = _cache_paths(export_url)
+
+    headers = {}
+    meta = _read_meta(meta_path) if os.path.exists(data_path) else {}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+
+    try:
+        with get_session().get(export_url, headers=headers, stream=True, timeout=FETCH_TIMEOUT) as response:
+            if response.status_code == 304 and meta:
+                return data_path, False
+            if response.status_code != 200:
+                raise SheetFetchError(f"Sheet download failed ({response.status_code}); is the sheet shared for viewing?")
+
+            def download(out):
+                size = 0
+                for chunk in response.iter_content(DOWNLOAD_CHUNK):
+                    size += len(chunk)
+                    if size > MAX_SHEET_BYTES:
+                        raise SheetFetchError(f"Sheet is larger than {MAX_SHEET_BYTES // (1024 * 1024)}MB")
+                    out.write(chunk)
+
+            _write_atomic(data_path, download)
+            meta = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+    except requests.RequestException as e:
+        raise SheetFetchError(f"Could not reach Google Sheets: {e}") from e
+
+    _write_atomic(meta_path, lambda out: out.write(json.dumps(meta).encode()))
+    return data_path, True
@@ -0,0 +1,189 @@
+# superdb/tasks.py
+"""
+Background jobs. With CELERY_BROKER_URL set they go to Celery workers;
+otherwise they run on a small in-process thread pool, or inline when
+JOB_BACKEND is 'eager' (tests, one-off commands).
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from celery import shared_task
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .instrumentation import scheduler_run, current_run
+from .models import BadgeArchive, Event, ImportJob, Log
+from .penalties import claim_no_show_penalties, get_system_user
+
+JOB_BACKEND = getattr(settings, 'JOB_BACKEND', 'thread')  # 'celery', 'thread' or 'eager'
+JOB_THREADS = getattr(settings, 'JOB_THREADS', 2)
+
+# Backlog catch-up after downtime: events per query and seconds per run
+CATCHUP_CHUNK = 50
+CATCHUP_BUDGET_SECONDS = 20
+
+_executor = None
+
+
+def _run_in_thread(task, args):
+    close_old_connections()
+    try:
+        task(*args)
+    finally:
+        close_old_connections()
+
+
+def enqueue(task, *args):
+    if JOB_BACKEND == 'celery':
+        task.delay(*args)
+    elif JOB_BACKEND == 'eager':
+        task(*args)
+    else:
+        global _executor
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=JOB_THREADS, thread_name_prefix='jobs')
+        _executor.submit(_run_in_thread, task, args)
+
+
+@shared_task
+def build_badge_archive(archive_id, window_start):
+    from .badges import badge_roster, roster_key, build_badge_archive as build
+
+    archive = BadgeArchive.objects.select_related('event').get(pk=archive_id)
+    try:
+        members = badge_roster(archive.event, archive.scope)
+        # the roster may have moved since the request; file the archive
+        # under what it actually contains
+        archive.roster_key = roster_key(archive.event_id, archive.scope, members, window_start)
+        BadgeArchive.objects.filter(pk=archive_id).update(roster_key=archive.roster_key)
+        build(archive, members, window_start)
+    except Exception as e:
+        print(f"[JOBS] Badge archive {archive_id} failed: {e}")
+        BadgeArchive.objects.filter(pk=archive_id).update(status='failed', error=str(e), finished_at=timezone.now())
+
+
+@shared_task
+def run_import_job(job_id):
+    from .imports import run_import_job as run
+
+    # queued -> running is the claim; a duplicate delivery finds it taken
+    if not ImportJob.objects.filter(pk=job_id, status='queued').update(status='running', updated_at=timezone.now()):
+        return
+    job = ImportJob.objects.get(pk=job_id)
+    try:
+        run(job)
+    except Exception as e:
+        print(f"[JOBS] Import {job_id} failed after {job.processed} rows: {e}")
+        ImportJob.objects.filter(pk=job_id).update(status='failed', error=str(e), finished_at=timezone.now(), updated_at=timezone.now())
+
+
+def penalize_ended_event(event, system_user=None):
+    """
+    Claim one ended event, apply its no-show penalties and log it, all in
+    one transaction. Returns the number of penalties, or None if another
+    runner had already claimed the event.
+    """
+    system_user = system_user or get_system_user()
+    with transaction.atomic():
+        result = claim_no_show_penalties(event, system_user)
+        if result is None:
+            return None
+        penalties_added, total_no_shows = result
+
+        # Log the scheduler action
+        Log.log(
+            action='scheduler_run',
+            user=system_user,
+            target_event=event,
+            details=f"Auto-processed event '{event.title}': {penalties_added} penalties for {total_no_shows} no-shows"
+        )
+
+    print(f"[AUTO-PENALTY] Processed: {event.title} - {penalties_added} penalties for {total_no_shows} no-shows")
+    run = current_run()
+    if run is not None:
+        run.event_processed(event, penalties_added)
+    return penalties_added
+
+
+@shared_task
+def process_event_end(event_id):
+    """Penalise one event's no-shows once it has ended."""
+    with scheduler_run('event_end') as run:
+        try:
+            event = Event.objects.filter(pk=event_id).first()
+            if event is None or event.penalties_processed:
+                return
+            if event.end_time > timezone.now():
+                # moved later since its job was scheduled
+                from .scheduler import schedule_event_end
+                schedule_event_end(event)
+                return
+            penalize_ended_event(event)
+
+        except Exception as e:
+            run.event_failed()
+            print(f"[AUTO-PENALTY] Error processing event {event_id}: {e}")
+
+
+@shared_task
+def process_ended_events(budget_seconds=None):
+    """
+    Work through ended, unprocessed events oldest first, CATCHUP_CHUNK at a
+    time. Each event is claimed and processed in its own transaction, so a
+    failure only skips that event (the next sweep retries it). When the
+    time budget runs out the rest is handed to a fresh task.
+    """
+    budget = CATCHUP_BUDGET_SECONDS if budget_seconds is None else budget_seconds
+    with scheduler_run('catch_up') as run:
+        return _catch_up(run, time.monotonic() + budget)
+
+
+def _catch_up(run, deadline):
+    now = timezone.now()
+    system_user = get_system_user()
+    backlog = Event.objects.filter(end_time__lt=now, penalties_processed=False).order_by('end_time', 'id')
+
+    after = None  # (end_time, id) of the last event looked at
+    while True:
+        chunk = backlog
+        if after is not None:
+            chunk = chunk.filter(Q(end_time__gt=after[0]) | Q(end_time=after[0], id__gt=after[1]))
+        chunk = list(chunk[:CATCHUP_CHUNK])
+        if not chunk:
+            break
+        for event in chunk:
+            if run.events + run.failed and time.monotonic() > deadline:
+                run.budget_exhausted = True
+                print(f"[AUTO-PENALTY] Catch-up paused after {run.events} events; continuing in a new task")
+                enqueue(process_ended_events)
+                return run.events
+            after = (event.end_time, event.id)
+            try:
+                penalize_ended_event(event, system_user)
+            except Exception as e:
+                run.event_failed()
+                print(f"[AUTO-PENALTY] Error processing event {event.id} ({event.title}): {e}")
+
+    return run.events
+
+
+@shared_task
+def housekeeping():
+    """Hourly clean-up that must run however the web app is served."""
+    from .badges import prune_badge_archives
+    from .live import prune_feed
+    from .sheets import prune_cache
+
+    for name, prune in (
+        ('attendance feed rows', prune_feed),
+        ('badge archive files', prune_badge_archives),
+        ('cached sheet downloads', prune_cache),
+    ):
+        try:
+            removed = prune()
+            if removed:
+                print(f"[JOBS] Housekeeping removed {removed} {name}")
+        except Exception as e:
+            print(f"[JOBS] Housekeeping of {name} failed: {e}")
@@ -1,3 +1,1233 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import http.server
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from pathlib import Path
+from datetime import timedelta
+from io import BytesIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+import pandas as pd
+
+from superdb.models import User, Event, Attendance, Graup, Penalty, AttendanceChange, Log, SchedulerRun, BadgeArchive
+from superdb.utils import make_qr_payload, make_compact_qr_payload, decode_qr_token, token_cache
+from superdb import views, live, badges, penalties, scheduler, tasks, imports, sheets
+
+
+class ScanEndpointTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        now = timezone.now()
+        self.group = Graup.objects.create(name='Blue')
+        self.scanner = User.objects.create(username='scanner', role='scanner')
+        self.member = User.objects.create(username='member', displayname='Member', graup=self.group)
+        self.event = Event.objects.create(title='Live', start_time=now - timedelta(hours=1), end_time=now + timedelta(hours=1))
+
+    def scan(self, event_id, user_id):
+        request = self.factory.post(
+            '/api/scan/',
+            data=json.dumps({'token': make_qr_payload(event_id, user_id)}),
+            content_type='application/json',
+        )
+        request.user = self.scanner
+        request.auser = sync_to_async(lambda: self.scanner)
+        response = async_to_sync(views.scan_endpoint)(request)
+        return response.status_code, json.loads(response.content)
+
+    def test_checkin_contract(self):
+        status, body = self.scan(self.event.id, self.member.id)
+        self.assertEqual(status, 200)
+        attendance = Attendance.objects.get(event=self.event, user=self.member)
+        self.assertEqual(body, {
+            'ok': True, 'message': 'checked_in', 'username': 'member', 'eventname': 'Live',
+            'group': 'Blue', 'user': self.member.id, 'event': self.event.id,
+            'checked_at': attendance.checked_at.isoformat(),
+        })
+        self.assertEqual(attendance.scanner, self.scanner)
+
+    def test_checkin_query_budget(self):
+        # one lookup query for event/user/group/flags, the INSERT, and its
+        # row in the live attendance feed; the two writes share a
+        # transaction, which inside TestCase shows up as a savepoint pair
+        with self.assertNumQueries(5):
+            status, _ = self.scan(self.event.id, self.member.id)
+        self.assertEqual(status, 200)
+
+    def test_failed_feed_write_rolls_back_the_checkin(self):
+        with mock.patch('superdb.views.record_checkins', side_effect=RuntimeError('feed down')):
+            status, body = self.scan(self.event.id, self.member.id)
+        self.assertEqual((status, body['error']), (500, 'db_error'))
+        self.assertFalse(Attendance.objects.filter(event=self.event, user=self.member).exists())
+        self.assertEqual(self.scan(self.event.id, self.member.id)[0], 200)
+
+    def test_groupless_user(self):
+        self.member.graup = None
+        self.member.save()
+        _, body = self.scan(self.event.id, self.member.id)
+        self.assertEqual(body['group'], 'Groupless')
+
+    def test_missing_rows(self):
+        self.assertEqual(self.scan(self.event.id + 100, self.member.id), (404, {'ok': False, 'error': 'no_event'}))
+        self.assertEqual(self.scan(self.event.id, self.member.id + 100), (404, {'ok': False, 'error': 'no_user'}))
+
+    def test_already_checked_in(self):
+        self.scan(self.event.id, self.member.id)
+        status, body = self.scan(self.event.id, self.member.id)
+        self.assertEqual(status, 400)
+        self.assertEqual(body['error'], 'This user is aleady checked in')
+
+    def test_banned_user(self):
+        self.member.penalty_status = 'banned'
+        self.member.save()
+        self.assertEqual(self.scan(self.event.id, self.member.id), (403, {'ok': False, 'error': 'user_banned'}))
+
+    def test_outside_event_time(self):
+        self.event.start_time = timezone.now() + timedelta(hours=1)
+        self.event.end_time = timezone.now() + timedelta(hours=2)
+        self.event.save()
+        status, body = self.scan(self.event.id, self.member.id)
+        self.assertEqual(status, 400)
+        self.assertEqual(body['error'], 'outside_event_time')
+
+    def test_role_checks(self):
+        body = json.dumps({'token': make_qr_payload(self.event.id, self.member.id)})
+        response = self.client.post('/api/scan/', body, content_type='application/json')
+        self.assertEqual(response.status_code, 302)
+        self.client.force_login(self.member)
+        response = self.client.post('/api/scan/', body, content_type='application/json')
+        self.assertEqual(response.status_code, 302)
+        self.client.force_login(self.scanner)
+        response = self.client.post('/api/scan/', body, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_check_status(self):
+        url = f'/api/check_status/?event_id={self.event.id}&user_id={self.member.id}'
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(self.member)
+        self.assertEqual(self.client.get(url).json(), {'ok': True, 'checked_in': False, 'banned': False})
+        Attendance.objects.create(event=self.event, user=self.member)
+        self.assertEqual(self.client.get(url).json(), {'ok': True, 'checked_in': True, 'banned': False})
+        bad = self.client.get(f'/api/check_status/?event_id={self.event.id + 100}&user_id={self.member.id}')
+        self.assertEqual(bad.status_code, 400)
+
+    def test_overlapping_scan_warns_then_bans(self):
+        other = Event.objects.create(title='Other', start_time=self.event.start_time, end_time=self.event.end_time)
+        Attendance.objects.create(event=other, user=self.member)
+
+        status, body = self.scan(self.event.id, self.member.id)
+        self.assertEqual((status, body['error'], body['penalty_level']), (400, 'warning_overlapping_scan', 1))
+        status, body = self.scan(self.event.id, self.member.id)
+        self.assertEqual((status, body['error']), (403, 'banned_due_to_multiple_overlaps'))
+
+        self.member.refresh_from_db()
+        self.assertEqual(self.member.penalty_status, 'banned')
+        self.assertEqual(Penalty.objects.filter(user=self.member).count(), 2)
+        self.assertFalse(Attendance.objects.filter(event=self.event, user=self.member).exists())
+
+
+class ScanBatchEndpointTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        now = timezone.now()
+        self.scanner = User.objects.create(username='scanner', role='scanner')
+        self.event = Event.objects.create(title='Live', start_time=now - timedelta(hours=1), end_time=now + timedelta(hours=1))
+        self.members = [User.objects.create(username=f'member{i}') for i in range(20)]
+
+    def scan_batch(self, tokens):
+        request = self.factory.post(
+            '/api/scan/batch/',
+            data=json.dumps({'tokens': tokens}),
+            content_type='application/json',
+        )
+        request.user = self.scanner
+        response = views.scan_batch_endpoint(request)
+        return json.loads(response.content)['results']
+
+    def test_results_follow_token_order(self):
+        results = self.scan_batch([
+            make_qr_payload(self.event.id, self.members[0].id),
+            'garbage',
+            make_qr_payload(self.event.id, self.members[0].id),
+            make_qr_payload(self.event.id + 100, self.members[1].id),
+        ])
+        self.assertEqual([r['status'] for r in results], [200, 400, 400, 404])
+        self.assertEqual(results[0]['username'], 'member0')
+        self.assertEqual(results[1]['error'], 'token_invalid')
+        self.assertEqual(results[2]['error'], 'This user is aleady checked in')
+        self.assertEqual(results[3]['error'], 'no_event')
+        self.assertEqual(Attendance.objects.filter(event=self.event).count(), 1)
+
+    def test_query_count_is_flat(self):
+        # in_bulk events, in_bulk users, prior attendances, then one transaction
+        # (savepoint, attendance INSERT, feed INSERT, release) -- whatever the
+        # batch size
+        for members in (self.members[:5], self.members[5:]):
+            tokens = [make_qr_payload(self.event.id, m.id) for m in members]
+            with self.assertNumQueries(7):
+                results = self.scan_batch(tokens)
+            self.assertTrue(all(r['ok'] for r in results))
+
+    def test_overlap_inside_batch(self):
+        other = Event.objects.create(title='Other', start_time=self.event.start_time, end_time=self.event.end_time)
+        member = self.members[0]
+        results = self.scan_batch([
+            make_qr_payload(self.event.id, member.id),
+            make_qr_payload(other.id, member.id),
+            make_qr_payload(other.id, member.id),
+            make_qr_payload(other.id, member.id),
+        ])
+        self.assertEqual(
+            [r.get('error') for r in results],
+            [None, 'warning_overlapping_scan', 'banned_due_to_multiple_overlaps', 'user_banned'],
+        )
+        member.refresh_from_db()
+        self.assertEqual((member.penalty_level, member.penalty_status), (2, 'banned'))
+        self.assertEqual(Penalty.objects.filter(user=member).count(), 2)
+
+
+class ScanReplayEndpointTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        now = timezone.now()
+        self.scanner = User.objects.create(username='scanner', role='scanner')
+        self.member = User.objects.create(username='member')
+        self.event = Event.objects.create(title='Live', start_time=now - timedelta(hours=2), end_time=now - timedelta(minutes=10))
+
+    def replay(self, scans):
+        request = self.factory.post(
+            '/api/scan/replay/',
+            data=json.dumps({'scans': scans}),
+            content_type='application/json',
+        )
+        request.user = self.scanner
+        response = views.scan_replay_endpoint(request)
+        return json.loads(response.content)['results']
+
+    def scan(self, scan_id, scanned_at, user=None):
+        return {
+            'id': scan_id,
+            'token': make_qr_payload(self.event.id, (user or self.member).id),
+            'scanned_at': scanned_at.isoformat(),
+        }
+
+    def test_replay_is_idempotent(self):
+        scans = [self.scan('6f1c1e1e-0000-4000-8000-000000000001', timezone.now() - timedelta(minutes=30))]
+        first = self.replay(scans)
+        second = self.replay(scans)
+        self.assertEqual(first, second)
+        self.assertEqual(first[0]['status'], 200)
+        self.assertEqual(Attendance.objects.filter(event=self.event, user=self.member).count(), 1)
+
+    def test_replayed_overlap_penalises_once(self):
+        other = Event.objects.create(title='Other', start_time=self.event.start_time, end_time=self.event.end_time)
+        Attendance.objects.create(event=other, user=self.member)
+        scans = [self.scan('6f1c1e1e-0000-4000-8000-000000000002', timezone.now() - timedelta(minutes=30))]
+        self.replay(scans)
+        self.replay(scans)
+        self.assertEqual(Penalty.objects.filter(user=self.member).count(), 1)
+
+    def test_live_scan_and_its_replay_share_an_id(self):
+        # the live response is lost, then the queued copy is replayed
+        self.event.end_time = timezone.now() + timedelta(hours=1)
+        self.event.save()
+        other = Event.objects.create(title='Other', start_time=self.event.start_time, end_time=self.event.end_time)
+        Attendance.objects.create(event=other, user=self.member)
+        scan = self.scan('6f1c1e1e-0000-4000-8000-000000000006', timezone.now())
+
+        request = self.factory.post('/api/scan/', data=json.dumps({'token': scan['token'], 'id': scan['id']}), content_type='application/json')
+        request.user = self.scanner
+        request.auser = sync_to_async(lambda: self.scanner)
+        live_body = json.loads(async_to_sync(views.scan_endpoint)(request).content)
+
+        replayed = self.replay([scan])[0]
+        self.assertEqual(replayed['error'], live_body['error'])
+        self.assertEqual(Penalty.objects.filter(user=self.member).count(), 1)
+
+    def test_client_timestamp_and_skew(self):
+        late = self.replay([self.scan('6f1c1e1e-0000-4000-8000-000000000003', self.event.end_time + views.SCAN_CLOCK_SKEW + timedelta(seconds=5))])
+        self.assertEqual(late[0]['error'], 'outside_event_time')
+        within = self.replay([self.scan('6f1c1e1e-0000-4000-8000-000000000004', self.event.end_time + timedelta(seconds=30))])
+        self.assertEqual(within[0]['status'], 200)
+        future = self.replay([self.scan('6f1c1e1e-0000-4000-8000-000000000005', timezone.now() + timedelta(hours=1))])
+        self.assertEqual(future[0]['error'], 'bad_timestamp')
+
+
+class CompactTokenTests(TestCase):
+    def test_round_trip(self):
+        token = make_compact_qr_payload(12, 345)
+        self.assertEqual(len(token), 32)
+        self.assertRegex(token, r'^[A-Z2-7]+$')
+        payload, err = decode_qr_token(token)
+        self.assertIsNone(err)
+        self.assertEqual((payload['event'], payload['user']), (12, 345))
+
+    def test_tampered_token(self):
+        token = make_compact_qr_payload(12, 345)
+        flipped = token[:10] + ('A' if token[10] != 'A' else 'B') + token[11:]
+        self.assertEqual(decode_qr_token(flipped), (None, 'invalid'))
+        self.assertEqual(decode_qr_token('NOTATOKEN'), (None, 'invalid'))
+
+    def test_expiry(self):
+        token = make_compact_qr_payload(12, 345, valid_seconds=-10)
+        self.assertEqual(decode_qr_token(token), (None, 'expired'))
+        payload, err = decode_qr_token(token, at=timezone.now() - timedelta(minutes=1))
+        self.assertIsNone(err)
+
+    def test_jwt_still_accepted(self):
+        payload, err = decode_qr_token(make_qr_payload(12, 345))
+        self.assertIsNone(err)
+        self.assertEqual((payload['event'], payload['user']), (12, 345))
+
+
+class VerifiedTokenCacheTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+
+    def tearDown(self):
+        token_cache.clear()
+
+    def test_repeat_scans_hit_the_cache(self):
+        token = make_qr_payload(1, 2)
+        first, _ = decode_qr_token(token)
+        second, _ = decode_qr_token(token)
+        self.assertEqual(first, second)
+        stats = token_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (1, 1, 1))
+
+    def test_invalid_tokens_are_not_cached(self):
+        decode_qr_token('garbage')
+        decode_qr_token('garbage')
+        self.assertEqual(token_cache.stats()['size'], 0)
+
+    def test_expired_entries_are_never_served(self):
+        key = token_cache.key('some-token')
+        exp = int(time.time()) + 60
+        token_cache.put(key, {'event': 1, 'user': 2, 'exp': exp})
+        self.assertIsNotNone(token_cache.get(key))
+
+        with mock.patch('superdb.utils.time.time', return_value=exp + 1):
+            self.assertIsNone(token_cache.get(key))
+        self.assertEqual(token_cache.stats()['size'], 0)
+
+        token_cache.put(key, {'event': 1, 'user': 2, 'exp': int(time.time()) - 1})
+        self.assertIsNone(token_cache.get(key))
+
+
+class AttendanceFeedTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.scanner = User.objects.create(username='scanner', role='scanner')
+        self.member = User.objects.create(username='member')
+        self.other = User.objects.create(username='other')
+        self.event = Event.objects.create(title='Live', start_time=now - timedelta(hours=1), end_time=now + timedelta(hours=1))
+
+    def test_checkins_and_undos_are_published(self):
+        self.event.assigned_users.add(self.member)
+        self.client.force_login(self.scanner)
+        self.client.post(f'/events/{self.event.id}/checkin/{self.member.id}/')
+        self.client.post(f'/events/{self.event.id}/checkin/{self.member.id}/undo/')
+        self.assertEqual(
+            list(AttendanceChange.objects.order_by('id').values_list('user_id', 'action', 'scanner')),
+            [(self.member.id, 'checkin', 'scanner'), (self.member.id, 'undo', '')],
+        )
+
+    async def test_stream_delivers_deltas(self):
+        stream = live.stream_event(self.event.id, only_user=self.member.id)
+        self.assertEqual(await anext(stream), 'retry: 3000\n\n')
+        pending = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+
+        await AttendanceChange.objects.acreate(event=self.event, user=self.other, action='checkin')
+        await AttendanceChange.objects.acreate(event=self.event, user=self.member, action='checkin', scanner='scanner')
+        frame = await asyncio.wait_for(pending, timeout=5)
+        await stream.aclose()
+
+        change = json.loads(frame.split('data: ', 1)[1])
+        self.assertEqual((change['user'], change['action'], change['scanner']), (self.member.id, 'checkin', 'scanner'))
+        self.assertEqual(live.feed.subscribers, {})
+
+    def test_streams_are_asgi_only(self):
+        self.event.assigned_users.add(self.member)
+        self.client.force_login(self.member)
+        self.assertEqual(self.client.get(f'/api/events/{self.event.id}/stream/').status_code, 503)
+        self.assertNotContains(self.client.get('/member/'), 'EventSource')
+
+        self.assertTrue(live.streams_enabled(ASGIRequest({'type': 'http', 'method': 'GET', 'path': '/'}, BytesIO())))
+        with override_settings(LIVE_STREAMS=True):
+            self.assertContains(self.client.get('/member/'), 'EventSource')
+
+    def test_old_rows_are_pruned(self):
+        stale = AttendanceChange.objects.create(event=self.event, user=self.member, action='checkin')
+        AttendanceChange.objects.filter(pk=stale.pk).update(at=timezone.now() - live.FEED_RETENTION - timedelta(minutes=1))
+        fresh = AttendanceChange.objects.create(event=self.event, user=self.other, action='checkin')
+        self.assertEqual(live.prune_feed(), 1)
+        self.assertEqual(list(AttendanceChange.objects.values_list('pk', flat=True)), [fresh.pk])
+
+
+class BulkQrZipTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.admin = User.objects.create(username='admin', role='admin')
+        self.members = [User.objects.create(username=f'm{i}') for i in range(3)]
+        self.event = Event.objects.create(title='Live', start_time=now, end_time=now + timedelta(hours=1))
+        self.event.assigned_users.add(self.members[1])
+        self.client.force_login(self.admin)
+
+    def download(self, query=''):
+        with mock.patch('superdb.badges.QR_RENDER_WORKERS', 1):
+            response = self.client.get(f'/bulk_qr/{self.event.id}/zip/{query}')
+            self.assertTrue(response.streaming)
+            archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        self.assertIsNone(archive.testzip())
+        return archive
+
+    def test_every_member_by_default(self):
+        archive = self.download()
+        self.assertEqual(archive.namelist(), [f'm{i}_event{self.event.id}.png' for i in range(3)])
+        self.assertEqual(archive.read(f'm0_event{self.event.id}.png')[:8], b'\x89PNG\r\n\x1a\n')
+
+    def test_assigned_scope(self):
+        archive = self.download('?scope=assigned')
+        self.assertEqual(archive.namelist(), [f'm1_event{self.event.id}.png'])
+
+    def test_pool_keeps_order(self):
+        tokens = [make_compact_qr_payload(self.event.id, u.id) for u in self.members]
+        self.assertEqual(list(badges.render_many(tokens, workers=2)), [badges.render_qr_png(t) for t in tokens])
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'qr': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'qr-tests'},
+})
+class BadgeImageTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.member = User.objects.create(username='member')
+        self.event = Event.objects.create(title='Live', start_time=now, end_time=now + timedelta(hours=1))
+        self.url = f'/generate_qr/{self.event.id}/{self.member.id}/'
+        self.client.force_login(self.member)
+
+    def test_repeat_views_are_cached_and_conditional(self):
+        render = mock.Mock(wraps=badges.render_qr_png)
+        with mock.patch.dict(badges.RENDERERS, png=render):
+            first = self.client.get(self.url)
+            second = self.client.get(self.url)
+            with mock.patch('pages.views.badge_image') as image:
+                not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(render.call_count, 1)
+        image.assert_not_called()  # a 304 never reads the image cache
+        self.assertEqual(first['Content-Type'], 'image/png')
+        self.assertEqual(first.content, second.content)
+        self.assertIn('private', first['Cache-Control'])
+        self.assertIn('max-age=', first['Cache-Control'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+
+    def test_svg_output(self):
+        response = self.client.get(self.url + '?format=svg')
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertTrue(response.content.startswith(b'<svg '))
+        self.assertNotEqual(response['ETag'], self.client.get(self.url)['ETag'])
+
+    def test_badge_is_stable_within_its_window(self):
+        start = 1_700_000_000 - 1_700_000_000 % badges.QR_CACHE_WINDOW
+        _, etag, fresh_for = badges.badge_image(self.event.id, self.member.id, now=start + 10)
+        _, same, _ = badges.badge_image(self.event.id, self.member.id, now=start + badges.QR_CACHE_WINDOW - 1)
+        _, rolled, _ = badges.badge_image(self.event.id, self.member.id, now=start + badges.QR_CACHE_WINDOW)
+        self.assertEqual(etag, same)
+        self.assertNotEqual(etag, rolled)
+        self.assertEqual(fresh_for, badges.QR_CACHE_WINDOW - 10)
+
+    def test_other_members_are_refused(self):
+        other = User.objects.create(username='other')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+class BadgeArchiveJobTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.admin = User.objects.create(username='admin', role='admin')
+        self.members = [User.objects.create(username=f'm{i}') for i in range(3)]
+        self.event = Event.objects.create(title='Live', start_time=now, end_time=now + timedelta(hours=1))
+        self.event.assigned_users.add(*self.members[:2])
+        self.client.force_login(self.admin)
+
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        for target, value in (
+            ('superdb.badges.BADGE_ARCHIVE_DIR', archive_dir.name),
+            ('superdb.badges.QR_RENDER_WORKERS', 1),
+            ('superdb.tasks.JOB_BACKEND', 'eager'),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def start(self):
+        return self.client.post(f'/bulk_qr/{self.event.id}/jobs/?scope=assigned').json()
+
+    def test_build_poll_and_download(self):
+        job = self.start()
+        self.assertEqual((job['status'], job['done'], job['total']), ('done', 2, 2))
+        self.assertEqual(self.client.get(f'/bulk_qr/jobs/{job["id"]}/').json(), job)
+
+        response = self.client.get(job['download_url'])
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(archive.namelist(), [f'm{i}_event{self.event.id}.png' for i in range(2)])
+
+    def test_archive_is_reused_until_the_roster_changes(self):
+        first = self.start()
+        self.assertEqual(self.start()['id'], first['id'])
+
+        self.event.assigned_users.add(self.members[2])
+        second = self.start()
+        self.assertNotEqual(second['id'], first['id'])
+        self.assertEqual(second['total'], 3)
+
+        self.members[0].username = 'renamed'
+        self.members[0].save()
+        self.assertNotEqual(self.start()['id'], second['id'])
+
+    def test_failed_build_is_reported(self):
+        with mock.patch('superdb.badges.render_qr_png', side_effect=RuntimeError('no pillow')):
+            job = self.start()
+        self.assertEqual((job['status'], job['error'], job['download_url']), ('failed', 'no pillow', None))
+        self.assertEqual(self.start()['status'], 'done')
+
+    def test_superseded_and_expired_archives_are_deleted(self):
+        first = BadgeArchive.objects.get(pk=self.start()['id'])
+        self.event.assigned_users.add(self.members[2])
+        second = BadgeArchive.objects.get(pk=self.start()['id'])
+        self.assertFalse(BadgeArchive.objects.filter(pk=first.pk).exists())
+        self.assertFalse(os.path.exists(first.path))
+        self.assertTrue(os.path.exists(second.path))
+
+        orphan = os.path.join(badges.BADGE_ARCHIVE_DIR, 'event0_orphan.zip')
+        Path(orphan).touch()
+        self.assertEqual(badges.prune_badge_archives(), 1)
+        self.assertTrue(os.path.exists(second.path))
+
+        self.assertEqual(badges.prune_badge_archives(now=timezone.now() + timedelta(days=2)), 1)
+        self.assertFalse(os.path.exists(second.path))
+        self.assertFalse(BadgeArchive.objects.exists())
+
+
+class BadgeSheetTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.admin = User.objects.create(username='admin', role='admin')
+        group = Graup.objects.create(name='Blue')
+        for i in range(5):
+            User.objects.create(username=f'm{i}', displayname=f'Member (#{i})', graup=group if i % 2 else None)
+        self.event = Event.objects.create(title='Live', start_time=now, end_time=now + timedelta(hours=1))
+        self.client.force_login(self.admin)
+
+    def test_sheets_are_a_valid_paginated_pdf(self):
+        with mock.patch('superdb.badges.QR_RENDER_WORKERS', 1):
+            response = self.client.get(f'/bulk_qr/{self.event.id}/sheets/?cols=2&rows=1')
+            data = b''.join(response.streaming_content)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(data.startswith(b'%PDF-1.4'))
+        self.assertTrue(data.endswith(b'%%EOF\n'))
+        self.assertEqual(len(re.findall(rb'/Type /Page ', data)), 3)
+        self.assertIn(b'/Count 3', data)
+
+        # every xref entry points at its object
+        xref_at = int(data.rsplit(b'startxref\n', 1)[1].split()[0])
+        entries = data[xref_at:].split(b'\n')[3:]
+        for number, entry in enumerate(entries, start=1):
+            if not entry.endswith(b' n '):
+                break
+            offset = int(entry.split()[0])
+            self.assertTrue(data[offset:].startswith(b'%d 0 obj' % number))
+
+    def test_labels_are_escaped(self):
+        from superdb.pdf import pdf_string
+        self.assertEqual(pdf_string('Member (#1) \\'), b'(Member \\(#1\\) \\\\)')
+        self.assertEqual(pdf_string('Ngô'), b'(Ng\xf4)')
+
+
+class NoShowPenaltyTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.event = Event.objects.create(title='Past', start_time=now - timedelta(hours=2), end_time=now - timedelta(hours=1))
+        self.system = penalties.get_system_user()
+
+    def assign(self, **fields):
+        user = User.objects.create(username=f'u{User.objects.count()}', **fields)
+        self.event.assigned_users.add(user)
+        return user
+
+    def test_levels_statuses_and_skips(self):
+        fresh = self.assign()
+        warned = self.assign(penalty_level=2, penalty_status='warned')
+        banned = self.assign(penalty_level=5, penalty_status='banned')
+        present = self.assign()
+        Attendance.objects.create(event=self.event, user=present)
+        self.event.assigned_users.add(self.system)
+
+        self.assertEqual(penalties.apply_no_show_penalties(self.event), (2, 4))
+
+        levels = dict(User.objects.values_list('username', 'penalty_level'))
+        statuses = dict(User.objects.values_list('username', 'penalty_status'))
+        self.assertEqual((levels[fresh.username], statuses[fresh.username]), (1, 'warned'))
+        self.assertEqual((levels[warned.username], statuses[warned.username]), (3, 'banned'))
+        self.assertEqual((levels[banned.username], levels[present.username]), (5, 0))
+        self.assertEqual(
+            sorted(Penalty.objects.values_list('user__username', 'previouslevel', 'admin__username')),
+            [(fresh.username, 0, 'whatisasystem'), (warned.username, 2, 'whatisasystem')],
+        )
+        self.assertEqual(Penalty.objects.get(user=fresh).reason, 'Failed to check in during the event (Past)')
+
+    def test_query_count_does_not_grow_with_the_roster(self):
+        for _ in range(30):
+            self.assign()
+        # select no-shows, one INSERT batch, one UPDATE (inside savepoints)
+        with self.assertNumQueries(5):
+            self.assertEqual(penalties.apply_no_show_penalties(self.event, self.system), (30, 30))
+
+    def test_manual_end_claims_the_event(self):
+        no_show = self.assign()
+        self.client.force_login(User.objects.create(username='admin', role='admin'))
+        url = f'/events/{self.event.id}/end-and-penalize/'
+
+        self.assertEqual(self.client.post(url).json()['penalties_added'], 1)
+        again = self.client.post(url)
+        self.assertEqual((again.status_code, again.json()['success']), (409, False))
+        self.assertIsNone(penalties.claim_no_show_penalties(self.event))  # the scheduler's job finds it claimed too
+        self.assertEqual(Penalty.objects.filter(user=no_show).count(), 1)
+
+
+class EventEndJobTests(TestCase):
+    def setUp(self):
+        from apscheduler.schedulers.background import BackgroundScheduler
+
+        self.scheduler = BackgroundScheduler()
+        self.scheduler.start(paused=True)
+        self.addCleanup(self.scheduler.shutdown, wait=False)
+        for target, value in (('superdb.scheduler.scheduler', self.scheduler), ('superdb.tasks.JOB_BACKEND', 'eager')):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.admin = User.objects.create(username='admin', role='admin')
+        self.client.force_login(self.admin)
+
+    def job(self, event_id):
+        return self.scheduler.get_job(scheduler.event_job_id(event_id))
+
+    def test_jobs_follow_create_edit_and_delete(self):
+        end = timezone.localtime() + timedelta(hours=3)
+        form = {'title': 'Talk', 'description': '', 'start_time': '2030-01-01T10:00', 'end_time': '2030-01-01T12:00'}
+        self.client.post('/events/create/', form)
+        event = Event.objects.get(title='Talk')
+        self.assertEqual(self.job(event.id).next_run_time, event.end_time)
+
+        form['end_time'] = end.strftime('%Y-%m-%dT%H:%M')
+        self.client.post(f'/events/{event.id}/edit/', form)
+        event.refresh_from_db()
+        self.assertEqual(self.job(event.id).next_run_time, event.end_time)
+
+        self.client.post(f'/events/{event.id}/delete/')
+        self.assertIsNone(self.job(event.id))
+
+    def test_job_penalises_once_and_follows_a_later_end(self):
+        now = timezone.now()
+        event = Event.objects.create(title='Past', start_time=now - timedelta(hours=2), end_time=now - timedelta(minutes=1))
+        no_show = User.objects.create(username='no_show')
+        event.assigned_users.add(no_show)
+
+        tasks.process_event_end(event.id)
+        tasks.process_event_end(event.id)
+        event.refresh_from_db()
+        self.assertTrue(event.penalties_processed)
+        self.assertEqual(Penalty.objects.filter(user=no_show).count(), 1)
+
+        later = Event.objects.create(title='Extended', start_time=now, end_time=now + timedelta(hours=1))
+        tasks.process_event_end(later.id)
+        self.assertFalse(Event.objects.get(pk=later.pk).penalties_processed)
+        self.assertEqual(self.job(later.id).next_run_time, later.end_time)
+
+    def test_reconcile_catches_up_and_schedules(self):
+        now = timezone.now()
+        missed = Event.objects.create(title='Missed', start_time=now - timedelta(hours=2), end_time=now - timedelta(hours=1))
+        upcoming = Event.objects.create(title='Upcoming', start_time=now, end_time=now + timedelta(hours=1))
+        scheduler.reconcile_event_jobs()
+        self.assertTrue(Event.objects.get(pk=missed.pk).penalties_processed)
+        self.assertIsNone(self.job(missed.id))
+        self.assertEqual(self.job(upcoming.id).next_run_time, upcoming.end_time)
+
+
+LEADER_CHILD = """
+import json, os, sys, time
+import django
+django.setup()
+from superdb import scheduler
+scheduler.LEADER_RETRY_SECONDS = 0.1
+time.sleep(max(0, float(sys.argv[1]) - time.time()))  # all start together
+scheduler.start_scheduler()
+led_at = None
+stop_at = time.time() + float(sys.argv[2])
+while time.time() < stop_at:
+    if led_at is None and scheduler.scheduler is not None:
+        led_at = time.time()
+    time.sleep(0.02)
+print(json.dumps({'led_at': led_at, 'exit_at': time.time()}))
+"""
+
+SEED_ENDED_EVENTS = """
+import django
+django.setup()
+from datetime import timedelta
+from django.utils import timezone
+from superdb.models import Event, User
+now = timezone.now()
+users = [User.objects.create(username=f'no_show_{i}') for i in range(5)]
+for i in range(4):
+    event = Event.objects.create(title=f'Ended {i}', start_time=now - timedelta(hours=2), end_time=now - timedelta(minutes=i + 1))
+    event.assigned_users.add(*users)
+"""
+
+
+class SchedulerLeaderTests(TestCase):
+    """Runs real processes against a throwaway SQLite file."""
+
+    def setUp(self):
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.db = os.path.join(workdir.name, 'db.sqlite3')
+        self.env = {**os.environ, 'SQLITE_PATH': self.db, 'DJANGO_SETTINGS_MODULE': 'mainframe.settings'}
+        self.cwd = Path(__file__).resolve().parent.parent
+        subprocess.run([sys.executable, 'manage.py', 'migrate', '-v0'], cwd=self.cwd, env=self.env, check=True)
+        subprocess.run([sys.executable, '-c', SEED_ENDED_EVENTS], cwd=self.cwd, env=self.env, check=True)
+
+    def test_each_ended_event_is_processed_once(self):
+        # same start, staggered lifetimes: when a leader exits, a standby
+        # takes over
+        start_at = time.time() + 3
+        children = [
+            subprocess.Popen(
+                [sys.executable, '-c', LEADER_CHILD, str(start_at), str(1 + i * 0.5)],
+                cwd=self.cwd, env=self.env, stdout=subprocess.PIPE, text=True,
+            )
+            for i in range(4)
+        ]
+        reports = []
+        for child in children:
+            out, _ = child.communicate(timeout=60)
+            self.assertEqual(child.returncode, 0)
+            # racing schedulers on SQLite show up as "database is locked"
+            self.assertNotIn('[AUTO-PENALTY] Error', out)
+            reports.append(json.loads(out.strip().splitlines()[-1]))
+
+        # leadership passes on, never overlapping, until the last child exits
+        terms = sorted((r['led_at'], r['exit_at']) for r in reports if r['led_at'] is not None)
+        self.assertTrue(terms)
+        for (_, ended), (started, _) in zip(terms, terms[1:]):
+            self.assertGreaterEqual(started, ended)
+        self.assertEqual(terms[-1][1], max(r['exit_at'] for r in reports))
+        import sqlite3
+        with sqlite3.connect(self.db) as db:
+            runs = db.execute("SELECT target_event_id, COUNT(*) FROM superdb_log WHERE action = 'scheduler_run' GROUP BY target_event_id").fetchall()
+            penalties = db.execute('SELECT user_id, COUNT(*) FROM superdb_penalty GROUP BY user_id').fetchall()
+            levels = {level for (level,) in db.execute("SELECT penalty_level FROM superdb_user WHERE username LIKE 'no_show_%'")}
+        self.assertEqual(len(runs), 4)
+        self.assertTrue(all(count == 1 for _, count in runs))
+        # 4 events: two warnings, the third bans, the fourth skips a banned user
+        self.assertEqual(sorted(count for _, count in penalties), [3] * 5)
+        self.assertEqual(levels, {3})
+
+
+class SchedulerTaskTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.event = Event.objects.create(title='Ended', start_time=now - timedelta(hours=2), end_time=now - timedelta(hours=1))
+        self.no_show = User.objects.create(username='no_show')
+        self.event.assigned_users.add(self.no_show)
+
+    def test_run_scheduler_once(self):
+        # --once also runs housekeeping, which sweeps these directories
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        with mock.patch('superdb.badges.BADGE_ARCHIVE_DIR', workdir.name), \
+                mock.patch('superdb.sheets.SHEET_CACHE_DIR', workdir.name):
+            call_command('run_scheduler', once=True)
+        self.assertTrue(Event.objects.get(pk=self.event.pk).penalties_processed)
+        self.assertEqual(Penalty.objects.filter(user=self.no_show).count(), 1)
+
+    def test_celery_backend_runs_the_registered_task(self):
+        from mainframe.celery import app
+
+        self.assertIn('superdb.tasks.process_event_end', app.tasks)
+        app.conf.task_always_eager = True
+        self.addCleanup(setattr, app.conf, 'task_always_eager', False)
+        with mock.patch('superdb.tasks.JOB_BACKEND', 'celery'):
+            tasks.enqueue(tasks.process_event_end, self.event.id)
+        self.assertEqual(Penalty.objects.filter(user=self.no_show).count(), 1)
+
+    def test_leader_is_only_notified_while_one_runs(self):
+        import fcntl
+
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        lock_path = os.path.join(workdir.name, 'scheduler.lock')
+        events_path = f'{lock_path}.events'
+        with mock.patch('superdb.scheduler.LEADER_LOCK_PATH', lock_path), \
+                mock.patch('superdb.scheduler.EVENTS_CHANGED_PATH', events_path):
+            scheduler.notify_leader()
+            self.assertFalse(os.path.exists(events_path))
+
+            with open(lock_path, 'a+') as leader:
+                fcntl.flock(leader, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                scheduler.notify_leader()
+            self.assertTrue(os.path.exists(events_path))
+
+
+class CatchUpTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.no_show = User.objects.create(username='no_show')
+        # created newest first so id order differs from end_time order
+        self.events = []
+        for minutes in (5, 40, 10, 30, 20):
+            event = Event.objects.create(title=f'Ended {minutes}m ago', start_time=self.now - timedelta(hours=2), end_time=self.now - timedelta(minutes=minutes))
+            event.assigned_users.add(self.no_show)
+            self.events.append(event)
+        self.oldest_first = sorted(self.events, key=lambda e: e.end_time)
+
+    def processed_order(self):
+        return list(Log.objects.filter(action='scheduler_run').order_by('id').values_list('target_event_id', flat=True))
+
+    def test_backlog_is_processed_oldest_first_in_chunks(self):
+        with mock.patch('superdb.tasks.CATCHUP_CHUNK', 2):
+            self.assertEqual(tasks.process_ended_events(), 5)
+        self.assertEqual(self.processed_order(), [e.id for e in self.oldest_first])
+        self.assertFalse(Event.objects.filter(penalties_processed=False).exists())
+
+    def test_a_failing_event_is_rolled_back_and_skipped(self):
+        bad = self.oldest_first[1]
+        real = penalties.apply_no_show_penalties
+
+        def apply(event, system_user=None):
+            if event.id == bad.id:
+                real(event, system_user)  # writes that must not survive
+                raise RuntimeError('boom')
+            return real(event, system_user)
+
+        with mock.patch('superdb.penalties.apply_no_show_penalties', side_effect=apply):
+            self.assertEqual(tasks.process_ended_events(), 4)
+        self.assertFalse(Event.objects.get(pk=bad.pk).penalties_processed)
+        self.assertNotIn(bad.id, self.processed_order())
+        self.assertEqual(Penalty.objects.filter(user=self.no_show).count(), 3)  # banned after the third
+
+    def test_claimed_events_are_not_processed_twice(self):
+        stale = Event.objects.get(pk=self.events[0].pk)
+        self.assertIsNotNone(tasks.penalize_ended_event(self.events[0]))
+        self.assertFalse(stale.penalties_processed)
+        self.assertIsNone(tasks.penalize_ended_event(stale))
+        self.assertEqual(self.processed_order(), [self.events[0].id])
+
+    def test_time_budget_hands_the_rest_to_a_new_task(self):
+        with mock.patch('superdb.tasks.enqueue') as enqueue:
+            self.assertEqual(tasks.process_ended_events(budget_seconds=0), 1)
+        enqueue.assert_called_once_with(tasks.process_ended_events)
+        self.assertEqual(self.processed_order(), [self.oldest_first[0].id])
+
+
+class SchedulerRunMetricsTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.no_show = User.objects.create(username='no_show')
+        for minutes in (30, 10):
+            event = Event.objects.create(title=f'Ended {minutes}m ago', start_time=self.now - timedelta(hours=2), end_time=self.now - timedelta(minutes=minutes))
+            event.assigned_users.add(self.no_show)
+        self.admin = User.objects.create(username='admin', role='admin')
+
+    def test_catch_up_records_one_run(self):
+        self.assertEqual(tasks.process_ended_events(), 2)
+        run = SchedulerRun.objects.get()
+        self.assertEqual((run.kind, run.events, run.penalties, run.failed), ('catch_up', 2, 2, 0))
+        self.assertGreater(run.queries, 0)
+        self.assertGreater(run.apply_ms, 0)
+        self.assertGreaterEqual(run.max_lag_s, 30 * 60)
+        self.assertGreaterEqual(run.max_lag_s, run.mean_lag_s)
+        self.assertFalse(run.budget_exhausted)
+
+    def test_idle_runs_are_not_recorded(self):
+        Event.objects.update(penalties_processed=True)
+        tasks.process_ended_events()
+        self.assertFalse(SchedulerRun.objects.exists())
+
+    def test_budget_exhaustion_is_recorded(self):
+        with mock.patch('superdb.tasks.enqueue'):
+            tasks.process_ended_events(budget_seconds=0)
+        self.assertTrue(SchedulerRun.objects.get().budget_exhausted)
+
+    def test_metrics_endpoint(self):
+        tasks.process_ended_events()
+        Event.objects.create(title='Pending', start_time=self.now - timedelta(hours=2), end_time=self.now - timedelta(minutes=5))
+
+        self.client.force_login(self.no_show)
+        self.assertNotEqual(self.client.get('/scheduler/metrics/').status_code, 200)
+
+        self.client.force_login(self.admin)
+        data = self.client.get('/scheduler/metrics/?hours=1').json()
+        self.assertEqual(data['summary']['runs'], 1)
+        self.assertEqual(data['summary']['penalties'], 2)
+        self.assertEqual(data['backlog']['events'], 1)
+        self.assertGreaterEqual(data['backlog']['oldest_lag_s'], 5 * 60)
+        self.assertEqual(data['runs'][0]['kind'], 'catch_up')
+
+
+class StagedImportTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create(username='admin', role='admin')
+        self.client.force_login(self.admin)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        patcher = mock.patch('superdb.imports.IMPORT_DIR', tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.import_dir = tmp.name
+        patcher = mock.patch('superdb.tasks.JOB_BACKEND', 'eager')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def xlsx(self, rows):
+        from openpyxl import Workbook
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(['First', 'Last', 'Team', 'Pin'])
+        for row in rows:
+            sheet.append(row)
+        buf = BytesIO()
+        workbook.save(buf)
+        buf.seek(0)
+        buf.name = 'roster.xlsx'
+        return buf
+
+    def test_parse_returns_preview_and_finalize_reads_staged_file(self):
+        rows = [[f'first{i}', f'last {i}', 'Blue' if i % 2 else 'Red', 1000 + i] for i in range(12)]
+        parsed = self.client.post('/api/parse-import/', {'file': self.xlsx(rows)}).json()
+        self.assertTrue(parsed['success'])
+        self.assertEqual(parsed['columns'], ['First', 'Last', 'Team', 'Pin'])
+        self.assertEqual(parsed['total_rows'], 12)
+        self.assertEqual(len(parsed['preview']), imports.PREVIEW_ROWS)
+        self.assertEqual(parsed['preview'][0], {'First': 'first0', 'Last': 'last 0', 'Team': 'Red', 'Pin': '1000'})
+        self.assertNotIn('rows', parsed)
+
+        response = self.client.post('/api/finalize-import/', json.dumps({
+            'import_id': parsed['import_id'],
+            'mode': 'name',
+            'mapping': {'firstname': 'First', 'lastname': 'Last', 'group': 'Team', 'password': 'Pin'},
+            'role': 'member',
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        job = response.json()
+        self.assertEqual((job['status'], job['total'], job['processed'], job['created'], job['updated']), ('done', 12, 12, 12, 0))
+        self.assertEqual(self.client.get(f"/api/imports/{job['id']}/").json(), job)
+        user = User.objects.get(username='first3_last3')
+        self.assertEqual((user.displayname, user.graup.name), ('First3 Last 3', 'Blue'))
+        self.assertEqual(os.listdir(self.import_dir), [])
+
+    def test_csv_is_read_in_chunks(self):
+        csv_file = BytesIO('\ufeffname,group\n'.encode('utf-8') + ''.join(f'user{i},G{i % 3}\n' for i in range(7)).encode())
+        csv_file.name = 'roster.csv'
+        parsed = self.client.post('/api/parse-import/', {'file': csv_file}).json()
+        self.assertEqual(parsed['columns'], ['name', 'group'])
+        self.assertEqual(parsed['total_rows'], 7)
+
+        chunks = list(imports.iter_chunks(parsed['import_id'], chunk_size=3))
+        self.assertEqual([len(c) for c in chunks], [3, 3, 1])
+        self.assertEqual(chunks[2][0], {'name': 'user6', 'group': 'G0'})
+
+    def test_unknown_import_id(self):
+        response = self.client.post('/api/finalize-import/', json.dumps({
+            'import_id': '../../etc/passwd', 'mode': 'username', 'mapping': {'username': 'name', 'group': 'group'}, 'role': 'member',
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_members_cannot_stage_files(self):
+        self.client.force_login(User.objects.create(username='member', role='member'))
+        response = self.client.post('/api/parse-import/', {'file': self.xlsx([])})
+        self.assertNotEqual(response.status_code, 200)
+        self.assertEqual(os.listdir(self.import_dir), [])
+
+    def test_upsert_updates_existing_users_in_a_few_queries(self):
+        blue = Graup.objects.create(name='Blue', description='kept')
+        existing = User.objects.create(username='ann', role='member', penalty_level=2, penalty_status='warned', password='old')
+        rows = [{'name': f'user{i}', 'team': 'Blue' if i % 2 else 'Green', 'pin': str(i)} for i in range(40)]
+        rows += [{'name': 'ann', 'team': 'Green', 'pin': ''}, {'name': 'ann', 'team': 'Blue', 'pin': 'new'}, {'name': '', 'team': 'Blue', 'pin': ''}]
+        mapping = {'username': 'name', 'group': 'team', 'password': 'pin'}
+
+        with self.assertNumQueries(7):
+            stats = imports.import_users([pd.DataFrame(rows, index=range(2, 45))], 'username', mapping, 'scanner')
+        self.assertEqual(stats, {
+            'created': 40, 'updated': 2, 'skipped': 1, 'errors': [],
+            'conflicts': [{'row': 43, 'username': 'ann', 'first_row': 42, 'imported_as': 'ann'}],
+        })
+        self.assertEqual(User.objects.filter(role='scanner').count(), 41)
+
+        existing.refresh_from_db()
+        self.assertEqual((existing.graup_id, existing.penalty_level, existing.penalty_status, existing.password), (blue.id, 0, 'ok', 'new'))
+        self.assertEqual(Graup.objects.get(name='Blue').description, 'kept')
+        self.assertEqual(User.objects.get(username='user4').graup.name, 'Green')
+        self.assertTrue(User.objects.get(username='user3').check_password('3'))
+
+    def test_failed_job_resumes_after_last_committed_chunk(self):
+        csv_file = BytesIO(('name,group\n' + ''.join(f'user{i},G\n' for i in range(8)) + ('x' * 200) + ',G\n').encode())
+        csv_file.name = 'roster.csv'
+        import_id = self.client.post('/api/parse-import/', {'file': csv_file}).json()['import_id']
+        body = json.dumps({'import_id': import_id, 'mode': 'username', 'mapping': {'username': 'name', 'group': 'group'}, 'role': 'member'})
+
+        real = imports.write_records
+        calls = []
+
+        def flaky(records, *args, **kwargs):
+            calls.append(list(records['username']))
+            if len(calls) == 2:
+                raise RuntimeError('database went away')
+            return real(records, *args, **kwargs)
+
+        with mock.patch('superdb.imports.IMPORT_CHUNK', 3), mock.patch('superdb.imports.write_records', side_effect=flaky):
+            job = self.client.post('/api/finalize-import/', body, content_type='application/json').json()
+            self.assertEqual((job['status'], job['processed'], job['error']), ('failed', 3, 'database went away'))
+            self.assertEqual(User.objects.filter(username__startswith='user').count(), 3)
+
+            job = self.client.post(f"/api/imports/{job['id']}/resume/").json()
+
+        self.assertEqual(calls[2][0], 'user3')
+        self.assertEqual((job['status'], job['processed'], job['created'], job['skipped']), ('done', 9, 8, 1))
+        self.assertEqual(job['errors'], ['Row 10: username is longer than 150 characters'])
+        self.assertEqual(self.client.post(f"/api/imports/{job['id']}/resume/").status_code, 409)
+        self.assertEqual(os.listdir(self.import_dir), [])
+
+    def test_repeated_names_get_numbered_usernames(self):
+        frame = pd.DataFrame({
+            'first': ['John', 'Ann', 'john', 'John', 'Jo'],
+            'last': ['Doe', 'Lee', 'DOE', 'Doe2', 'Hn Doe'],
+        }, index=range(2, 7))
+        mapping = {'firstname': 'first', 'lastname': 'last', 'group': 'team'}
+        records, stats = imports.prepare_frame(frame, 'name', mapping, {})
+
+        self.assertEqual(list(records['username']), ['john_doe', 'ann_lee', 'john_doe3', 'john_doe2', 'jo_hndoe'])
+        self.assertEqual(list(records['displayname'])[:3], ['John Doe', 'Ann Lee', 'John Doe'])
+        self.assertEqual(stats['conflicts'], [{'row': 4, 'username': 'john_doe', 'first_row': 2, 'imported_as': 'john_doe3'}])
+
+    def test_dry_run_diff_writes_nothing(self):
+        Graup.objects.create(name='Blue')
+        User.objects.create(username='ann', role='member', displayname='Ann', graup=Graup.objects.get(name='Blue'))
+        User.objects.create(username='bob', role='member', displayname='Bob', penalty_level=1, penalty_status='warned')
+        User.objects.create(username='cy', role='member', displayname='Cy', password='pw')
+        csv_file = BytesIO(b'name,group,pin\nann,Blue,\nbob,,\ncy,,new\ndee,Red,\nann,Blue,\n,,\n')
+        csv_file.name = 'roster.csv'
+        import_id = self.client.post('/api/parse-import/', {'file': csv_file}).json()['import_id']
+        body = {'import_id': import_id, 'mode': 'username', 'mapping': {'username': 'name', 'group': 'group', 'password': 'pin'}, 'role': 'member'}
+
+        with self.assertNumQueries(2):
+            diff = imports.diff_import(import_id, body['mode'], body['mapping'], body['role'])
+        self.assertEqual(
+            {k: diff['summary'][k] for k in ('rows', 'create', 'update', 'unchanged', 'skipped', 'duplicates', 'new_groups')},
+            {'rows': 6, 'create': 1, 'update': 2, 'unchanged': 1, 'skipped': 1, 'duplicates': 1, 'new_groups': ['Red']},
+        )
+        self.assertEqual(diff['changes'], [
+            {'row': 3, 'username': 'bob', 'action': 'update', 'changes': {'penalties': ['warned (1)', 'ok (0)']}},
+            {'row': 4, 'username': 'cy', 'action': 'update', 'changes': {'password': ['***', '***']}},
+            {'row': 5, 'username': 'dee', 'action': 'create', 'changes': {'role': [None, 'member'], 'group': [None, 'Red'], 'displayname': [None, 'Dee']}},
+        ])
+
+        body['page'] = 2
+        with mock.patch('superdb.imports.DIFF_PAGE_SIZE', 2):
+            response = self.client.post('/api/imports/dry-run/', json.dumps(body), content_type='application/json').json()
+        self.assertEqual((response['page'], response['pages'], [c['username'] for c in response['changes']]), (2, 2, ['dee']))
+        self.assertEqual(User.objects.count(), 4)
+        self.assertFalse(Graup.objects.filter(name='Red').exists())
+
+
+class SheetServer(http.server.BaseHTTPRequestHandler):
+    """Stand-in for the Sheets CSV export: honours If-None-Match, counts requests."""
+    body = b'name,group\nann,Blue\nbob,Red\n'
+    requests = []
+
+    def do_GET(self):
+        etag = '"%s"' % hashlib.sha256(self.body).hexdigest()[:16]
+        self.requests.append((self.path, self.headers.get('If-None-Match')))
+        if self.path.startswith('/missing/'):
+            self.send_response(404)
+            self.end_headers()
+        elif self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(len(self.body)))
+            self.end_headers()
+            self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class SheetFetchTests(TestCase):
+    def setUp(self):
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), SheetServer)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        SheetServer.requests = []
+        SheetServer.body = b'name,group\nann,Blue\nbob,Red\n'
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        for target, value in (
+            ('superdb.sheets.SHEETS_EXPORT_URL', f'http://127.0.0.1:{server.server_port}/{{sheet_id}}/export'),
+            ('superdb.sheets.SHEET_CACHE_DIR', os.path.join(tmp.name, 'sheets')),
+            ('superdb.imports.IMPORT_DIR', os.path.join(tmp.name, 'imports')),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.url = 'https://docs.google.com/spreadsheets/d/abc123/edit#gid=0'
+
+    def test_unchanged_sheet_is_revalidated_not_downloaded(self):
+        path, changed = sheets.fetch_sheet_csv(self.url)
+        self.assertTrue(changed)
+        self.assertEqual(open(path, 'rb').read(), SheetServer.body)
+
+        self.assertEqual(sheets.fetch_sheet_csv(self.url), (path, False))
+        self.assertEqual([etag is not None for _, etag in SheetServer.requests], [False, True])
+
+        SheetServer.body += b'cy,Blue\n'
+        path, changed = sheets.fetch_sheet_csv(self.url)
+        self.assertTrue(changed)
+        self.assertTrue(open(path, 'rb').read().endswith(b'cy,Blue\n'))
+
+    def test_url_import_stages_the_download(self):
+        self.client.force_login(User.objects.create(username='admin', role='admin'))
+        parsed = self.client.post('/api/parse-import/', json.dumps({'url': self.url}), content_type='application/json').json()
+        self.assertEqual((parsed['success'], parsed['columns'], parsed['total_rows']), (True, ['name', 'group'], 2))
+        self.assertEqual(SheetServer.requests[0][0], '/abc123/export')
+
+    def test_errors(self):
+        with self.assertRaises(sheets.SheetFetchError):
+            sheets.fetch_sheet_csv('https://docs.google.com/spreadsheets/d/missing/edit')
+        with self.assertRaises(sheets.SheetFetchError):
+            sheets.fetch_sheet_csv('not a sheet')
+        with mock.patch('superdb.sheets.MAX_SHEET_BYTES', 10), self.assertRaises(sheets.SheetFetchError):
+            sheets.fetch_sheet_csv(self.url)
+        self.assertEqual(os.listdir(sheets.SHEET_CACHE_DIR), [])  # no partial downloads left behind
+
+    def test_old_downloads_are_pruned(self):
+        path, _ = sheets.fetch_sheet_csv(self.url)
+        self.assertEqual(sheets.prune_cache(), 0)
+        with mock.patch('superdb.sheets.SHEET_CACHE_RETENTION_SECONDS', -1):
+            self.assertEqual(sheets.prune_cache(), 2)
+        self.assertEqual(os.listdir(sheets.SHEET_CACHE_DIR), [])
+
+
+class DashboardApiTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.admin = User.objects.create(username='admin', role='admin')
+        self.client.force_login(self.admin)
+
+    def walk(self, url, limit):
+        """Follow the cursors to the end, returning every page's results."""
+        pages, after = [], None
+        while True:
+            data = self.client.get(url, {'limit': limit, **({'after': after} if after else {})}).json()
+            pages.append(data['results'])
+            after = data['next']
+            if after is None:
+                return pages
+
+    def test_dashboard_render_does_not_grow_with_the_data(self):
+        def render_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get('/admin-dashboard/').status_code, 200)
+            return len(queries)
+
+        before = render_queries()
+        group = Graup.objects.create(name='Blue')
+        users = User.objects.bulk_create([User(username=f'u{i}', graup=group) for i in range(60)])
+        Penalty.objects.bulk_create([Penalty(user=u, reason='Late', admin=self.admin) for u in users])
+        Event.objects.create(title='Soon', start_time=self.now + timedelta(days=1), end_time=self.now + timedelta(days=1, hours=1))
+        self.assertEqual(render_queries(), before)
+
+    def test_users_pages_cover_every_user_once(self):
+        User.objects.bulk_create([User(username=f'u{i:02}') for i in range(7)] + [User(username='root', role='core')])
+        pages = self.walk('/dashboard/users/', 3)
+        self.assertEqual([len(page) for page in pages], [3, 3, 2])
+        usernames = [u['username'] for page in pages for u in page]
+        self.assertEqual(usernames, sorted(User.objects.exclude(role='core').values_list('username', flat=True), reverse=True))
+
+    def test_events_with_the_same_start_are_not_skipped(self):
+        start = self.now + timedelta(days=1)
+        events = [Event.objects.create(title=f'E{i}', start_time=start, end_time=start + timedelta(hours=1)) for i in range(5)]
+        later = Event.objects.create(title='Later', start_time=start + timedelta(days=1), end_time=start + timedelta(days=1, hours=1))
+        ids = [e['id'] for page in self.walk('/dashboard/events/', 2) for e in page]
+        self.assertEqual(ids, [later.id] + [e.id for e in reversed(events)])
+
+    def test_filters(self):
+        group = Graup.objects.create(name='Blue')
+        User.objects.create(username='alice', displayname='Alice Smith', graup=group, penalty_status='warned')
+        User.objects.create(username='bob', role='scanner')
+        User.objects.create(username='root', role='core')
+
+        def usernames(**params):
+            return [u['username'] for u in self.client.get('/dashboard/users/', params).json()['results']]
+
+        self.assertEqual(usernames(q='smith'), ['alice'])
+        self.assertEqual(usernames(role='scanner'), ['bob'])
+        self.assertEqual(usernames(penalty='penalized'), ['alice'])
+        self.assertEqual(usernames(group='Blue'), ['alice'])
+        self.assertNotIn('root', usernames(include_core='1'))  # only core admins see core users
+        self.client.force_login(User.objects.get(username='root'))
+        self.assertIn('root', usernames(include_core='1'))
+
+        Event.objects.create(title='Done', start_time=self.now - timedelta(hours=2), end_time=self.now - timedelta(hours=1))
+        Event.objects.create(title='Now', start_time=self.now - timedelta(hours=1), end_time=self.now + timedelta(hours=1))
+        events = self.client.get('/dashboard/events/', {'status': 'ongoing'}).json()['results']
+        self.assertEqual([(e['title'], e['status']) for e in events], [('Now', 'ongoing')])
+
+        alice = User.objects.get(username='alice')
+        Penalty.objects.create(user=alice, type='add', reason='Late', admin=User.objects.get(username='root'))
+        Penalty.objects.create(user=alice, type='pardon', reason='Sorry', admin=self.admin)
+        penalties = self.client.get('/dashboard/penalties/', {'q': 'ali', 'type': 'add'}).json()['results']
+        self.assertEqual([(p['reason'], p['by']) for p in penalties], [('Late', 'System')])
+
+    def test_select_all_assigns_a_whole_group(self):
+        group = Graup.objects.create(name='Blue')
+        User.objects.bulk_create([User(username=f'blue{i}', graup=group) for i in range(60)] + [User(username='red')])
+        event = Event.objects.create(title='Soon', start_time=self.now + timedelta(days=1), end_time=self.now + timedelta(days=1, hours=1))
+
+        self.assertEqual(len(self.client.get('/dashboard/users/', {'group': 'Blue'}).json()['results']), 50)
+        ids = self.client.get('/dashboard/users/', {'group': 'Blue', 'ids_only': '1'}).json()['ids']
+        self.client.post(f'/events/{event.id}/assign/', json.dumps({'user_ids': ids}), content_type='application/json')
+        self.assertEqual(set(event.assigned_users.values_list('username', flat=True)), {f'blue{i}' for i in range(60)})
+
+    def test_bad_requests_and_access(self):
+        self.assertEqual(self.client.get('/dashboard/users/', {'after': 'nonsense'}).status_code, 400)
+        self.assertEqual(self.client.get('/dashboard/events/', {'limit': 'all'}).status_code, 400)
+        self.assertEqual(self.client.get('/dashboard/groups/').json(), {'success': True, 'results': [], 'next': None})
+
+        self.client.force_login(User.objects.create(username='member'))
+        for name in ('users', 'events', 'penalties', 'groups'):
+            self.assertNotEqual(self.client.get(f'/dashboard/{name}/').status_code, 200)
@@ -4,7 +4,13 @@ from . import views
 
 urlpatterns = [
     path('scan/', views.scan_endpoint, name='scan_endpoint'),
+    path('scan/batch/', views.scan_batch_endpoint, name='scan_batch_endpoint'),
+    path('scan/replay/', views.scan_replay_endpoint, name='scan_replay_endpoint'),
     path('check_status/', views.check_status, name='check_status'),
+    path('events/<int:event_id>/stream/', views.attendance_stream, name='attendance_stream'),
     path("parse-import/", views.parse_import, name="parse_import"),
     path("finalize-import/", views.finalize_import, name="finalize_import"),
+    path("imports/dry-run/", views.import_dry_run, name="import_dry_run"),
+    path("imports/<int:job_id>/", views.import_job_status, name="import_job_status"),
+    path("imports/<int:job_id>/resume/", views.import_job_resume, name="import_job_resume"),
 ]
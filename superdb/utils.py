@@ -1,5 +1,12 @@
 # superdb/utils.py
 import jwt
+import hmac
+import base64
+import hashlib
+import struct
+import threading
+import time
+from cachetools import TLRUCache
 from django.conf import settings
 from datetime import datetime, timezone, timedelta
 
@@ -7,8 +14,67 @@ JWT_SECRET = settings.SECRET_KEY
 JWT_ALG = 'HS256'
 QR_VALID_FOR_SECONDS = 60 * 60 * 24  # tokens valid for 24h by default; adjust as needed
 
-def make_qr_payload(event_id: int, user_id: int, valid_seconds=None):
-    now = datetime.now(timezone.utc)
+# Compact tokens: version, event id, user id and expiry packed into 13 bytes,
+# followed by a truncated HMAC-SHA256, base32-encoded. 20 bytes give exactly
+# 32 characters from A-Z2-7, which QR codes store in alphanumeric mode.
+COMPACT_VERSION = 1
+COMPACT_FIELDS = struct.Struct('>BIII')
+COMPACT_MAC_BYTES = 7
+COMPACT_KEY = hashlib.sha256(b'superdb.qr.compact:' + JWT_SECRET.encode()).digest()
+
+# Which format make_qr_token mints; decode_qr_token always accepts both.
+QR_TOKEN_FORMAT = getattr(settings, 'QR_TOKEN_FORMAT', 'jwt')
+
+# Verified payloads are cached by token digest so repeat scans of the same
+# badge skip signature checks; each entry lives until the token's own exp.
+QR_TOKEN_CACHE_SIZE = getattr(settings, 'QR_TOKEN_CACHE_SIZE', 4096)
+
+class VerifiedTokenCache:
+    """Thread-safe bounded LRU of verified token payloads with hit/miss counters."""
+
+    def __init__(self, maxsize):
+        self._cache = TLRUCache(maxsize=maxsize, ttu=lambda key, payload, now: payload['exp'], timer=time.time)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, key):
+        with self._lock:
+            payload = self._cache.get(key)
+            # TLRUCache expires lazily; never hand out a token past its exp
+            if payload is not None and payload['exp'] <= time.time():
+                del self._cache[key]
+                payload = None
+            if payload is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return dict(payload)
+
+    def put(self, key, payload):
+        if payload.get('exp', 0) <= time.time():
+            return
+        with self._lock:
+            self._cache[key] = dict(payload)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._cache), 'maxsize': self._cache.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+token_cache = VerifiedTokenCache(QR_TOKEN_CACHE_SIZE)
+
+def make_qr_payload(event_id: int, user_id: int, valid_seconds=None, issued_at=None):
+    now = issued_at or datetime.now(timezone.utc)
     valid = valid_seconds or QR_VALID_FOR_SECONDS
     payload = {
         'event': int(event_id),
@@ -20,9 +86,70 @@ def make_qr_payload(event_id: int, user_id: int, valid_seconds=None):
     # jwt.encode returns str in pyjwt>=2
     return token
 
-def decode_qr_token(token: str):
+def make_compact_qr_payload(event_id: int, user_id: int, valid_seconds=None, issued_at=None):
+    now = issued_at or datetime.now(timezone.utc)
+    valid = valid_seconds or QR_VALID_FOR_SECONDS
+    exp = int((now + timedelta(seconds=valid)).timestamp())
+    body = COMPACT_FIELDS.pack(COMPACT_VERSION, int(event_id), int(user_id), exp)
+    mac = hmac.new(COMPACT_KEY, body, hashlib.sha256).digest()[:COMPACT_MAC_BYTES]
+    return base64.b32encode(body + mac).decode('ascii')
+
+def make_qr_token(event_id: int, user_id: int, valid_seconds=None, issued_at=None):
+    """
+    Mint a badge token in the configured QR_TOKEN_FORMAT. The same
+    `issued_at` always gives the same token, which lets rendered badges be
+    cached.
+    """
+    if QR_TOKEN_FORMAT == 'jwt':
+        return make_qr_payload(event_id, user_id, valid_seconds, issued_at)
+    return make_compact_qr_payload(event_id, user_id, valid_seconds, issued_at)
+
+def _decode_compact(token: str, leeway=0):
+    try:
+        raw = base64.b32decode(token.upper())
+    except (ValueError, TypeError):
+        return None, 'invalid'
+    if len(raw) != COMPACT_FIELDS.size + COMPACT_MAC_BYTES:
+        return None, 'invalid'
+
+    body, mac = raw[:COMPACT_FIELDS.size], raw[COMPACT_FIELDS.size:]
+    expected = hmac.new(COMPACT_KEY, body, hashlib.sha256).digest()[:COMPACT_MAC_BYTES]
+    if not hmac.compare_digest(mac, expected):
+        return None, 'invalid'
+
+    version, event_id, user_id, exp = COMPACT_FIELDS.unpack(body)
+    if version != COMPACT_VERSION:
+        return None, 'invalid'
+    if exp + leeway < datetime.now(timezone.utc).timestamp():
+        return None, 'expired'
+    return {'event': event_id, 'user': user_id, 'exp': exp}, None
+
+def decode_qr_token(token: str, at=None):
+    """
+    Verify a QR token, either a JWT or a compact token. `at` checks expiry
+    against an earlier moment than now, e.g. when an offline scan is
+    replayed after the fact.
+    """
+    if not isinstance(token, str):
+        return None, 'invalid'
+
+    cache_key = token_cache.key(token)
+    payload = token_cache.get(cache_key)
+    if payload is not None:
+        return payload, None
+
+    leeway = 0
+    if at is not None:
+        leeway = max(0, (datetime.now(timezone.utc) - at).total_seconds())
+    # JWTs always contain dots; compact tokens never do
+    if '.' not in token:
+        payload, err = _decode_compact(token, leeway)
+        if payload is not None:
+            token_cache.put(cache_key, payload)
+        return payload, err
     try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG], leeway=leeway)
+        token_cache.put(cache_key, payload)
         return payload, None
     except jwt.ExpiredSignatureError:
         return None, 'expired'
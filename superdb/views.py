@@ -1,11 +1,19 @@
 # superdb/views.py
 from django.views.decorators.http import require_POST, require_GET
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from datetime import timedelta, timezone as dt_timezone
 import json
+import uuid
+from asgiref.sync import sync_to_async
 from .utils import decode_qr_token
-from .models import Event, User, Attendance, Penalty, Graup
-from django.db import transaction
+from .live import record_checkins, stream_event, streams_enabled
+from . import imports, sheets
+from .models import Event, User, Attendance, Penalty, Graup, ScanReceipt, ImportJob
+from .tasks import enqueue, run_import_job
+from django.db import transaction, IntegrityError
+from django.db.models import Q
 from django.contrib.auth.decorators import login_required, user_passes_test
 import pandas as pd
 from io import StringIO
@@ -16,17 +24,168 @@ from django.contrib.auth import get_user_model
 def is_scanner_or_admin(user):
     return user.is_authenticated and (user.role == 'scanner' or user.role == 'admin' or user.role == 'core')
 
+def is_admin(user):
+    return user.is_authenticated and user.role in ('admin', 'moderator', 'core')
+
+def _db_datetime(value):
+    """Normalise a raw datetime column (a string on SQLite) to an aware datetime."""
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    if value is not None and timezone.is_naive(value):
+        value = timezone.make_aware(value, dt_timezone.utc)
+    return value
+
+
+SCAN_LOOKUP_SQL = """
+    SELECT u.*, g.name AS group_name,
+           e.id AS scan_event_id, e.title AS scan_event_title,
+           e.start_time AS scan_event_start, e.end_time AS scan_event_end,
+           EXISTS (
+               SELECT 1 FROM {attendance} a
+               JOIN {event} o ON o.id = a.event_id
+               WHERE a.user_id = u.id AND a.event_id != e.id
+                 AND o.start_time <= e.end_time AND o.end_time >= e.start_time
+           ) AS has_overlap,
+           EXISTS (
+               SELECT 1 FROM {attendance} a
+               WHERE a.user_id = u.id AND a.event_id = e.id
+           ) AS already_checked
+    FROM {event} e
+    LEFT JOIN {user} u ON u.id = %s
+    LEFT JOIN {graup} g ON g.id = u.graup_id
+    WHERE e.id = %s
+"""
+
+
+def _load_scan_targets(event_id, user_id):
+    """
+    Resolve everything a scan needs in a single query: the event, the user
+    with its group name, and whether the user already has an attendance for
+    this event or for an overlapping one.
+    Returns (event, user); either may be None when the row does not exist.
+    """
+    sql = SCAN_LOOKUP_SQL.format(
+        attendance=Attendance._meta.db_table,
+        event=Event._meta.db_table,
+        user=User._meta.db_table,
+        graup=Graup._meta.db_table,
+    )
+    rows = list(User.objects.raw(sql, [user_id, event_id]))
+    if not rows:
+        return None, None
+
+    row = rows[0]
+    event = Event(id=row.scan_event_id, title=row.scan_event_title,
+                  start_time=_db_datetime(row.scan_event_start), end_time=_db_datetime(row.scan_event_end))
+    if row.id is None:
+        return event, None
+
+    # attach the joined group so user.graup never costs a lazy query
+    row.graup = Graup(id=row.graup_id, name=row.group_name) if row.graup_id else None
+    row.has_overlap = bool(row.has_overlap)
+    row.already_checked = bool(row.already_checked)
+    return event, row
+
+
+def _apply_scan(scanner, event, user, now):
+    """
+    Run the ban, time-window and overlap rules for one scan and record the
+    attendance. Returns (body, status) for the JSON response.
+    """
+    # check banned
+    if user.penalty_status == 'banned' or not user.is_active_member:
+        return {'ok': False, 'error': 'user_banned'}, 403
+
+    # Check event time window
+    if not (event.start_time <= now <= event.end_time):
+        return {'ok': False, 'error': 'outside_event_time', 'now': now.isoformat(), 'start': event.start_time.isoformat(), 'end': event.end_time.isoformat()}, 400
+
+    # Prevent overlapping events
+    if user.has_overlap:
+        # increment penalty count
+        user.penalty_level += 1
+        if user.penalty_level >= 2:
+            user.penalty_status = 'banned'
+            user.save()
+            Penalty.objects.create(user=user, reason='Auto-ban for multiple overlapping scans', admin=scanner)
+            return {'ok': False, 'error': 'banned_due_to_multiple_overlaps', 'penalty_level': user.penalty_level}, 403
+        else:
+            user.penalty_status = 'warned'
+            user.save()
+            Penalty.objects.create(user=user, reason=f'Warning: overlapping event scanned (count={user.penalty_level})', admin=scanner)
+            return {'ok': False, 'error': 'warning_overlapping_scan', 'penalty_level': user.penalty_level}, 400
+
+    if user.already_checked:
+        return {'ok': False, 'error': 'This user is aleady checked in'}, 400
+
+    # Create attendance record (unique) and its feed row together, so a
+    # failed feed write cannot leave a check-in the scanner was told failed
+    try:
+        with transaction.atomic():
+            attendance = Attendance.objects.create(event=event, user=user, scanner=scanner)
+            record_checkins([attendance])
+    except IntegrityError:
+        # another scanner won the race for the same badge
+        return {'ok': False, 'error': 'This user is aleady checked in'}, 400
+    except Exception as e:
+        return {'ok': False, 'error': 'db_error', 'details': str(e)}, 500
+
+    group_namething = user.graup.name if user.graup else 'Groupless'
+
+    return {'ok': True, 'message': 'checked_in', 'username': user.username, 'eventname': event.title, 'group': group_namething, 'user': user.id, 'event': event.id, 'checked_at': attendance.checked_at.isoformat()}, 200
+
+
+def _scan(scanner, event_id, user_id, now):
+    """Lookup plus rules for one decoded token. Returns (body, status)."""
+    event, user = _load_scan_targets(event_id, user_id)
+    if event is None:
+        return {'ok': False, 'error': 'no_event'}, 404
+    if user is None:
+        return {'ok': False, 'error': 'no_user'}, 404
+    return _apply_scan(scanner, event, user, now)
+
+
+def _scan_once(scanner, scan_id, event_id, user_id, now):
+    """
+    _scan under a client-chosen scan id. The result is stored as a
+    ScanReceipt in the same transaction as the scan, so retrying a scan
+    whose response was lost, live or through scan_replay_endpoint, gets
+    the stored result instead of scanning (and penalising) twice.
+    """
+    receipt = ScanReceipt.objects.filter(scan_id=scan_id).first()
+    if receipt is not None:
+        return receipt.response, receipt.status
+    try:
+        with transaction.atomic():
+            body, status = _scan(scanner, event_id, user_id, now)
+            if status != 500:  # nothing was written; let the client retry
+                ScanReceipt.objects.create(scan_id=scan_id, scanner=scanner, scanned_at=now, status=status, response=body)
+    except IntegrityError:
+        # the same id is being applied concurrently; its result wins
+        receipt = ScanReceipt.objects.filter(scan_id=scan_id).first()
+        if receipt is None:
+            return {'ok': False, 'error': 'replay_in_progress'}, 409
+        return receipt.response, receipt.status
+    return body, status
+
+
 @require_POST
 @login_required
 @user_passes_test(is_scanner_or_admin)
-def scan_endpoint(request):
+async def scan_endpoint(request):
     """
-    Expects JSON body: { "token": "<jwt token>" }
+    Expects JSON body: { "token": "<jwt token>", "id": "<uuid>" }
+    The optional id makes the scan idempotent (see _scan_once); the scanner
+    page reuses it if the scan has to be queued for replay.
     Only scanner-role or admin users can POST to this endpoint.
+    Async so a burst of scans doesn't pin one sync worker per request; the
+    lookup and write run in a single thread hop, since they must share one
+    connection and per-query hops would only add latency.
     """
     try:
         payload = json.loads(request.body)
         token = payload.get('token')
+        scan_id = uuid.UUID(str(payload['id'])) if payload.get('id') else None
     except Exception:
         return JsonResponse({'ok': False, 'error': 'bad_request'}, status=400)
 
@@ -34,197 +193,365 @@ def scan_endpoint(request):
     if err:
         return JsonResponse({'ok': False, 'error': 'token_' + err}, status=400)
 
-    event_id = data.get('event')
-    user_id = data.get('user')
-    now = timezone.now()
+    scanner = await request.auser()
+    if scan_id is None:
+        body, status = await sync_to_async(_scan)(scanner, data.get('event'), data.get('user'), timezone.now())
+    else:
+        body, status = await sync_to_async(_scan_once)(scanner, scan_id, data.get('event'), data.get('user'), timezone.now())
+    return JsonResponse(body, status=status)
 
-    try:
-        event = Event.objects.get(pk=event_id)
-        user = User.objects.get(pk=user_id)
-    except Event.DoesNotExist:
-        return JsonResponse({'ok': False, 'error': 'no_event'}, status=404)
-    except User.DoesNotExist:
-        return JsonResponse({'ok': False, 'error': 'no_user'}, status=404)
+MAX_BATCH_SCANS = 1000
 
-    # check banned
-    if user.penalty_status == 'banned' or not user.is_active_member:
-        return JsonResponse({'ok': False, 'error': 'user_banned'}, status=403)
 
-    # Check event time window
-    if not (event.start_time <= now <= event.end_time):
-        return JsonResponse({'ok': False, 'error': 'outside_event_time', 'now': now.isoformat(), 'start': event.start_time.isoformat(), 'end': event.end_time.isoformat()}, status=400)
+def _apply_scan_batch(scanner, scans, skew=timedelta(0)):
+    """
+    Set-based version of _apply_scan. `scans` is a list of
+    (event_id, user_id, at) tuples, applied in order so that scans later in
+    the batch see the effects of earlier ones. Everything is loaded with three
+    queries and written back with bulk operations in one transaction.
+    `skew` widens the event time window for client-reported timestamps.
+    Returns a list of (body, status), one per scan.
+    """
+    events = Event.objects.in_bulk({event_id for event_id, _, _ in scans})
+    users = User.objects.select_related('graup').in_bulk({user_id for _, user_id, _ in scans})
+
+    # Prior attendances that can matter: same event or overlapping any batch event
+    history = {}
+    if events and users:
+        prior = Attendance.objects.filter(
+            user_id__in=users,
+            event__start_time__lte=max(e.end_time for e in events.values()),
+            event__end_time__gte=min(e.start_time for e in events.values()),
+        ).values_list('user_id', 'event_id', 'event__start_time', 'event__end_time')
+        for user_id, event_id, start, end in prior:
+            history.setdefault(user_id, []).append((event_id, start, end))
+
+    results = []
+    new_attendances = []
+    new_penalties = []
+    penalised = {}
+
+    for event_id, user_id, at in scans:
+        event = events.get(event_id)
+        user = users.get(user_id)
+        if event is None:
+            results.append(({'ok': False, 'error': 'no_event'}, 404))
+            continue
+        if user is None:
+            results.append(({'ok': False, 'error': 'no_user'}, 404))
+            continue
 
-    # Prevent overlapping events
-    overlapping = Attendance.objects.filter(
-        user=user,
-        event__start_time__lte=event.end_time,
-        event__end_time__gte=event.start_time
-    ).exclude(event=event)
+        if user.penalty_status == 'banned' or not user.is_active_member:
+            results.append(({'ok': False, 'error': 'user_banned'}, 403))
+            continue
 
-    if overlapping.exists():
-        # increment penalty count
-        user.penalty_level += 1
-        if user.penalty_level >= 2:
-            user.penalty_status = 'banned'
-            user.save()
-            Penalty.objects.create(user=user, reason='Auto-ban for multiple overlapping scans', admin=request.user)
-            return JsonResponse({'ok': False, 'error': 'banned_due_to_multiple_overlaps', 'penalty_level': user.penalty_level}, status=403)
-        else:
-            user.penalty_status = 'warned'
-            user.save()
-            Penalty.objects.create(user=user, reason=f'Warning: overlapping event scanned (count={user.penalty_level})', admin=request.user)
-            return JsonResponse({'ok': False, 'error': 'warning_overlapping_scan', 'penalty_level': user.penalty_level}, status=400)
+        if not (event.start_time - skew <= at <= event.end_time + skew):
+            results.append(({'ok': False, 'error': 'outside_event_time', 'now': at.isoformat(), 'start': event.start_time.isoformat(), 'end': event.end_time.isoformat()}, 400))
+            continue
+
+        attended = history.get(user.id, [])
+        if any(eid != event.id and start <= event.end_time and end >= event.start_time for eid, start, end in attended):
+            user.penalty_level += 1
+            penalised[user.id] = user
+            if user.penalty_level >= 2:
+                user.penalty_status = 'banned'
+                new_penalties.append(Penalty(user=user, reason='Auto-ban for multiple overlapping scans', admin=scanner))
+                results.append(({'ok': False, 'error': 'banned_due_to_multiple_overlaps', 'penalty_level': user.penalty_level}, 403))
+            else:
+                user.penalty_status = 'warned'
+                new_penalties.append(Penalty(user=user, reason=f'Warning: overlapping event scanned (count={user.penalty_level})', admin=scanner))
+                results.append(({'ok': False, 'error': 'warning_overlapping_scan', 'penalty_level': user.penalty_level}, 400))
+            continue
+
+        if any(eid == event.id for eid, _, _ in attended):
+            results.append(({'ok': False, 'error': 'This user is aleady checked in'}, 400))
+            continue
+
+        attendance = Attendance(event=event, user=user, scanner=scanner)
+        new_attendances.append(attendance)
+        history.setdefault(user.id, []).append((event.id, event.start_time, event.end_time))
+        # body is filled in once the row exists and checked_at is known
+        results.append((attendance, 200))
 
-    # Create attendance record (unique)
     try:
         with transaction.atomic():
-            attendance, created = Attendance.objects.get_or_create(event=event, user=user, defaults={'scanner': request.user})
-            if not created:
-                return JsonResponse({'ok': False, 'error': 'This user is aleady checked in'}, status=400)
+            Attendance.objects.bulk_create(new_attendances, batch_size=500)
+            record_checkins(new_attendances)
+            Penalty.objects.bulk_create(new_penalties, batch_size=500)
+            User.objects.bulk_update(penalised.values(), ['penalty_level', 'penalty_status'], batch_size=500)
     except Exception as e:
-        return JsonResponse({'ok': False, 'error': 'db_error', 'details': str(e)}, status=500)
+        # nothing was written; the whole batch can be retried as-is
+        return [({'ok': False, 'error': 'db_error', 'details': str(e)}, 500) for _ in scans]
 
-    group_thing = user.graup
+    for i, (attendance, status) in enumerate(results):
+        if isinstance(attendance, Attendance):
+            user = attendance.user
+            results[i] = ({'ok': True, 'message': 'checked_in', 'username': user.username, 'eventname': attendance.event.title, 'group': user.graup.name if user.graup else 'Groupless', 'user': user.id, 'event': attendance.event.id, 'checked_at': attendance.checked_at.isoformat()}, status)
+    return results
 
-    if group_thing == None:
-        group_namething = 'Groupless'
-    else: 
-        group_namething = user.graup.name    
 
-    return JsonResponse({'ok': True, 'message': 'checked_in', 'username': user.username, 'eventname': event.title, 'group': group_namething, 'user': user.id, 'event': event.id, 'checked_at': attendance.checked_at.isoformat()})
+@require_POST
+@login_required
+@user_passes_test(is_scanner_or_admin)
+def scan_batch_endpoint(request):
+    """
+    Expects JSON body: { "tokens": ["<jwt token>", ...] }
+    Applies the scan_endpoint rules to every token, in order, and answers with
+    one result per token: { "ok": true, "results": [{ "status": 200, ...scan_endpoint body }] }
+    """
+    try:
+        payload = json.loads(request.body)
+        tokens = payload.get('tokens')
+    except Exception:
+        return JsonResponse({'ok': False, 'error': 'bad_request'}, status=400)
+    if not isinstance(tokens, list):
+        return JsonResponse({'ok': False, 'error': 'bad_request'}, status=400)
+    if len(tokens) > MAX_BATCH_SCANS:
+        return JsonResponse({'ok': False, 'error': 'too_many_tokens', 'max': MAX_BATCH_SCANS}, status=400)
+
+    now = timezone.now()
+    results = [None] * len(tokens)
+    scans = []
+    positions = []
+    for i, token in enumerate(tokens):
+        data, err = decode_qr_token(token)
+        if err:
+            results[i] = {'status': 400, 'ok': False, 'error': 'token_' + err}
+            continue
+        scans.append((data.get('event'), data.get('user'), now))
+        positions.append(i)
+
+    if scans:
+        for i, (body, status) in zip(positions, _apply_scan_batch(request.user, scans)):
+            results[i] = {'status': status, **body}
+
+    return JsonResponse({'ok': True, 'results': results})
+
+SCAN_CLOCK_SKEW = timedelta(minutes=2)
+SCAN_REPLAY_MAX_AGE = timedelta(days=1)
+
+
+@require_POST
+@login_required
+@user_passes_test(is_scanner_or_admin)
+def scan_replay_endpoint(request):
+    """
+    Idempotent replay of scans queued by an offline scanner.
+    Expects JSON body: { "scans": [{ "id": "<uuid>", "token": "<jwt token>", "scanned_at": "<iso datetime>" }] }
+    Each scan is judged at its client `scanned_at` (allowing SCAN_CLOCK_SKEW)
+    and its result is stored under its id, so replaying the same id again
+    returns the stored result instead of scanning twice.
+    """
+    try:
+        payload = json.loads(request.body)
+        items = payload.get('scans')
+        if not isinstance(items, list):
+            raise ValueError
+        scans = [(uuid.UUID(str(item['id'])), item.get('token'), parse_datetime(item.get('scanned_at') or '')) for item in items]
+    except Exception:
+        return JsonResponse({'ok': False, 'error': 'bad_request'}, status=400)
+    if len(scans) > MAX_BATCH_SCANS:
+        return JsonResponse({'ok': False, 'error': 'too_many_tokens', 'max': MAX_BATCH_SCANS}, status=400)
+
+    now = timezone.now()
+    done = {r.scan_id: {'status': r.status, **r.response} for r in ScanReceipt.objects.filter(scan_id__in=[scan_id for scan_id, _, _ in scans])}
+
+    fresh = {}
+    pending = []
+    for scan_id, token, scanned_at in scans:
+        if scan_id in done or scan_id in fresh:
+            continue
+        if scanned_at is None:
+            fresh[scan_id] = (now, {'ok': False, 'error': 'bad_timestamp'}, 400)
+            continue
+        if timezone.is_naive(scanned_at):
+            scanned_at = timezone.make_aware(scanned_at, dt_timezone.utc)
+        if scanned_at > now + SCAN_CLOCK_SKEW:
+            fresh[scan_id] = (scanned_at, {'ok': False, 'error': 'bad_timestamp'}, 400)
+            continue
+        if scanned_at < now - SCAN_REPLAY_MAX_AGE:
+            fresh[scan_id] = (scanned_at, {'ok': False, 'error': 'stale_scan'}, 400)
+            continue
+        data, err = decode_qr_token(token, at=min(scanned_at, now))
+        if err:
+            fresh[scan_id] = (scanned_at, {'ok': False, 'error': 'token_' + err}, 400)
+            continue
+        fresh[scan_id] = None
+        pending.append((scan_id, scanned_at, data))
+
+    try:
+        with transaction.atomic():
+            if pending:
+                applied = _apply_scan_batch(
+                    request.user,
+                    [(data.get('event'), data.get('user'), min(scanned_at, now)) for _, scanned_at, data in pending],
+                    skew=SCAN_CLOCK_SKEW,
+                )
+                if applied and applied[0][1] == 500:
+                    # nothing was written, so store nothing and let the client retry
+                    return JsonResponse({'ok': False, 'error': 'db_error', 'details': applied[0][0].get('details')}, status=500)
+                for (scan_id, scanned_at, _), (body, status) in zip(pending, applied):
+                    fresh[scan_id] = (scanned_at, body, status)
+
+            # a concurrent replay of the same ids makes this raise and roll back
+            ScanReceipt.objects.bulk_create([
+                ScanReceipt(scan_id=scan_id, scanner=request.user, scanned_at=scanned_at, status=status, response=body)
+                for scan_id, (scanned_at, body, status) in fresh.items()
+            ])
+    except IntegrityError:
+        return JsonResponse({'ok': False, 'error': 'replay_in_progress'}, status=409)
+
+    for scan_id, (_, body, status) in fresh.items():
+        done[scan_id] = {'status': status, **body}
+
+    return JsonResponse({'ok': True, 'results': [{'id': str(scan_id), **done[scan_id]} for scan_id, _, _ in scans]})
 
 @login_required
 @require_GET
-def check_status(request):
+async def check_status(request):
     event_id = request.GET.get('event_id')
     user_id = request.GET.get('user_id')
     try:
-        event = Event.objects.get(pk=event_id)
-        user = User.objects.get(pk=user_id)
+        user = await User.objects.only('penalty_status', 'is_active_member').aget(pk=user_id)
+        if not await Event.objects.filter(pk=event_id).aexists():
+            raise Event.DoesNotExist
     except Exception:
         return JsonResponse({'ok': False}, status=400)
-    checked = Attendance.objects.filter(event=event, user=user).exists()
+    checked = await Attendance.objects.filter(event_id=event_id, user_id=user_id).aexists()
     banned = user.penalty_status == 'banned' or not user.is_active_member
     return JsonResponse({'ok': True, 'checked_in': checked, 'banned': banned})
 
+@require_GET
+@login_required
+async def attendance_stream(request, event_id):
+    """
+    Server-sent events for one event: an `attendance` message with a small
+    delta for every check-in or undo. Members only receive their own.
+    Needs ASGI (mainframe/asgi.py): under WSGI every open stream would pin
+    a sync worker, so it answers 503 and pages fall back to polling.
+    """
+    if not streams_enabled(request):
+        return JsonResponse({'ok': False, 'error': 'streams_need_asgi'}, status=503)
+    user = await request.auser()
+    if not await Event.objects.filter(pk=event_id).aexists():
+        return JsonResponse({'ok': False, 'error': 'no_event'}, status=404)
+
+    since = request.headers.get('Last-Event-ID') or request.GET.get('since')
+    since = int(since) if since and since.isdigit() else None
+    only_user = None if user.role in ('scanner', 'moderator', 'admin', 'core') else user.id
+
+    response = StreamingHttpResponse(stream_event(event_id, since, only_user), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 User = get_user_model()
 
 
 @csrf_exempt
+@login_required
+@user_passes_test(is_admin)
 def parse_import(request):
-    import json
-    import pandas as pd
-    from io import StringIO
-    import requests
-
+    """
+    Stage the sheet server-side and return its import id, columns and a
+    short preview; finalize_import reads the rows from the staged file.
+    """
     if request.method != "POST":
         return JsonResponse({"success": False, "error": "Invalid method"}, status=400)
 
-    # FILE MODE
-    if "file" in request.FILES:
-        df = pd.read_excel(request.FILES["file"])
+    try:
+        # FILE MODE
+        if "file" in request.FILES:
+            import_id = imports.stage_upload(request.FILES["file"])
+
+        # URL MODE
+        else:
+            data = json.loads(request.body)
+            path, _ = sheets.fetch_sheet_csv(data.get("url"))
+            import_id = imports.stage_copy(path)
+
+        staged = imports.describe(import_id)
+    except Exception as e:
+        return JsonResponse({"success": False, "error": str(e)})
+
+    return JsonResponse({"success": True, "import_id": import_id, **staged})
+
+# a running import that has not committed a chunk for this long is presumed dead
+IMPORT_JOB_STALL = timedelta(minutes=5)
+
+def import_job_json(job):
+    return {
+        'success': True,
+        'id': job.id,
+        'status': job.status,
+        'total': job.total,
+        'processed': job.processed,
+        'created': job.created,
+        'updated': job.updated,
+        'skipped': job.skipped,
+        'duplicates': job.duplicates,
+        'errors': job.errors,
+        'conflicts': job.conflicts,
+        'error': job.error or None,
+    }
 
-    # URL MODE
-    else:
-        data = json.loads(request.body)
-        url = data.get("url")
-
-        try:
-            sheet_id = url.split("/d/")[1].split("/")[0]
-            csv_url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=csv"
-            text = requests.get(csv_url).text
-            df = pd.read_csv(StringIO(text))
-        except Exception as e:
-            return JsonResponse({"success": False, "error": str(e)})
-
-    # ✅ columns to help user create reference mapping
-    columns = list(df.columns)
-
-    # ✅ rows to use later in finalize
-    rows = df.to_dict(orient="records")
-
-    return JsonResponse({
-        "success": True,
-        "columns": columns,
-        "rows": rows
-    })
-    
 @csrf_exempt
+@login_required
+@user_passes_test(is_admin)
 def finalize_import(request):
-    import json
-    from .models import Graup
-    from django.contrib.auth import get_user_model
-    
-    User = get_user_model()
-
+    """Queue the staged import as an ImportJob; poll import_job_status for progress."""
     data = json.loads(request.body)
 
-    rows = data["rows"]
+    import_id = data["import_id"]
     mode = data["mode"]
     mapping = data["mapping"]
     role = data["role"]
 
-    default_penalty = 0
-    default_penalty2 = "ok"
-
-    count = 0
-
-    for row in rows:
-        display_name_val = ""
-
-        # --- MODE A: USERNAME ---
-        if mode == "username":
-            username = row.get(mapping["username"], "")
-            group_name = row.get(mapping["group"], "")
-            password = row.get(mapping.get("password"), None)
-            
-            # Requirement: Username with the first letter in Caps
-            if username:
-                display_name_val = username.strip().capitalize()
-
-        # --- MODE B: FIRSTNAME + LASTNAME ---
-        else:
-            firstname = row.get(mapping["firstname"], "")
-            lastname = row.get(mapping["lastname"], "")
-            group_name = row.get(mapping["group"], "")
-            password = row.get(mapping.get("password"), None)
-
-            # Generate username
-            username = f"{firstname}_{lastname}".lower().replace(" ", "")
-
-            # Requirement: Firstname Lastname (Both capitalized, space between)
-            # .title() ensures "john" becomes "John"
-            f_clean = str(firstname).strip().title()
-            l_clean = str(lastname).strip().title()
-            display_name_val = f"{f_clean} {l_clean}"
-
-        if not username:
-            continue
-
-        # --- CREATE OR GET GRAUP ---
-        graup_obj, _ = Graup.objects.update_or_create(
-            name=group_name,
-            defaults={"description": ""}
-        )
-
-        # --- CREATE/UPDATE USER ---
-        user, created = User.objects.update_or_create(
-            username=username,
-            defaults={
-                "role": role,
-                "graup": graup_obj,
-                "penalty_level": default_penalty,
-                "penalty_status": default_penalty2,
-                "displayname": display_name_val,  # <--- ADDED THIS
-            }
-        )
+    try:
+        total = imports.count_rows(import_id)
+    except imports.ImportNotFound:
+        return JsonResponse({"success": False, "error": "Import not found or expired, upload the file again"}, status=404)
 
-        # --- SET PASSWORD (raw) ---
-        if password:
-            user.set_password(password)
+    job = ImportJob.objects.create(import_id=import_id, mode=mode, mapping=mapping, role=role, total=total, requested_by=request.user)
+    enqueue(run_import_job, job.id)
+    job.refresh_from_db()
+    return JsonResponse(import_job_json(job), status=202)
 
-        count += 1
+@csrf_exempt
+@require_POST
+@login_required
+@user_passes_test(is_admin)
+def import_dry_run(request):
+    """What finalize_import would change for the same body, one page of the diff at a time."""
+    data = json.loads(request.body)
+    try:
+        page = int(data.get("page", 1))
+    except (TypeError, ValueError):
+        return JsonResponse({"success": False, "error": "page must be a number"}, status=400)
 
-    return JsonResponse({"success": True, "count": count})
+    try:
+        diff = imports.diff_import(data["import_id"], data["mode"], data["mapping"], data["role"], page=page)
+    except imports.ImportNotFound:
+        return JsonResponse({"success": False, "error": "Import not found or expired, upload the file again"}, status=404)
+    return JsonResponse({"success": True, **diff})
 
+@require_GET
+@login_required
+@user_passes_test(is_admin)
+def import_job_status(request, job_id):
+    job = ImportJob.objects.filter(pk=job_id).first()
+    if job is None:
+        return JsonResponse({'success': False, 'error': 'no_job'}, status=404)
+    return JsonResponse(import_job_json(job))
 
+@csrf_exempt
+@require_POST
+@login_required
+@user_passes_test(is_admin)
+def import_job_resume(request, job_id):
+    """Requeue a failed (or stalled) import; it continues after the last committed chunk."""
+    stalled = Q(status='running', updated_at__lt=timezone.now() - IMPORT_JOB_STALL)
+    if not ImportJob.objects.filter(Q(status='failed') | stalled, pk=job_id).update(status='queued', error='', finished_at=None):
+        return JsonResponse({'success': False, 'error': 'Only failed or stalled imports can be resumed'}, status=409)
+    enqueue(run_import_job, job_id)
+    return JsonResponse(import_job_json(ImportJob.objects.get(pk=job_id)), status=202)